@@ -0,0 +1,166 @@
+# coding: utf8
+"""
+Benchmark exports of large schemas, mappings and diffs to each output format.
+
+Data of each category is generated with a number of field paths (see synthetic module):
+- schema: collections of 100 field paths, nested in objects and arrays of objects
+- mapping: the mapping of the schema to SQL (see tosql module)
+- diff: the differences of the schema with a schema where all fields changed type
+Each format (each concrete subclass of export.BaseOutput) is written with transform_data_to_file
+for each category and size in a new python process, killed after --timeout seconds.
+The duration of the export, peak RSS of the process and RSS before export (once data is
+generated) are reported in json, with the size of the output file.
+
+Results can be stored with --output, and compared to a previous run with --baseline
+(see extraction benchmark).
+
+python benchmarks/export.py [--sizes 1000 100000 1000000] [--formats tsv md]
+                            [--categories schema diff] [--timeout 600]
+                            [--output results.json] [--baseline previous.json]
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing import TimeoutError, get_context
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.extraction import compare_to_baseline, package_version, peak_rss_mib  # noqa
+from benchmarks.synthetic import generate_diff, generate_schema  # noqa: E402
+from pymongo_schema.export import BaseOutput, transform_data_to_file  # noqa: E402
+
+CATEGORIES = ['schema', 'mapping', 'diff']
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def output_formats(start_class=BaseOutput):
+    """ List the formats of concrete subclasses of BaseOutput
+
+    :param start_class: class, default BaseOutput
+    :return formats: list of str
+    """
+    formats = []
+    for subclass in start_class.__subclasses__():
+        if isinstance(subclass.output_format, str):
+            formats.append(subclass.output_format)
+        formats += output_formats(subclass)
+    return sorted(formats)
+
+
+def generate_data(category, field_paths):
+    """ Generate data of a category with field_paths field paths
+
+    :param category: str - 'schema', 'mapping' or 'diff'
+    :param field_paths: int
+    :return data: dict or list
+    """
+    mongo_schema = generate_schema(field_paths)
+    if category == 'mapping':
+        from pymongo_schema.tosql import mongo_schema_to_mapping
+
+        return mongo_schema_to_mapping(mongo_schema)
+    if category == 'diff':
+        return generate_diff(mongo_schema)
+    return mongo_schema
+
+
+def benchmark_format(category, field_paths, output_format, output_dir):
+    """ Time the export of generated data to a format
+
+    Peak RSS only makes sense if the export runs in its own process (see benchmark_export).
+
+    :param category: str
+    :param field_paths: int
+    :param output_format: str
+    :param output_dir: str - directory of the output file
+    :return results: dict - {metric: value}
+    """
+    data = generate_data(category, field_paths)
+    results = {'setup_rss_mib': peak_rss_mib()}
+    output = os.path.join(output_dir, '{}_{}'.format(category, field_paths))
+    start_time = time.perf_counter()
+    transform_data_to_file(data, [output_format], output, category=category)
+    results.update(duration_s=round(time.perf_counter() - start_time, 4),
+                   peak_rss_mib=peak_rss_mib(),
+                   output_bytes=os.path.getsize(output + '.' + output_format))
+    return results
+
+
+def run_in_new_process(function, args, timeout=None):
+    """ Call function in a new python process, killed after timeout seconds
+
+    :raise multiprocessing.TimeoutError: if function does not return within timeout
+    """
+    pool = get_context('spawn').Pool(1)
+    try:
+        return pool.apply_async(function, args).get(timeout)
+    finally:
+        pool.terminate()
+
+
+def benchmark_export(sizes=None, formats=None, categories=None, timeout=600):
+    """ Benchmark each format, for each category and size, in a new python process
+
+    Exports lasting more than timeout seconds are reported as {'timeout_s': timeout}.
+
+    :param sizes: list of int, default None - numbers of field paths, default DEFAULT_SIZES
+    :param formats: list of str, default None - by default all formats, see output_formats
+    :param categories: list of str, default None - by default all CATEGORIES
+    :param timeout: float, default 600
+    :return results: dict - {'environment': dict,
+                             'scenarios': {category: {field_paths: {format: dict}}}}
+    """
+    results = {'environment': {'python': platform.python_version(),
+                               'implementation': platform.python_implementation(),
+                               'platform': platform.platform(),
+                               'pymongo_schema': package_version(),
+                               'timeout_s': timeout},
+               'scenarios': dict()}
+    output_dir = tempfile.mkdtemp()
+    try:
+        for category in categories or CATEGORIES:
+            category_results = results['scenarios'][category] = dict()
+            for field_paths in sizes or DEFAULT_SIZES:
+                size_results = category_results[str(field_paths)] = dict()
+                for output_format in formats or output_formats():
+                    try:
+                        size_results[output_format] = run_in_new_process(
+                            benchmark_format, (category, field_paths, output_format, output_dir),
+                            timeout)
+                    except TimeoutError:
+                        size_results[output_format] = {'timeout_s': timeout}
+    finally:
+        shutil.rmtree(output_dir)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='Numbers of field paths of data [default: 1000 100000 1000000]')
+    parser.add_argument('--formats', nargs='+', choices=output_formats(),
+                        help='Output formats [default: all]')
+    parser.add_argument('--categories', nargs='+', choices=CATEGORIES,
+                        help='Categories of data [default: all]')
+    parser.add_argument('--timeout', default=600, type=float,
+                        help='Maximum duration of each export, in seconds [default: 600]')
+    parser.add_argument('--output', help='Write results to this json file, besides stdout')
+    parser.add_argument('--baseline', help='Compare results to this previous json output')
+    args = parser.parse_args()
+
+    results = benchmark_export(args.sizes, args.formats, args.categories, args.timeout)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_to_baseline(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    json.dump(results, sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,271 @@
+# coding: utf8
+"""
+Benchmark schema extraction on synthetic collections (see synthetic module).
+
+Each case of CASES (engine and options of extract_collection_schema) runs on each scenario in
+a new python process, where documents are generated and BSON encoded in an in-process
+collection, then extracted. For each case, are reported:
+- documents by second and median wall time of extraction
+- peak RSS of the process, and RSS before extraction, in MiB
+- allocations by document: peak of traced bytes and net blocks retained, during the extraction
+  of a smaller collection of --trace-documents documents, traced with tracemalloc
+Conversions of the schema are timed too (recursive_default_to_regular_dict, post_process_schema).
+
+Results are printed as json, with the python and package versions: store them with --output,
+and compare a later run against them with --baseline, which adds ratios to baseline values.
+
+python benchmarks/extraction.py [--documents 20000] [--runs 3] [--scenarios flat nested]
+                                [--cases python rawbson] [--trace-documents 2000]
+                                [--output results.json] [--baseline previous.json]
+"""
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic import SCENARIOS, BenchmarkCollection, generate_documents  # noqa: E402
+from pymongo_schema.extract import (extract_collection_schema, init_empty_object_schema,  # noqa
+                                    object_schema_to_dict, post_process_schema,
+                                    recursive_default_to_regular_dict, scan_collection)
+
+# Options of extract_collection_schema
+CASES = {
+    'python': {'engine': 'python'},
+    'python_no_shape_cache': {'engine': 'python', 'shape_cache_size': 0},
+    'rawbson': {'engine': 'rawbson'},
+}
+
+# Metrics compared to baseline values
+RATIO_METRICS = ['docs_per_s', 'median_s', 'duration_s', 'peak_rss_mib', 'peak_bytes_per_doc',
+                 'retained_blocks_per_doc', 'recursive_default_to_regular_dict_s',
+                 'post_process_schema_s']
+
+# ru_maxrss is in bytes on macOS, and in KiB elsewhere
+RU_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# Minimum total duration of repeated schema conversions, to time them accurately
+MIN_CONVERSION_DURATION = 0.2
+
+
+def peak_rss_mib():
+    """ Get the peak resident set size of the current process, in MiB """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RU_MAXRSS_UNIT / 2. ** 20,
+                 1)
+
+
+def benchmark_case(scenario, case, documents=20000, runs=3, trace_documents=2000):
+    """ Benchmark an extraction case on a synthetic collection
+
+    Peak RSS only makes sense if the case runs in its own process (see benchmark_extraction).
+
+    :param scenario: str - key of SCENARIOS
+    :param case: str - key of CASES
+    :param documents: int, default 20000 - number of documents of the collection
+    :param runs: int, default 3 - number of timed extractions
+    :param trace_documents: int, default 2000
+        Number of documents of the collection whose extraction is traced, 0 to skip tracing
+    :return results: dict - {metric: value}
+    """
+    collection = BenchmarkCollection(generate_documents(documents, **SCENARIOS[scenario]),
+                                     name=scenario)
+    gc.collect()
+    results = {'bson_bytes_per_doc': round(
+        sum(len(batch) for batch in collection.raw_batches) / float(collection.count), 1),
+        'setup_rss_mib': peak_rss_mib()}
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        extract_collection_schema(collection, **CASES[case])
+        durations.append(time.perf_counter() - start_time)
+    durations.sort()
+    median = durations[len(durations) // 2]
+    results.update(docs_per_s=round(collection.count / median), median_s=round(median, 4),
+                   peak_rss_mib=peak_rss_mib())
+    if trace_documents:
+        collection = BenchmarkCollection(
+            generate_documents(trace_documents, **SCENARIOS[scenario]), name=scenario)
+        results.update(trace_allocations(collection, CASES[case]))
+    return results
+
+
+def benchmark_scenario_conversion(scenario, documents=20000):
+    """ Benchmark conversions of the schema of a synthetic collection, see benchmark_conversion
+
+    :param scenario: str - key of SCENARIOS
+    :param documents: int, default 20000 - number of documents of the collection
+    :return results: dict - {metric: value}
+    """
+    return benchmark_conversion(BenchmarkCollection(
+        generate_documents(documents, **SCENARIOS[scenario]), name=scenario))
+
+
+def trace_allocations(collection, extract_kwargs):
+    """ Trace memory allocations of an extraction
+
+    tracemalloc slows down extraction, thus traced extractions are not timed.
+
+    :param collection: BenchmarkCollection
+    :param extract_kwargs: dict - options of extract_collection_schema
+    :return allocations: dict - peak bytes and net blocks allocated by document
+    """
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    collection_schema = extract_collection_schema(collection, **extract_kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    allocations = {'peak_bytes_per_doc': round(peak / float(collection.count), 1),
+                   'retained_blocks_per_doc': round(
+                       (sys.getallocatedblocks() - blocks) / float(collection.count), 3)}
+    del collection_schema
+    return allocations
+
+
+def benchmark_conversion(collection):
+    """ Time conversions of the schema of a collection to regular dicts, and its post-processing
+
+    post_process_schema runs on a copy of the schema (without post-processing) made by
+    recursive_default_to_regular_dict.
+
+    :param collection: BenchmarkCollection
+    :return durations: dict - seconds by call, and number of fields of the schema
+    """
+    object_schema = init_empty_object_schema()
+    scan_collection(collection, object_schema)
+    collection_schema = {'count': collection.count, 'object': object_schema_to_dict(object_schema)}
+
+    copies = []
+    calls = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < MIN_CONVERSION_DURATION:
+        copies.append(recursive_default_to_regular_dict(collection_schema))
+        calls += 1
+    to_dict_duration = (time.perf_counter() - start_time) / calls
+
+    start_time = time.perf_counter()
+    for copy in copies:
+        post_process_schema(copy)
+    post_process_duration = (time.perf_counter() - start_time) / calls
+
+    return {'fields': count_fields(collection_schema['object']),
+            'recursive_default_to_regular_dict_s': round(to_dict_duration, 7),
+            'post_process_schema_s': round(post_process_duration, 7)}
+
+
+def count_fields(object_schema):
+    """ Count the fields of an object_schema, including nested ones """
+    return sum(1 + count_fields(field_schema.get('object', {}))
+               for field_schema in object_schema.values())
+
+
+def benchmark_extraction(scenarios=None, documents=20000, runs=3, cases=None,
+                         trace_documents=2000):
+    """ Benchmark each case of each scenario in a new python process
+
+    :param scenarios: list of str, default None - keys of SCENARIOS, by default all
+    :param documents: int, default 20000
+    :param runs: int, default 3
+    :param cases: list of str, default None - keys of CASES, by default all
+    :param trace_documents: int, default 2000
+    :return results: dict - {'environment': dict, 'scenarios': {scenario: {case: dict}}}
+    """
+    import bson
+
+    results = {'environment': {'python': platform.python_version(),
+                               'implementation': platform.python_implementation(),
+                               'platform': platform.platform(),
+                               'pymongo_schema': package_version(),
+                               'bson_c_extension': bson.has_c(),
+                               'documents': documents,
+                               'runs': runs,
+                               'trace_documents': trace_documents},
+               'scenarios': dict()}
+    for scenario in sorted(scenarios or SCENARIOS):
+        scenario_results = results['scenarios'][scenario] = dict()
+        for case in sorted(cases or CASES):
+            scenario_results[case] = run_in_new_process(benchmark_case, scenario, case,
+                                                        documents, runs, trace_documents)
+        scenario_results['conversion'] = run_in_new_process(benchmark_scenario_conversion,
+                                                            scenario, documents)
+    return results
+
+
+def run_in_new_process(function, *args):
+    """ Call function in a new python process, and return its result """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def package_version():
+    """ Get the installed version of pymongo_schema, if any """
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        return None
+    try:
+        return version('pymongo_schema')
+    except PackageNotFoundError:
+        return None
+
+
+def compare_to_baseline(results, baseline):
+    """ Add the ratio of each metric of RATIO_METRICS to its baseline value, as '<metric>_ratio'
+
+    A docs_per_s_ratio below 1, or a *_s_ratio above 1, is a slow down.
+
+    :param results: dict - output of benchmark_extraction (or export benchmark), modified in place
+    :param baseline: dict - previous output of the same benchmark
+    :return results: dict
+    """
+    def add_ratios(values, baseline_values):
+        for key, value in list(values.items()):
+            baseline_value = baseline_values.get(key)
+            if isinstance(value, dict) and isinstance(baseline_value, dict):
+                add_ratios(value, baseline_value)
+            elif key in RATIO_METRICS and baseline_value:
+                values[key + '_ratio'] = round(value / float(baseline_value), 3)
+
+    add_ratios(results['scenarios'], baseline.get('scenarios', {}))
+    results['baseline_environment'] = baseline.get('environment')
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', default=20000, type=int,
+                        help='Number of documents of each collection [default: 20000]')
+    parser.add_argument('--runs', default=3, type=int,
+                        help='Number of timed extractions by case [default: 3]')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        help='Shapes of collections [default: all]')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES),
+                        help='Extraction engines and options [default: all]')
+    parser.add_argument('--trace-documents', default=2000, type=int,
+                        help='Number of documents whose extraction is traced to count '
+                             'allocations, 0 to skip tracing [default: 2000]')
+    parser.add_argument('--output', help='Write results to this json file, besides stdout')
+    parser.add_argument('--baseline', help='Compare results to this previous json output')
+    args = parser.parse_args()
+
+    results = benchmark_extraction(args.scenarios, args.documents, args.runs, args.cases,
+                                   args.trace_documents)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_to_baseline(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    json.dump(results, sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,90 @@
+# coding: utf8
+"""
+Benchmark the startup time of pymongo_schema commands which do not need MongoDB.
+
+Each command runs several times in a new python process. The median and minimum wall times
+are reported as json, with the heavy dependencies loaded by the command, which should be none
+for light commands (compare, transform to json).
+
+python benchmarks/startup.py [--runs 10]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_DIR = os.path.join(ROOT_DIR, 'tests', 'resources', 'input')
+SCHEMA_FILE = os.path.join(INPUT_DIR, 'test_schema.json')
+OTHER_SCHEMA_FILE = os.path.join(INPUT_DIR, 'test_schema2.json')
+
+HEAVY_MODULES = ['pandas', 'yaml', 'jinja2', 'openpyxl', 'ete4', 'pymongo', 'bson']
+
+COMMANDS = {
+    'help': ['--help'],
+    'compare': ['compare', SCHEMA_FILE, OTHER_SCHEMA_FILE],
+    'transform': ['transform', SCHEMA_FILE],
+    'transform_md': ['transform', SCHEMA_FILE, '--formats', 'md'],
+    'tosql': ['tosql', SCHEMA_FILE],
+}
+
+# Run a command in a python process, then print the heavy modules it loaded on stderr
+RUN_COMMAND = """
+import json
+import sys
+from pymongo_schema.__main__ import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(m for m in {} if m in sys.modules)))
+""".format(HEAVY_MODULES)
+
+
+def run_command(argv, output):
+    """ Run pymongo_schema command in a new python process
+
+    :param argv: list of str - command line arguments
+    :param output: str - output file
+    :return duration, heavy_modules: float, list of str
+    """
+    if argv != ['--help']:
+        argv = ['--quiet'] + argv + ['--output', output]
+    start_time = time.time()
+    process = subprocess.run([sys.executable, '-c', RUN_COMMAND] + argv, cwd=ROOT_DIR,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    duration = time.time() - start_time
+    heavy_modules = json.loads(process.stderr.decode('utf-8').splitlines()[-1])
+    return duration, heavy_modules
+
+
+def benchmark_startup(runs=10):
+    """ Time each command of COMMANDS
+
+    :param runs: int, default 10 - number of runs of each command
+    :return results: dict - {command: {'median_s', 'min_s', 'heavy_modules'}}
+    """
+    results = dict()
+    output_dir = tempfile.mkdtemp()
+    for name, argv in sorted(COMMANDS.items()):
+        durations = []
+        for _ in range(runs):
+            duration, heavy_modules = run_command(argv, os.path.join(output_dir, name))
+            durations.append(duration)
+        durations.sort()
+        results[name] = {'median_s': round(durations[len(durations) // 2], 4),
+                         'min_s': round(durations[0], 4),
+                         'heavy_modules': heavy_modules}
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', default=10, type=int,
+                        help='Number of runs of each command [default: 10]')
+    args = parser.parse_args()
+    json.dump(benchmark_startup(args.runs), sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,228 @@
+# coding: utf8
+"""
+Generate synthetic collections for benchmarks, with controllable shape:
+
+- width: number of fields of each object
+- depth: nesting depth of sub-documents (1 for flat documents)
+- array_size: number of elements of arrays ('items' field), sub-documents if depth allows
+- polymorphism: probability that a field is missing or has another type than usual
+- map_keys: number of keys of a map-like object ('by_key' field), keyed by ids
+
+Documents are generated from a seed, so that benchmarks of distinct versions see the same data.
+
+Schemas (as extract module outputs them) and diffs (as compare module outputs them) are generated
+with a given number of field paths, to benchmark exports without extracting collections.
+"""
+import datetime
+import random
+import struct
+from itertools import islice
+
+import bson
+
+SCALAR_GENERATORS = [
+    lambda rng, i: i,
+    lambda rng, i: rng.random() * 1000,
+    lambda rng, i: 'value {}'.format(rng.randrange(1000)),
+    lambda rng, i: bool(i % 2),
+    lambda rng, i: datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=i),
+    lambda rng, i: bson.ObjectId(struct.pack('>4xQ', i)),
+    lambda rng, i: bson.Int64(i),
+]
+
+# Number of distinct keys map-like objects draw their keys from
+MAP_KEY_SPACE = 10 ** 6
+
+# Shapes of synthetic collections, as generate_documents arguments
+SCENARIOS = {
+    'flat': {'width': 20, 'depth': 1, 'array_size': 0},
+    'nested': {'width': 8, 'depth': 4, 'array_size': 0},
+    'arrays': {'width': 6, 'depth': 2, 'array_size': 20},
+    'polymorphic': {'width': 20, 'depth': 2, 'array_size': 3, 'polymorphism': 0.3},
+    'map_like': {'width': 6, 'depth': 1, 'array_size': 0, 'map_keys': 50},
+}
+
+
+def generate_documents(count, width=10, depth=2, array_size=3, polymorphism=0., map_keys=0,
+                       seed=0):
+    """ Generate synthetic documents, one at a time
+
+    :param count: int - number of documents
+    :param width: int, default 10
+    :param depth: int, default 2
+    :param array_size: int, default 3
+    :param polymorphism: float, default 0.
+    :param map_keys: int, default 0
+    :param seed: int, default 0
+    :return documents: iterator of dict
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        document = {'_id': bson.ObjectId(struct.pack('>4xQ', i))}
+        document.update(generate_object(rng, i, width, depth, array_size, polymorphism))
+        if map_keys:
+            document['by_key'] = {str(rng.randrange(MAP_KEY_SPACE)): rng.randrange(100)
+                                  for _ in range(map_keys)}
+        yield document
+
+
+def generate_object(rng, i, width, depth, array_size, polymorphism):
+    """ Generate an object of width fields, with sub-documents down to depth
+
+    Field 'f<n>' has the type SCALAR_GENERATORS[n % len(SCALAR_GENERATORS)], unless polymorphic.
+    If depth allows, field 'nested' is a sub-document, and elements of 'items' are sub-documents
+    of half width.
+
+    :return object: dict
+    """
+    value_object = dict()
+    for field_index in range(width):
+        generator_index = field_index
+        if polymorphism and rng.random() < polymorphism:
+            if rng.random() < 0.5:
+                continue
+            generator_index = rng.randrange(len(SCALAR_GENERATORS))
+        value_object['f{}'.format(field_index)] = SCALAR_GENERATORS[
+            generator_index % len(SCALAR_GENERATORS)](rng, i)
+    if depth > 1:
+        value_object['nested'] = generate_object(rng, i, width, depth - 1, array_size,
+                                                 polymorphism)
+    if array_size:
+        if depth > 1:
+            value_object['items'] = [generate_object(rng, i, max(1, width // 2), depth - 1, 0,
+                                                     polymorphism)
+                                     for _ in range(array_size)]
+        else:
+            value_object['items'] = [rng.randrange(100) for _ in range(array_size)]
+    return value_object
+
+
+# Types of fields of synthetic schemas
+SCHEMA_TYPES = ['integer', 'string', 'float', 'boolean', 'date', 'oid']
+
+
+def generate_schema(field_paths, paths_per_collection=100, collections_per_database=100,
+                    width=10, depth=3):
+    """ Generate a mongo schema, with field_paths fields in all
+
+    Every fifth field of objects not deeper than depth is an object (or an array of objects)
+    of up to width fields.
+
+    :param field_paths: int - number of fields, including nested ones
+    :param paths_per_collection: int, default 100
+    :param collections_per_database: int, default 100
+    :param width: int, default 10
+    :param depth: int, default 3
+    :return mongo_schema: dict
+    """
+    mongo_schema = dict()
+    collection_index = 0
+    while field_paths > 0:
+        database = 'db_{}'.format(collection_index // collections_per_database)
+        collection_paths = min(field_paths, paths_per_collection)
+        object_schema = {'_id': _generate_field_schema(1000, 'oid')}
+        _fill_object_schema(object_schema, collection_paths - 1, 1000, width, depth)
+        mongo_schema.setdefault(database, dict())['coll_{}'.format(collection_index)] = {
+            'count': 1000, 'object': object_schema}
+        field_paths -= collection_paths
+        collection_index += 1
+    return mongo_schema
+
+
+def _fill_object_schema(object_schema, field_paths, count, width, depth):
+    """ Add field_paths fields to an object_schema, see generate_schema
+
+    :return field_paths: int - number of fields added
+    """
+    added = 0
+    field_index = 0
+    while added < field_paths:
+        field = 'field_{}'.format(field_index)
+        field_count = count - field_index % 3
+        if depth > 1 and field_index % 5 == 4 and field_paths - added > 1:
+            field_schema = _generate_field_schema(
+                field_count, 'ARRAY' if field_index % 10 == 9 else 'OBJECT', count)
+            field_schema['object'] = dict()
+            added += 1 + _fill_object_schema(field_schema['object'],
+                                             min(width, field_paths - added - 1), field_count,
+                                             width, depth - 1)
+        else:
+            field_schema = _generate_field_schema(
+                field_count, SCHEMA_TYPES[field_index % len(SCHEMA_TYPES)], count)
+            added += 1
+        object_schema[field] = field_schema
+        field_index += 1
+    return added
+
+
+def _generate_field_schema(count, field_type, object_count=None):
+    """ Generate the schema of a field of a type, found in count objects """
+    field_schema = {'count': count, 'types_count': {field_type: count},
+                    'prop_in_object': round(count / float(object_count or count), 4)}
+    if field_type == 'ARRAY':
+        field_schema.update(type='ARRAY', array_type='OBJECT',
+                            array_types_count={'OBJECT': 2 * count})
+    else:
+        field_schema['type'] = field_type
+    return field_schema
+
+
+def generate_diff(mongo_schema):
+    """ Generate the diff of a mongo schema with a schema where all fields changed type
+
+    :param mongo_schema: dict
+    :return diff: list of dicts - as compare.compare_schemas_bases outputs it
+    """
+    diff = []
+
+    def add_object_diff(object_schema, hierarchy):
+        for field, field_schema in sorted(object_schema.items()):
+            field_hierarchy = '{}.{}'.format(hierarchy, field)
+            diff.append({'hierarchy': field_hierarchy,
+                         'prev_schema': {'type': field_schema['type']},
+                         'new_schema': {'type': 'string' if field_schema['type'] != 'string'
+                                        else 'integer'}})
+            if 'object' in field_schema:
+                add_object_diff(field_schema['object'], field_hierarchy)
+
+    for database, database_schema in sorted(mongo_schema.items()):
+        for collection, collection_schema in sorted(database_schema.items()):
+            add_object_diff(collection_schema['object'], '{}.{}'.format(database, collection))
+    return diff
+
+
+class BenchmarkCollection(object):
+    """ In-process stand-in for a pymongo collection, for the python and rawbson engines
+
+    Documents are BSON encoded once in batches, as MongoDB would send them:
+    find decodes them as a pymongo cursor would, and find_raw_batches returns them as is.
+    """
+
+    def __init__(self, documents, name='coll', batch_size=1000):
+        """
+        :param documents: iterable of dict
+        :param name: str, default 'coll'
+        :param batch_size: int, default 1000 - number of documents by batch
+        """
+        self.name = name
+        self.full_name = 'benchmark.{}'.format(name)
+        self.count = 0
+        self.raw_batches = []
+        documents = iter(documents)
+        while True:
+            batch = [bson.encode(document) for document in islice(documents, batch_size)]
+            if not batch:
+                break
+            self.count += len(batch)
+            self.raw_batches.append(b''.join(batch))
+
+    def estimated_document_count(self):
+        return self.count
+
+    def find(self, filter=None, projection=None, **kwargs):
+        for batch in self.raw_batches:
+            for document in bson.decode_all(batch):
+                yield document
+
+    def find_raw_batches(self, filter=None, **kwargs):
+        return iter(self.raw_batches)
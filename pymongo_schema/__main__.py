@@ -5,21 +5,22 @@
 CLI tool to use pymongo_schema modules.
 
 python -m pymongo_schema --help
+
+Modules needing pymongo or bson are only imported by the commands using them,
+so that commands on json files (transform, compare) start fast.
 """
 
 import json
 import logging
+import os
 import sys
 from argparse import ArgumentParser
+from functools import reduce
 from time import time
 
-import pymongo
-
 from pymongo_schema.compare import compare_schemas_bases
 from pymongo_schema.export import transform_data_to_file, HtmlOutput, TsvOutput
-from pymongo_schema.extract import extract_pymongo_client_schema
 from pymongo_schema.filter import filter_mongo_schema_namespaces
-from pymongo_schema.tosql import mongo_schema_to_mapping
 
 logger = logging.getLogger()
 
@@ -37,6 +38,105 @@ def add_subparser_extract(subparsers, parent_parsers):
     subparser.add_argument('--size', default=0, type=int,
                            help='Only analyze limited rows with random. By default analyze all '
                                 'rows in each collections')
+    subparser.add_argument('--sampling', nargs='+', default=['random'],
+                           metavar='[COLLECTION=]STRATEGY',
+                           help="Strategy to sample documents with --size or --convergence-size, "
+                                "among 'random' ($sample stage), 'stratified' (first documents of "
+                                "strata of --sampling-key range), 'reservoir' (random documents "
+                                "drawn while reading at most --reservoir-scan-size documents), "
+                                "'first' and 'last' (in --sampling-key order). "
+                                "Prefix a strategy with 'collection=' or 'database.collection=' "
+                                "to use it for this collection only. Only 'random' is available "
+                                "with aggregation and rawbson engines [default: random]")
+    subparser.add_argument('--sampling-key', default='_id',
+                           help="Indexed field ordering documents for 'stratified', 'first' and "
+                                "'last' sampling, or '$natural' for insertion order of 'first' "
+                                "and 'last' [default: _id]")
+    subparser.add_argument('--strata', default=10, type=int,
+                           help="Number of strata of 'stratified' sampling [default: 10]")
+    subparser.add_argument('--reservoir-scan-size', default=0, type=int,
+                           help="Maximum number of documents read by 'reservoir' sampling "
+                                "[default: 0, read all documents]")
+    subparser.add_argument('--convergence-size', default=0, type=int,
+                           help='Adaptive sampling: analyze random documents by batches of '
+                                'increasing size, and stop once this number of documents in a row '
+                                'brought no new field or type. --size then limits the number of '
+                                'analyzed documents. Only with python engine [default: 0, '
+                                'analyze all documents]')
+    subparser.add_argument('--workers', default=1, type=int,
+                           help='Number of processes extracting collections concurrently, each one '
+                                'with its own connection to MongoDB [default: 1]')
+    subparser.add_argument('--partitions', default=1, type=int,
+                           help='Split each collection into this number of _id ranges, scanned '
+                                'concurrently by workers. Ignored with --size [default: 1]')
+    subparser.add_argument('--engine', default='python',
+                           choices=['python', 'aggregation', 'rawbson'],
+                           help="'python' decodes and analyzes documents in python. "
+                                "'aggregation' makes MongoDB count fields types with aggregation "
+                                "pipelines, and only sends back counts. "
+                                "'rawbson' only reads types and field names in raw BSON "
+                                "documents, without decoding values [default: python]")
+    subparser.add_argument('--shape-cache-size', default=1024, type=int,
+                           help="Number of documents shapes (fields and types layouts) whose "
+                                "counters are cached by 'python' engine. 0 disables the cache "
+                                "[default: 1024]")
+    add_map_detection_arguments(subparser)
+    subparser.add_argument('--max-array-elements', default=0, type=int,
+                           help="Only examine this number of elements of longer arrays, "
+                                "extrapolating their types counts. Such arrays are counted in "
+                                "'sampled_arrays_count'. Only with python engine "
+                                "[default: 0, examine all elements]")
+    subparser.add_argument('--array-sampling', default='first', choices=['first', 'random'],
+                           help='Elements examined in long arrays [default: first]')
+    subparser.add_argument('--max-depth', default=0, type=int,
+                           help='Do not walk objects nested deeper than this depth (1 for '
+                                'fields of documents). Only with python engine '
+                                '[default: 0, walk all objects]')
+    subparser.add_argument('--value-stats', action='store_true',
+                           help="Collect statistics of the values of fields in the same pass: "
+                                "null and distinct counts, bounds and percentiles of numbers and "
+                                "strings lengths, in mergeable 'value_stats'. Disables the shape "
+                                "cache. Only with python engine")
+    subparser.add_argument('--top-values', default=0, type=int,
+                           help="Number of most frequent strings and integers of each field to "
+                                "keep in 'value_stats', with approximate counts. Memory is fixed "
+                                "by field. Implies --value-stats [default: 0]")
+    subparser.add_argument('--checkpoint-dir', default=None,
+                           help='Directory where the state of each collection scan is saved '
+                                'periodically, to resume it with --resume. Collections are then '
+                                "read in _id order. Only with python engine, without sampling "
+                                "[default: None]")
+    subparser.add_argument('--checkpoint-every', default=10 ** 5, type=int,
+                           help='Number of documents between two checkpoints [default: 100000]')
+    subparser.add_argument('--resume', action='store_true',
+                           help='Resume collection scans from their state in --checkpoint-dir')
+    subparser.add_argument('--retries', default=3, type=int,
+                           help='Number of times a checkpointed scan re-opens its cursor in a row '
+                                'after network errors, failovers or cursor timeouts [default: 3]')
+    subparser.add_argument('--incremental', default=None, metavar='PREVIOUS_SCHEMA',
+                           help='json schema file of a previous extraction with counts. Only '
+                                'documents whose --watermark-key is greater than the watermark '
+                                'recorded in it are scanned, and their counts are merged into it. '
+                                'The file may not exist yet, for the first extraction '
+                                '[default: None]')
+    subparser.add_argument('--watermark-key', default='_id',
+                           help='Indexed field growing with insertion time, used as watermark of '
+                                'incremental extractions. Fields of sub-documents are dotted, '
+                                'such as meta.updated_at [default: _id]')
+    subparser.add_argument('--batch-size', default=None,
+                           help="Number of documents per cursor batch, or 'auto' to fill "
+                                "16 MiB batches from the average size of documents "
+                                "[default: MongoDB default]")
+    subparser.add_argument('--no-cursor-timeout', action='store_true',
+                           help='Prevent MongoDB from closing idle cursors during long scans')
+    subparser.add_argument('--exhaust', action='store_true',
+                           help='Use exhaust cursors, so that MongoDB streams batches without '
+                                'waiting for getMore requests. Not available through mongos')
+    add_connection_arguments(subparser)
+
+
+def add_connection_arguments(subparser):
+    """CLI arguments to connect to MongoDB, see parse_client_kwargs"""
     subparser.add_argument('--port', default=27017, type=int,
                            help='Port to connect to MongoDB [default: 27017]')
     subparser.add_argument('--host', default='localhost',
@@ -45,6 +145,110 @@ def add_subparser_extract(subparsers, parent_parsers):
                            help='User to connect to MongoDB [default: None]')
     subparser.add_argument('--password', default=None,
                            help='Password to connect to MongoDB [default: None]')
+    subparser.add_argument('--uri', default=None,
+                           help='MongoDB connection string, overriding --host, --port, --user and '
+                                '--password [default: None]')
+    subparser.add_argument('--compressors', default=None,
+                           help="Comma separated list of wire compressors to negotiate with "
+                                "MongoDB, among 'zstd', 'snappy' and 'zlib'. 'zstd' and 'snappy' "
+                                "need zstandard and python-snappy packages [default: None]")
+    subparser.add_argument('--read-preference', default=None,
+                           choices=['primary', 'primaryPreferred', 'secondary',
+                                    'secondaryPreferred', 'nearest'],
+                           help='Replica set members to read documents from [default: primary]')
+
+
+def add_map_detection_arguments(subparser):
+    """CLI arguments of the detection of map-like objects"""
+    subparser.add_argument('--map-max-keys', default=1000, type=int,
+                           help="Objects with more fields are considered map-like (keyed by ids, "
+                                "dates, ...), and their fields are collapsed into a single '<key>' "
+                                "field. 0 disables the cap [default: 1000]")
+    subparser.add_argument('--map-min-keys', default=20, type=int,
+                           help="Objects with at least this number of fields, whose keys all "
+                                "match --map-key-pattern, are collapsed into a '<key>' field. "
+                                "0 disables the detection from keys [default: 20]")
+    subparser.add_argument('--map-key-pattern', default=None,
+                           help='Regular expression matching keys of map-like objects [default: '
+                                'numbers or ids with a short prefix, ObjectId, UUID and dates]')
+
+
+def add_subparser_extract_dump(subparsers, parent_parsers):
+    """CLI argument parser for dump module"""
+    subparser = subparsers.add_parser('extract-dump', parents=parent_parsers,
+                                      help='Extract schema from mongodump output, without MongoDB')
+    subparser.add_argument('dump',
+                           help='mongodump output directory (with .bson or .bson.gz files), '
+                                'or archive file (--archive, possibly with --gzip)')
+    subparser.add_argument('-d', '--databases', nargs='*',
+                           help="Only analyze those databases. By default analyze all databases "
+                                "but 'admin' and 'local'")
+    subparser.add_argument('-c', '--collections', nargs='*',
+                           help="Only analyze those collections. By default analyze all "
+                                "collections but 'system.*' in each database")
+    subparser.add_argument('--workers', default=1, type=int,
+                           help='Number of processes scanning chunks of .bson files concurrently. '
+                                'Archives are read by a single process [default: 1]')
+    subparser.add_argument('--chunk-size', default=64, type=int,
+                           help='Size in MiB of the chunks .bson files are split into, to be '
+                                'scanned concurrently [default: 64]')
+    add_map_detection_arguments(subparser)
+
+
+def add_subparser_extract_json(subparsers, parent_parsers):
+    """CLI argument parser for json_lines module"""
+    subparser = subparsers.add_parser('extract-json', parents=parent_parsers,
+                                      help='Extract schema from JSON Lines files, such as '
+                                           'mongoexport output, without MongoDB')
+    subparser.add_argument('files', nargs='+',
+                           help='JSON Lines files of Extended JSON documents, one file by '
+                                'collection named after the file, possibly compressed with '
+                                'gzip (.gz) or zstandard (.zst, needs zstandard package)')
+    subparser.add_argument('--database', default=None,
+                           help='Database of the collections. By default, the name of the '
+                                'directory of each file')
+    subparser.add_argument('--workers', default=1, type=int,
+                           help='Number of processes parsing ranges of files concurrently. '
+                                'Compressed files are parsed by a single process [default: 1]')
+    subparser.add_argument('--chunk-size', default=64, type=int,
+                           help='Size in MiB of the ranges uncompressed files are split into, to '
+                                'be parsed concurrently [default: 64]')
+    subparser.add_argument('--shape-cache-size', default=1024, type=int,
+                           help='Number of documents shapes whose counters are cached by range. '
+                                '0 disables the cache [default: 1024]')
+    add_map_detection_arguments(subparser)
+
+
+def add_subparser_watch(subparsers, parent_parsers):
+    """CLI argument parser for watch module"""
+    subparser = subparsers.add_parser('watch', parents=parent_parsers,
+                                      help='Keep the schema of documents written to MongoDB up '
+                                           'to date from a change stream')
+    subparser.add_argument('-d', '--database', default=None,
+                           help='Only watch this database. By default watch all databases')
+    subparser.add_argument('-c', '--collection', default=None,
+                           help='Only watch this collection of --database')
+    subparser.add_argument('--flush-interval', default=10., type=float,
+                           help='Seconds between two writes of the schema to --output '
+                                '[default: 10]')
+    subparser.add_argument('--max-events', default=0, type=int,
+                           help='Stop after this number of change events [default: 0, watch '
+                                'until interrupted]')
+    subparser.add_argument('--initial-schema', default=None,
+                           help='json schema file with counts to start from, such as a previous '
+                                'extraction [default: None]')
+    subparser.add_argument('--full-document', default='updateLookup',
+                           choices=['updateLookup', 'default'],
+                           help="'updateLookup' adds the current version of updated documents. "
+                                "'default' ignores updates [default: updateLookup]")
+    subparser.add_argument('--replay', default=None,
+                           help='Replay change events from this file (one extended json event '
+                                'per line) rather than watching MongoDB, e.g. to benchmark '
+                                '[default: None]')
+    subparser.add_argument('--shape-cache-size', default=1024, type=int,
+                           help='Number of documents shapes whose counters are cached by '
+                                'collection. 0 disables the cache [default: 1024]')
+    add_connection_arguments(subparser)
 
 
 def add_subparser_transform(subparsers, parent_parsers):
@@ -83,6 +287,15 @@ def add_subparser_compare(subparsers, parent_parsers):
     subparser.add_argument('--detailed_diff', action='store_true')
 
 
+def add_subparser_merge(subparsers, parent_parsers):
+    """CLI argument parser for merge module"""
+    subparser = subparsers.add_parser('merge', parents=parent_parsers,
+                                      help='Merge schemas extracted from distinct documents, '
+                                           'summing their counts')
+    subparser.add_argument('inputs', nargs='+',
+                           help='json schema files to merge (extracted with counts)')
+
+
 def main(argv=None):
     """ Launch pymongo_schema (assuming CLI).
 
@@ -107,6 +320,9 @@ def main(argv=None):
                                    PROP_IN_OBJECT
                                    PERCENTAGE
                                    TYPES_COUNT
+                                   MIN, MAX, LENGTH_MIN, LENGTH_MAX, NULL_COUNT, DISTINCT_COUNT
+                                       (from value_stats, extracted with --value-stats)
+                                   TOP_VALUES (extracted with --top-values)
                                Columns have to be separated by whitespace, and are case insensitive.
                                Default for 'html' and 'md' output is {}
                                Default for 'tsv' and 'xlsx' output is {}'''.format(
@@ -126,8 +342,14 @@ def main(argv=None):
     add_subparser_transform(subparsers, [parent_parser])
     add_subparser_tosql(subparsers, [parent_parser])
     add_subparser_compare(subparsers, [parent_parser])
+    add_subparser_merge(subparsers, [parent_parser])
+    add_subparser_watch(subparsers, [parent_parser])
+    add_subparser_extract_dump(subparsers, [parent_parser])
+    add_subparser_extract_json(subparsers, [parent_parser])
 
     args = parser.parse_args(argv)
+    if args.command == 'watch' and args.collection and not args.database:
+        parser.error('watch: --collection needs --database')
 
     # Parse command line argument
     preprocess_args(args)
@@ -150,6 +372,22 @@ def main(argv=None):
         output_dict = compare_schemas(args)
         args.category = 'diff'
 
+    # Merge schemas
+    if args.command == 'merge':
+        output_dict = merge_schemas_files(args)
+
+    # Extract mongo schema from mongodump output
+    if args.command == 'extract-dump':
+        output_dict = extract_schema_from_dump(args)
+
+    # Extract mongo schema from JSON Lines files
+    if args.command == 'extract-json':
+        output_dict = extract_schema_from_json_lines(args)
+
+    # Watch change streams
+    if args.command == 'watch':
+        output_dict = watch_schema_changes(args)
+
     # Output dict
     logger.info('=== Write output')
     if output_dict:
@@ -176,22 +414,199 @@ def initialize_logger(args):
 
 def extract_schema(args):
     """ Main entry point function to extract schema."""
+    import pymongo
+    from pymongo_schema.extract import extract_pymongo_client_schema
+
     start_time = time()
     logger.info('=== Start MongoDB schema analysis')
-    if args.password:
-        client = pymongo.MongoClient(host=args.host, port=args.port, username=args.user, password=args.password)
-    else:
-        client = pymongo.MongoClient(host=args.host, port=args.port)
-    
-    mongo_schema = extract_pymongo_client_schema(client,
-                                                 database_names=args.databases,
-                                                 collection_names=args.collections,
-                                                 sample_size=args.size)
+    client_kwargs = parse_client_kwargs(args)
+    client = pymongo.MongoClient(**client_kwargs)
+    sampling, collections_sampling = parse_sampling(args.sampling)
+
+    extract_kwargs = dict()
+    extract_function = extract_pymongo_client_schema
+    if args.incremental:
+        from pymongo_schema.incremental import extract_pymongo_client_schema_incremental
+
+        extract_function = extract_pymongo_client_schema_incremental
+        extract_kwargs['watermark_key'] = args.watermark_key
+        extract_kwargs['previous_schema'] = None
+        if os.path.isfile(args.incremental):
+            with open(args.incremental, 'r') as f:
+                extract_kwargs['previous_schema'] = json.load(f)
+    if args.map_key_pattern:
+        extract_kwargs['map_key_pattern'] = args.map_key_pattern
+
+    mongo_schema = extract_function(client,
+                                    database_names=args.databases,
+                                    collection_names=args.collections,
+                                    sample_size=args.size,
+                                    workers=args.workers,
+                                    partitions=args.partitions,
+                                    engine=args.engine,
+                                    shape_cache_size=args.shape_cache_size,
+                                    convergence_size=args.convergence_size,
+                                    sampling=sampling,
+                                    collections_sampling=collections_sampling,
+                                    sampling_options={
+                                        'key': args.sampling_key,
+                                        'strata': args.strata,
+                                        'scan_size': args.reservoir_scan_size},
+                                    cursor_options=parse_cursor_options(args),
+                                    checkpoint_dir=args.checkpoint_dir,
+                                    checkpoint_every=args.checkpoint_every,
+                                    resume=args.resume,
+                                    retries=args.retries,
+                                    map_max_keys=args.map_max_keys,
+                                    map_min_keys=args.map_min_keys,
+                                    max_array_elements=args.max_array_elements,
+                                    array_sampling=args.array_sampling,
+                                    max_depth=args.max_depth,
+                                    value_stats=args.value_stats,
+                                    top_values=args.top_values,
+                                    client_kwargs=client_kwargs,
+                                    **extract_kwargs)
 
     logger.info('--- MongoDB schema analysis took %.2f s', time() - start_time)
     return mongo_schema
 
 
+def extract_schema_from_dump(args):
+    """ Main entry point function to extract schema from mongodump output."""
+    from pymongo_schema.dump import extract_dump_schema
+
+    start_time = time()
+    logger.info('=== Start schema analysis of mongodump output %s', args.dump)
+    map_kwargs = dict()
+    if args.map_key_pattern:
+        map_kwargs['map_key_pattern'] = args.map_key_pattern
+    mongo_schema = extract_dump_schema(args.dump,
+                                       database_names=args.databases,
+                                       collection_names=args.collections,
+                                       workers=args.workers,
+                                       chunk_size=args.chunk_size * 1024 * 1024,
+                                       map_max_keys=args.map_max_keys,
+                                       map_min_keys=args.map_min_keys,
+                                       **map_kwargs)
+    logger.info('--- Schema analysis of mongodump output took %.2f s', time() - start_time)
+    return mongo_schema
+
+
+def extract_schema_from_json_lines(args):
+    """ Main entry point function to extract schema from JSON Lines files."""
+    from pymongo_schema.json_lines import extract_json_lines_schema
+
+    start_time = time()
+    logger.info('=== Start schema analysis of JSON Lines files')
+    map_kwargs = dict()
+    if args.map_key_pattern:
+        map_kwargs['map_key_pattern'] = args.map_key_pattern
+    mongo_schema = extract_json_lines_schema(args.files,
+                                             database_name=args.database,
+                                             workers=args.workers,
+                                             chunk_size=args.chunk_size * 1024 * 1024,
+                                             shape_cache_size=args.shape_cache_size,
+                                             map_max_keys=args.map_max_keys,
+                                             map_min_keys=args.map_min_keys,
+                                             **map_kwargs)
+    logger.info('--- Schema analysis of JSON Lines files took %.2f s', time() - start_time)
+    return mongo_schema
+
+
+def watch_schema_changes(args):
+    """ Main entry point function to watch schema changes."""
+    from bson import json_util
+    from pymongo_schema.watch import watch_schema
+
+    logger.info('=== Watch MongoDB schema changes')
+    mongo_schema = None
+    if args.initial_schema:
+        with open(args.initial_schema, 'r') as f:
+            mongo_schema = json.load(f)
+
+    if args.output:
+        flush = lambda schema: transform_data_to_file(schema, **vars(args))
+    else:
+        flush = None
+
+    if args.replay:
+        with open(args.replay, 'r') as f:
+            change_events = (json_util.loads(line) for line in f if line.strip())
+            return watch_schema(change_events, flush, mongo_schema, args.flush_interval,
+                                args.max_events, args.shape_cache_size)
+
+    import pymongo
+
+    watched = pymongo.MongoClient(**parse_client_kwargs(args))
+    if args.database:
+        watched = watched[args.database]
+        if args.collection:
+            watched = watched[args.collection]
+    change_stream = watched.watch(full_document=args.full_document)
+    return watch_schema(change_stream, flush, mongo_schema, args.flush_interval,
+                        args.max_events, args.shape_cache_size)
+
+
+def parse_client_kwargs(args):
+    """ Build the arguments of MongoClient from connection and wire options
+
+    :param args: argparse.Namespace
+    :return client_kwargs: dict
+    """
+    if args.uri:
+        client_kwargs = {'host': args.uri}
+    else:
+        client_kwargs = {'host': args.host, 'port': args.port}
+        if args.password:
+            client_kwargs.update(username=args.user, password=args.password)
+    if args.compressors:
+        client_kwargs['compressors'] = args.compressors
+    if args.read_preference:
+        client_kwargs['readPreference'] = args.read_preference
+    return client_kwargs
+
+
+def parse_cursor_options(args):
+    """ Build the options of cursors reading documents
+
+    :param args: argparse.Namespace
+    :return cursor_options: dict - see extract.scan_collection
+    """
+    import pymongo
+
+    cursor_options = dict()
+    if args.batch_size:
+        cursor_options['batch_size'] = ('auto' if args.batch_size == 'auto'
+                                        else int(args.batch_size))
+    if args.no_cursor_timeout:
+        cursor_options['no_cursor_timeout'] = True
+    if args.exhaust:
+        cursor_options['cursor_type'] = pymongo.CursorType.EXHAUST
+    return cursor_options
+
+
+def parse_sampling(sampling_args):
+    """ Parse --sampling arguments into default and collections sampling strategies
+
+    :param sampling_args: list of str - 'strategy' or 'collection=strategy'
+    :return sampling, collections_sampling: str, dict
+    """
+    from pymongo_schema.sampling import SAMPLING_STRATEGIES
+
+    sampling = 'random'
+    collections_sampling = dict()
+    for sampling_arg in sampling_args:
+        collection, _, strategy = sampling_arg.rpartition('=')
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError("Sampling strategy should be one of {}, not {}".format(
+                ', '.join(sorted(SAMPLING_STRATEGIES)), strategy))
+        if collection:
+            collections_sampling[collection] = strategy
+        else:
+            sampling = strategy
+    return sampling, collections_sampling
+
+
 def transform_schema(args):
     """ Main entry point function to transform a schema."""
     logger.info('=== Transform existing mongo schema (filter, new format, and/or select infos)')
@@ -207,6 +622,8 @@ def transform_schema(args):
 
 def schema_to_sql(args):
     """ Main entry point function to generate a mapping from mongo to sql."""
+    from pymongo_schema.tosql import mongo_schema_to_mapping
+
     logger.info('=== Generate mapping from mongo to sql')
     input_schema = load_input_schema(args)
     mongo_to_sql_mapping = mongo_schema_to_mapping(input_schema)
@@ -222,6 +639,18 @@ def compare_schemas(args):
     return diff
 
 
+def merge_schemas_files(args):
+    """ Main entry point function to merge schemas."""
+    from pymongo_schema.merge import merge_schemas
+
+    logger.info('=== Merge schemas')
+    input_schemas = []
+    for filename in args.inputs:
+        with open(filename, 'r') as f:
+            input_schemas.append(json.load(f))
+    return reduce(merge_schemas, input_schemas)
+
+
 def load_input_schema(args, opt='input'):
     """Load schema from file or stdin."""
     filename = getattr(args, opt)
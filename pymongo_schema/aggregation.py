@@ -0,0 +1,190 @@
+# coding: utf8
+"""
+This module intends to extract object schemas with aggregation pipelines, run by MongoDB.
+
+Rather than sending every document over the wire to be decoded and analyzed in python,
+MongoDB groups the fields of objects by name and BSON type, and only sends back counts.
+
+One pipeline is run for each depth of the schema:
+- first for the documents of the collection,
+- then for all nested object fields of the previous depth at once, with a $facet stage.
+  Objects of each field are reached from the documents by going down the path and unwinding
+  arrays, as the python engine does.
+
+Documents are thus read once by depth of the schema, rather than once by nested object field,
+but each sub-pipeline of the $facet still goes over all of them: the work of MongoDB grows with
+the number of nested object fields, so that this engine is best suited to shallow collections.
+The result of each pipeline is a single document, limited to 16 MB: the counts of fields by type
+of all objects of a depth must fit in it.
+
+Map-like objects are collapsed into a MAP_KEY field as with the python engine (see
+extract.ObjectStats), before their values are analyzed in a single sub-pipeline.
+Other differences with the python engine:
+- DBRef are stored as objects in MongoDB, and thus typed 'OBJECT' rather than 'dbref'
+
+With a sample_size, _id of sampled documents are fetched first, then matched by the pipeline of
+each depth, so that nested objects are counted in the same documents as their parents.
+"""
+import logging
+
+from pymongo_schema.mongo_sql_types import get_bson_type_alias_string
+
+logger = logging.getLogger(__name__)
+
+
+def extract_object_schema_with_pipelines(pymongo_collection, sample_size=0, query=None,
+                                         settings=None):
+    """ Extract the object schema of a collection with aggregation pipelines
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int, default 0
+        Only analyze a random sample of documents. By default analyze all documents.
+        Sampled _id are sent back in pipelines, thus samples are bounded by the 16 MB limit of
+        commands (about 500 000 ObjectId).
+    :param query: dict, default None
+        Only analyze documents matching this query
+    :param settings: extract.ExtractionSettings, default None
+        Settings of the detection of map-like objects. By default, extract.DEFAULT_SETTINGS.
+    :return count, object_schema: int, dict
+        number of analyzed documents, and object_schema (not post-processed)
+    """
+    documents_stages = []
+    if query:
+        documents_stages.append({'$match': query})
+    if sample_size:
+        ids_pipeline = documents_stages + [{'$sample': {'size': sample_size}},
+                                           {'$project': {'_id': 1}}]
+        sampled_ids = [document['_id'] for document in
+                       pymongo_collection.aggregate(ids_pipeline, allowDiskUse=True)]
+        documents_stages = [{'$match': {'_id': {'$in': sampled_ids}}}]
+    documents_stages.append({'$project': {'_v': '$$ROOT'}})
+
+    return extract_objects_schema(pymongo_collection, documents_stages, settings)
+
+
+def extract_objects_schema(pymongo_collection, documents_stages, settings=None):
+    """ Extract the schema of documents, then of their nested objects depth after depth
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param documents_stages: list - aggregation stages producing one document per document to
+        analyze, with the document in '_v' field
+    :param settings: extract.ExtractionSettings, default None - see collapse_map_like_object
+    :return count, object_schema: int, dict
+    """
+    count = 0
+    document_schema = {'object': dict()}
+    # Nested objects of a depth, as (path, field_schema the object schema belongs to)
+    objects = [((), document_schema)]
+    while objects:
+        logger.info('   aggregate fields of objects %s',
+                    ', '.join('.'.join(path) for path, _ in objects) or '(documents)')
+        facets = dict()
+        for i, (path, _) in enumerate(objects):
+            objects_stages = [stage for field in path for stage in nested_objects_stages(field)]
+            facets.update(objects_profile_facets(objects_stages, 'o{}'.format(i)))
+        facet_result = next(pymongo_collection.aggregate(documents_stages + [{'$facet': facets}],
+                                                         allowDiskUse=True))
+
+        nested_objects = []
+        for i, (path, field_schema) in enumerate(objects):
+            objects_count, object_schema = facet_result_to_object_schema(
+                {key: facet_result['o{}_{}'.format(i, key)]
+                 for key in ['count', 'types', 'array_types']})
+            if not path:
+                count = objects_count
+            field_schema['object'] = object_schema = collapse_map_like_object(object_schema,
+                                                                              settings)
+            for field, nested_field_schema in sorted(object_schema.items()):
+                if 'OBJECT' in nested_field_schema['types_count'] or \
+                        'OBJECT' in nested_field_schema.get('array_types_count', {}):
+                    nested_objects.append((path + (field,), nested_field_schema))
+        objects = nested_objects
+
+    return count, document_schema['object']
+
+
+def collapse_map_like_object(object_schema, settings=None):
+    """ Collapse the fields of a map-like object into a MAP_KEY field, as the python engine does
+
+    :param object_schema: dict - counts of fields, without nested objects
+    :param settings: extract.ExtractionSettings, default None
+        Settings of the detection of map-like objects. By default, extract.DEFAULT_SETTINGS.
+    :return object_schema: dict
+    """
+    # extract module imports this one, thus is imported only when used
+    from pymongo_schema.extract import (add_object_schema_to_object_schema,
+                                        init_empty_object_schema, object_schema_to_dict)
+
+    object_stats = init_empty_object_schema(settings)
+    add_object_schema_to_object_schema(object_schema, object_stats)
+    return object_schema_to_dict(object_stats)
+
+
+def objects_profile_facets(objects_stages, name):
+    """ Sub-pipelines of a $facet stage counting the objects produced by objects_stages,
+    and fields of objects by name and type (in arrays or not)
+
+    :param objects_stages: list - stages producing one document per object, with the object in
+        '_v' field
+    :param name: str - prefix of the names of sub-pipelines
+    :return facets: dict - {name_count, name_types, name_array_types: sub-pipeline}
+    """
+    fields_stages = objects_stages + [{'$project': {'_kv': {'$objectToArray': '$_v'}}},
+                                      {'$unwind': '$_kv'}]
+    group_stage = {'$group': {'_id': {'k': '$_kv.k', 't': {'$type': '$_kv.v'}},
+                              'count': {'$sum': 1}}}
+    return {
+        name + '_count': objects_stages + [{'$count': 'count'}],
+        name + '_types': fields_stages + [group_stage],
+        name + '_array_types': fields_stages + [
+            {'$match': {'$expr': {'$isArray': '$_kv.v'}}},
+            {'$unwind': {'path': '$_kv.v', 'preserveNullAndEmptyArrays': True}},
+            group_stage]
+    }
+
+
+def nested_objects_stages(field):
+    """ Stages going from objects in '_v' to the objects in their field, or in arrays in this field
+
+    Objects in all fields are reached from a MAP_KEY field, which collapses them.
+
+    :param field: str
+    :return stages: list
+    """
+    from pymongo_schema.extract import MAP_KEY
+
+    is_object = {'$expr': {'$eq': [{'$type': '$_v'}, 'object']}}
+    stages = [{'$project': {'_v': {'$objectToArray': '$_v'}}},
+              {'$unwind': '$_v'}]
+    if field != MAP_KEY:
+        stages.append({'$match': {'_v.k': field}})
+    return stages + [{'$project': {'_v': '$_v.v'}},
+                     {'$unwind': '$_v'},
+                     {'$match': is_object}]
+
+
+def facet_result_to_object_schema(facet_result):
+    """ Create an object schema from the results of sub-pipelines of objects_profile_facets
+
+    :param facet_result: dict - {'count', 'types', 'array_types': result of sub-pipeline}
+    :return count, object_schema: int, dict
+    """
+    object_schema = dict()
+    for group in facet_result['types']:
+        field_schema = object_schema.setdefault(group['_id']['k'],
+                                                {'count': 0, 'types_count': dict()})
+        field_schema['count'] += group['count']
+        _add_type_count(field_schema['types_count'], group)
+
+    for group in facet_result['array_types']:
+        field_schema = object_schema[group['_id']['k']]
+        _add_type_count(field_schema.setdefault('array_types_count', dict()), group)
+
+    count = facet_result['count'][0]['count'] if facet_result['count'] else 0
+    return count, object_schema
+
+
+def _add_type_count(types_count, group):
+    """ Add the count of a $group result to types_count, several BSON types having the same type"""
+    type_string = get_bson_type_alias_string(group['_id']['t'])
+    types_count[type_string] = types_count.get(type_string, 0) + group['count']
@@ -0,0 +1,112 @@
+# coding: utf8
+"""
+This module intends to make long scans of collections resumable.
+
+Checkpointed scans read documents in _id order. The partial object_schema is periodically
+saved to a state file, together with the number of scanned documents and the last _id.
+A scan resumed from a state file only reads documents with a greater _id.
+
+Retriable cursor errors (network errors, failovers, cursor timeouts) do not abort the scan:
+the cursor is re-opened after the last scanned _id.
+
+Range queries on _id only match values of the same BSON type as their bound,
+thus resuming is only exact for collections whose _id are all of the same type.
+"""
+import json
+import logging
+import os
+import time
+
+from bson import json_util
+from pymongo.errors import AutoReconnect, CursorNotFound
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the cursor is re-opened after the last scanned _id
+RETRIABLE_ERRORS = (AutoReconnect, CursorNotFound)
+
+
+def checkpoint_path(checkpoint_dir, pymongo_collection):
+    """ Path of the state file of a collection
+
+    :param checkpoint_dir: str
+    :param pymongo_collection: pymongo.collection.Collection
+    :return path: str
+    """
+    return os.path.join(checkpoint_dir, '{}.json'.format(pymongo_collection.full_name))
+
+
+def save_checkpoint(path, state):
+    """ Write a scan state to a file, atomically so that a crash keeps the previous state
+
+    :param path: str
+    :param state: dict
+        'namespace': str, 'query': dict, 'scanned': int, 'last_id', 'complete': bool,
+        'object': object_schema as regular dicts, not post-processed
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json_util.dumps(state))
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, namespace, query=None):
+    """ Read the scan state of a collection, if any
+
+    :param path: str
+    :param namespace: str - 'database.collection'
+    :param query: dict, default None
+    :return state: dict or None if there is no state file
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        state = json_util.loads(f.read())
+    if state['namespace'] != namespace or state['query'] != (query or {}):
+        raise ValueError("Checkpoint {} was saved by a scan of {} with query {}, cannot resume "
+                         "it for {} with query {}".format(path, state['namespace'],
+                                                          json.dumps(state['query']), namespace,
+                                                          json.dumps(query or {})))
+    return state
+
+
+def find_by_id(pymongo_collection, query=None, last_id=None, cursor_options=None, retries=3,
+               retry_delay=1.):
+    """ Iterate over documents in _id order, re-opening the cursor on retriable errors
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param query: dict, default None
+    :param last_id: default None
+        Only read documents with a greater _id. By default, read all documents.
+    :param cursor_options: dict, default None
+        Options of pymongo Collection.find
+    :param retries: int, default 3
+        Number of times the cursor is re-opened in a row without reading any new document,
+        before raising the error
+    :param retry_delay: float, default 1.
+        Seconds to wait before re-opening the cursor, multiplied by the number of failed attempts
+    :return documents: iterator of dict
+    """
+    failures = 0
+    while True:
+        id_query = query or {}
+        if last_id is not None:
+            id_condition = {'_id': {'$gt': last_id}}
+            id_query = {'$and': [id_query, id_condition]} if id_query else id_condition
+        try:
+            for document in pymongo_collection.find(id_query, **(cursor_options or {})).sort(
+                    '_id', 1):
+                failures = 0
+                last_id = document['_id']
+                yield document
+            return
+        except RETRIABLE_ERRORS as e:
+            failures += 1
+            if failures > retries:
+                raise
+            logger.warning('Scan of collection %s failed (%s), resume it after _id %s',
+                           pymongo_collection.name, e, last_id)
+            time.sleep(retry_delay * failures)
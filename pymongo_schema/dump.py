@@ -0,0 +1,280 @@
+# coding: utf8
+"""
+This module intends to extract schemas from mongodump output, without any MongoDB server.
+
+Two layouts of mongodump output are read:
+- directories of <database>/<collection>.bson files, or .bson.gz files with --gzip
+- archive files written with --archive, possibly gzipped with --gzip
+
+Documents are walked in raw BSON, without decoding values (see rawbson module).
+Uncompressed .bson files are memory-mapped, and split into chunks of whole documents,
+found by following documents length prefixes, so that large files are scanned in parallel.
+Compressed files and archives are read as streams.
+
+The schema is the one extract_pymongo_client_schema builds, with the number of dumped documents
+as 'count' of collections.
+"""
+import gzip
+import logging
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from urllib.parse import unquote
+
+import bson
+from past.builtins import basestring
+
+from pymongo_schema.extract import (DEFAULT_MAP_KEY_PATTERN, ExtractionSettings,
+                                    add_object_schema_to_object_schema, init_empty_object_schema,
+                                    object_schema_to_dict)
+from pymongo_schema.rawbson import add_bson_documents_to_object_schema
+
+logger = logging.getLogger(__name__)
+
+_UNPACK_INT = struct.Struct('<i').unpack_from
+
+# Size of chunks of .bson files scanned by workers
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Size of reads from compressed files
+READ_SIZE = 1024 * 1024
+
+# First bytes of mongodump archives, and int32 ending blocks of documents in archives
+ARCHIVE_MAGIC_NUMBER = 0x8199e26d
+ARCHIVE_TERMINATOR = -1
+
+GZIP_MAGIC_NUMBER = b'\x1f\x8b'
+
+
+def extract_dump_schema(dump_path, database_names=None, collection_names=None, workers=1,
+                        chunk_size=DEFAULT_CHUNK_SIZE, map_max_keys=1000, map_min_keys=20,
+                        map_key_pattern=DEFAULT_MAP_KEY_PATTERN):
+    """ Extract the schema of collections dumped by mongodump
+
+    :param dump_path: str - mongodump output directory, or archive file
+    :param database_names: str, list of str, default None
+        By default, all databases but 'admin' and 'local'
+    :param collection_names: str, list of str, default None
+        Will be used for every database. By default, all collections but 'system.*'
+    :param workers: int, default 1
+        Number of processes scanning chunks of files concurrently, for directories
+    :param chunk_size: int, default DEFAULT_CHUNK_SIZE
+        Size in bytes of the chunks .bson files are split into
+    :param map_max_keys: int, default 1000
+    :param map_min_keys: int, default 20
+    :param map_key_pattern: str, default DEFAULT_MAP_KEY_PATTERN
+        Detection of map-like objects, see extract.ExtractionSettings
+    :return mongo_schema: dict
+    """
+    if isinstance(database_names, basestring):
+        database_names = [database_names]
+    if isinstance(collection_names, basestring):
+        collection_names = [collection_names]
+    settings = ExtractionSettings(map_max_keys, map_min_keys, map_key_pattern)
+
+    def is_selected(database, collection):
+        if database_names is None and database in ('admin', 'local'):
+            return False
+        if collection_names is None and collection.startswith('system.'):
+            return False
+        return ((database_names is None or database in database_names) and
+                (collection_names is None or collection in collection_names))
+
+    if os.path.isdir(dump_path):
+        scans = []
+        for database, collection, path in list_dump_files(dump_path):
+            if is_selected(database, collection):
+                scans += [(database, collection, path, start, end)
+                          for start, end in split_dump_file(path, chunk_size)]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_scan_dump_chunk, scans, repeat(settings)))
+        else:
+            results = map(_scan_dump_chunk, scans, repeat(settings))
+        namespaces_schemas = dict()
+        for (database, collection, _, _, _), (scanned, object_schema) in zip(scans, results):
+            namespace_schema = namespaces_schemas.setdefault(
+                (database, collection), [0, init_empty_object_schema(settings)])
+            namespace_schema[0] += scanned
+            add_object_schema_to_object_schema(object_schema, namespace_schema[1])
+    else:
+        if workers > 1:
+            logger.info('Archive %s is read by a single process', dump_path)
+        namespaces_schemas = scan_dump_archive(dump_path, is_selected, settings)
+
+    mongo_schema = dict()
+    for (database, collection), (count, object_schema) in sorted(namespaces_schemas.items()):
+        mongo_schema.setdefault(database, dict())[collection] = {
+            'count': count,
+            'object': object_schema_to_dict(object_schema, count)
+        }
+    return mongo_schema
+
+
+def list_dump_files(dump_dir):
+    """ List the .bson and .bson.gz files of a mongodump output directory
+
+    :param dump_dir: str
+    :return dump_files: list of (database, collection, path) tuples
+    """
+    dump_files = []
+    for database in sorted(os.listdir(dump_dir)):
+        database_dir = os.path.join(dump_dir, database)
+        if not os.path.isdir(database_dir):  # such as oplog.bson
+            continue
+        for file_name in sorted(os.listdir(database_dir)):
+            for extension in ['.bson', '.bson.gz']:
+                if file_name.endswith(extension):
+                    # mongodump escapes characters such as '/' or '%' in file names
+                    collection = unquote(file_name[:-len(extension)])
+                    dump_files.append((database, collection,
+                                       os.path.join(database_dir, file_name)))
+    return dump_files
+
+
+def split_dump_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Split a .bson file into chunks of whole documents of about chunk_size bytes
+
+    Compressed files cannot be split: they are a single chunk, whose end is None.
+
+    :param path: str
+    :param chunk_size: int, default DEFAULT_CHUNK_SIZE
+    :return chunks: list of (start, end) tuples - positions of chunks in file
+    """
+    size = os.path.getsize(path)
+    if path.endswith('.gz'):
+        return [(0, None)]
+    if size <= chunk_size:
+        return [(0, size)]
+    chunks = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = position = 0
+        while position < size:
+            position += _UNPACK_INT(data, position)[0]
+            if position - start >= chunk_size or position >= size:
+                chunks.append((start, position))
+                start = position
+    return chunks
+
+
+def _scan_dump_chunk(scan, settings):
+    """ Add the documents of a chunk of a dump file to an object_schema, possibly in a worker
+
+    :param scan: (database, collection, path, start, end) tuple
+    :param settings: extract.ExtractionSettings
+    :return scanned, object_schema: int, dict - object_schema as regular dicts
+    """
+    database, collection, path, start, end = scan
+    logger.info('...collection %s.%s, bytes %s to %s', database, collection, start,
+                end if end is not None else 'end')
+    object_schema = init_empty_object_schema(settings)
+    scanned = 0
+    if end is None:
+        with gzip.open(path, 'rb') as stream:
+            scanned = add_bson_stream_to_object_schema(stream, object_schema)
+    elif end > start:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            scanned = add_bson_documents_to_object_schema(data, object_schema, start, end)
+    return scanned, object_schema_to_dict(object_schema)
+
+
+def add_bson_stream_to_object_schema(stream, object_schema, read_size=READ_SIZE):
+    """ Add the concatenated BSON documents of a stream to an object_schema
+
+    :param stream: file-like object
+    :param object_schema: dict
+    :param read_size: int, default READ_SIZE
+    :return count: int - number of documents added
+    """
+    count = 0
+    buffer = bytearray()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        buffer += data
+        end = _whole_documents_end(buffer)
+        count += add_bson_documents_to_object_schema(buffer, object_schema, 0, end)
+        del buffer[:end]
+    if buffer:
+        raise ValueError('Truncated BSON document at the end of {}'.format(stream))
+    return count
+
+
+def _whole_documents_end(data):
+    """ Get the position after the last whole document of concatenated BSON documents"""
+    position = 0
+    while position + 4 <= len(data):
+        document_end = position + _UNPACK_INT(data, position)[0]
+        if document_end > len(data):
+            break
+        position = document_end
+    return position
+
+
+def scan_dump_archive(path, is_selected=None, settings=None):
+    """ Add the documents of a mongodump archive to object schemas of their namespace
+
+    An archive starts with a magic number and a prelude (a header and collections metadata),
+    then interleaves blocks of documents of each collection. Each block starts with a namespace
+    header document and ends with a terminator.
+
+    :param path: str - archive file, possibly gzipped
+    :param is_selected: function, default None
+        Called with database and collection names: documents of other collections are skipped
+    :param settings: extract.ExtractionSettings, default None - settings of object schemas
+    :return namespaces_schemas: dict - {(database, collection): [count, object_schema]}
+    """
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == GZIP_MAGIC_NUMBER
+    with (gzip.open(path, 'rb') if gzipped else open(path, 'rb')) as stream:
+        if struct.unpack('<I', stream.read(4))[0] != ARCHIVE_MAGIC_NUMBER:
+            raise ValueError('{} is not a mongodump archive'.format(path))
+
+        # Prelude: header, then collections metadata, up to a terminator
+        while _read_archive_document(stream) is not None:
+            pass
+
+        namespaces_schemas = dict()
+        while True:
+            header = _read_archive_document(stream, eof_allowed=True)
+            if header is None:
+                break
+            header = bson.decode(header)
+            namespace = (header['db'], header['collection'])
+            selected = is_selected is None or is_selected(*namespace)
+            if selected and namespace not in namespaces_schemas:
+                logger.info('...collection %s.%s', *namespace)
+                namespaces_schemas[namespace] = [0, init_empty_object_schema(settings)]
+            while True:
+                document = _read_archive_document(stream)
+                if document is None:
+                    break
+                if selected:
+                    namespace_schema = namespaces_schemas[namespace]
+                    namespace_schema[0] += add_bson_documents_to_object_schema(
+                        document, namespace_schema[1])
+    return namespaces_schemas
+
+
+def _read_archive_document(stream, eof_allowed=False):
+    """ Read a BSON document from an archive stream
+
+    :param stream: file-like object
+    :param eof_allowed: bool, default False - whether the stream may end before the document
+    :return document: bytes, or None for a terminator (or the end of stream, if allowed)
+    """
+    size_bytes = stream.read(4)
+    if not size_bytes and eof_allowed:
+        return None
+    if len(size_bytes) < 4:
+        raise ValueError('Truncated mongodump archive')
+    size = _UNPACK_INT(size_bytes)[0]
+    if size == ARCHIVE_TERMINATOR:
+        return None
+    document = size_bytes + stream.read(size - 4)
+    if len(document) < size:
+        raise ValueError('Truncated mongodump archive')
+    return document
@@ -20,29 +20,30 @@ They intend to preprocess data as this is common to each group of output.
 They use OutputPreProcessing class to deal with this preprocessing.
 This class is a factory that will allow to use the right preprocessing methods
 depending on the category treated (schema, mapping, ...).
+Table like outputs iterate over lines generated from data: only xlsx builds a pandas dataframe,
+so that tsv, md and html outputs of large schemas are written without holding them twice.
 
 Then those base classes are used (inherited from) to define each format:
 JsonOutput, YamlOutput, TsvOutput, HtmlOutput, MdOutput, XlsxOutput
+
+Dependencies of a single format or of dataframes (pandas, yaml, jinja2, openpyxl, bson) are only
+imported when used, so that light commands start fast.
 """
 import abc
 import codecs
 import csv
+import html
 import json
 import logging
 import os
 import re
 import sys
+from collections import OrderedDict
 from contextlib import contextmanager
 from functools import partial
 from numbers import Number
 
-import yaml
-import jinja2
-from bson import json_util
-from future.moves.collections import OrderedDict
 from past.builtins import basestring
-import pandas as pd
-from openpyxl import load_workbook
 
 logger = logging.getLogger(__name__)
 
@@ -122,7 +123,7 @@ class OutputPreProcessing(object):
     Abstract methods to override:
     property category: string - specifies what category the child is managing (schema, mapping, ...)
     property default_columns: list - name of columns to display in table like outputs
-    convert_to_dataframe: convert data into a dataframe - used for list outputs
+    iterate_lines: iterate over lines of data - used for list outputs
 
     Public method that should be overridden:
     columns_values_makers: dict - indicate how to extract data for each columns
@@ -133,9 +134,14 @@ class OutputPreProcessing(object):
     Public methods that should not be overridden:
     regularize_column_name: reformat column name to fill columns_values_makers format
     make_column_value: use columns_values_makers to extract column data
+    header: names of columns of lines
+    convert_to_dataframe: convert data into a dataframe of lines - used for xlsx output
     """
     __metaclass__ = abc.ABCMeta
 
+    # Names of the first columns of lines, which group them in tables
+    group_columns = ['Database', 'Collection']
+
     @property
     @abc.abstractmethod
     def category(self):
@@ -172,10 +178,24 @@ class OutputPreProcessing(object):
 
     @classmethod
     @abc.abstractmethod
-    def convert_to_dataframe(cls, data, **kwargs):
-        """Create a dataframe from data"""
+    def iterate_lines(cls, data, columns_to_get=None):
+        """Iterate over lines of data: lists of group_columns values, then columns_to_get values"""
         return
 
+    @classmethod
+    def header(cls, columns_to_get=None):
+        """List names of columns of lines"""
+        return cls.group_columns + (columns_to_get or cls.default_columns)
+
+    @classmethod
+    def convert_to_dataframe(cls, data, columns_to_get=None, **kwargs):
+        """Create a dataframe from lines of data"""
+        import pandas as pd
+
+        columns_to_get = columns_to_get or cls.default_columns
+        return pd.DataFrame(list(cls.iterate_lines(data, columns_to_get)),
+                            columns=cls.header(columns_to_get))
+
     @classmethod
     def filter_data(cls, data):
         """Basic method just return data - can be overridden to filter (return json)"""
@@ -196,6 +216,7 @@ class _MappingPreProcessing(OutputPreProcessing):
     """Preprocess 'mapping' data from to_sql module"""
     category = 'mapping'
     default_columns = ['Field_name', 'Description', 'Type']
+    group_columns = ['Database', 'Table']
 
     @classmethod
     def columns_values_makers(cls):
@@ -207,16 +228,13 @@ class _MappingPreProcessing(OutputPreProcessing):
         }
 
     @classmethod
-    def convert_to_dataframe(cls, data, columns_to_get=None, **kwargs):
-        """Transform data (mapping dict) into a dataframe."""
+    def iterate_lines(cls, data, columns_to_get=None):
+        """Iterate over lines of data (mapping dict), table by table."""
         columns_to_get = columns_to_get or cls.default_columns
-        lines = []
         for db in sorted(data):
             for table in sorted(data[db]):
-                lines += cls._table_dict_to_lines(db, table, data[db][table], columns_to_get)
-
-        header = ['Database', 'Table'] + columns_to_get
-        return pd.DataFrame(lines, columns=header)
+                for line in cls._table_dict_to_lines(db, table, data[db][table], columns_to_get):
+                    yield line
 
     @classmethod
     def _table_dict_to_lines(cls, db_name, table_name, table_dict, columns_to_get):
@@ -245,22 +263,18 @@ class _DiffPreProcessing(OutputPreProcessing):
         }
 
     @classmethod
-    def convert_to_dataframe(cls, data, columns_to_get=None, **kwargs):
-        """Transform data (list of dicts) into a dataframe."""
+    def iterate_lines(cls, data, columns_to_get=None):
+        """Iterate over lines of data (list of dicts), in the order of data."""
         columns_to_get = columns_to_get or cls.default_columns
 
-        table = []
         for d in data:
             hierarchy = d['hierarchy'].split('.')
             db = hierarchy.pop(0)
             coll = hierarchy.pop(0) if hierarchy else ''
 
-            table.append([db, coll] +
-                         [cls.make_column_value(col_name, d, hierarchy)
-                          for col_name in columns_to_get])
-
-        header = ['Database', 'Collection'] + columns_to_get
-        return pd.DataFrame(table, columns=header)
+            yield ([db, coll] +
+                   [cls.make_column_value(col_name, d, hierarchy)
+                    for col_name in columns_to_get])
 
 
 class _SchemaPreProcessing(OutputPreProcessing):
@@ -271,7 +285,7 @@ class _SchemaPreProcessing(OutputPreProcessing):
     @classmethod
     def columns_values_makers(cls):
         """How to extract columns data based on field schema, name and prefix."""
-        return {  # 'f' for field
+        makers = {  # 'f' for field
             'field_full_name': lambda f_schema, f, f_prefix: f_prefix + f,
             'field_compact_name': cls._field_compact_name,
             'field_name': lambda f_schema, f, f_prefix: f,
@@ -282,6 +296,30 @@ class _SchemaPreProcessing(OutputPreProcessing):
             'types_count': lambda f_schema, f, f_prefix: cls._format_types_count(
                 f_schema.get('types_count', None), f_schema.get('array_types_count', None)),
         }
+        for stat in ['min', 'max', 'length_min', 'length_max', 'null_count', 'distinct_count']:
+            makers[stat] = cls._value_stat_getter(stat)
+        makers['top_values'] = lambda f_schema, f, f_prefix: cls._format_top_values(
+            f_schema.get('value_stats', {}).get('top_values'))
+        return makers
+
+    @staticmethod
+    def _format_top_values(top_values):
+        """ Format top values with their counts
+
+        >>> _SchemaPreProcessing._format_top_values([['a', 3], [1, 2]])
+        'a : 3, 1 : 2'
+
+        :param top_values: list of [value, count], or None
+        :return str or None
+        """
+        if top_values is None:
+            return None
+        return ', '.join('{} : {}'.format(value, count) for value, count in top_values)
+
+    @staticmethod
+    def _value_stat_getter(stat):
+        """Column value maker of a statistic from 'value_stats' of fields"""
+        return lambda f_schema, f, f_prefix: f_schema.get('value_stats', {}).get(stat)
 
     @classmethod
     def filter_data(cls, data):
@@ -293,32 +331,39 @@ class _SchemaPreProcessing(OutputPreProcessing):
         if isinstance(data, dict):
             schema_filtered = dict()
             for k, v in data.items():
-                if k not in ['count', 'types_count', 'prop_in_object', 'array_types_count']:
+                if k not in ['count', 'types_count', 'prop_in_object', 'array_types_count',
+                             'analyzed_count', 'sampled_arrays_count', 'sketches']:
                     schema_filtered[k] = cls.filter_data(v)
             return schema_filtered
         return data
 
     @classmethod
-    def convert_to_dataframe(cls, data, columns_to_get=None, **kwargs):
+    def iterate_lines(cls, data, columns_to_get=None):
         """
-        Load schema (data) into dataframe, filtering on columns_to_get (column names list).
+        Iterate over lines of schema (data), filtering on columns_to_get (column names list).
         """
         columns_to_get = columns_to_get or cls.default_columns
-        line_tuples = list()
         for database, database_schema in sorted(list(data.items())):
             for collection, collection_schema in sorted(list(database_schema.items())):
-                collection_line_tuples = cls._object_schema_to_line_tuples(
-                    collection_schema['object'], columns_to_get, field_prefix='')
-                for line in collection_line_tuples:
-                    line_tuples.append([database, collection] + list(line))
-
-        header = tuple(['Database', 'Collection'] + columns_to_get)
-        return pd.DataFrame(line_tuples, columns=header)
+                for line in cls._iterate_object_schema_line_tuples(
+                        collection_schema['object'], columns_to_get, field_prefix=''):
+                    yield [database, collection] + list(line)
 
     @classmethod
     def _object_schema_to_line_tuples(cls, object_schema, columns_to_get, field_prefix):
         """ Get the list of tuples describing lines in object_schema
 
+        See _iterate_object_schema_line_tuples
+
+        :return line_tuples: list of tuples describing lines
+        """
+        return list(cls._iterate_object_schema_line_tuples(object_schema, columns_to_get,
+                                                           field_prefix))
+
+    @classmethod
+    def _iterate_object_schema_line_tuples(cls, object_schema, columns_to_get, field_prefix):
+        """ Iterate over tuples describing lines in object_schema
+
         - Sort fields by count
         - Add the tuples describing each field in object
         - Recursively add tuples for nested objects
@@ -330,16 +375,13 @@ class _SchemaPreProcessing(OutputPreProcessing):
             allows to create full name.
             '.' is the separator for object subfields
             ':' is the separator for list of objects subfields
-        :return line_tuples: list of tuples describing lines
+        :return line_tuples: iterator of tuples describing lines
         """
-        line_tuples = []
         sorted_fields = sorted(list(object_schema.items()),
                                key=lambda x: (-x[1]['count'], x[0]) if 'count' in x[1] else x[0])
 
         for field, field_schema in sorted_fields:
-            line_columns = cls._field_schema_to_columns(
-                field, field_schema, field_prefix, columns_to_get)
-            line_tuples.append(line_columns)
+            yield cls._field_schema_to_columns(field, field_schema, field_prefix, columns_to_get)
 
             types = field_schema.get('types_count', [field_schema['type']])
 
@@ -352,10 +394,9 @@ class _SchemaPreProcessing(OutputPreProcessing):
                     logger.warning('Field {} has key "object" but has types {} while should have '
                                    '"OBJECT" or "ARRAY"'.format(field, types))
                     continue
-                line_tuples += cls._object_schema_to_line_tuples(
-                    field_schema['object'], columns_to_get, field_prefix=current_prefix)
-
-        return line_tuples
+                for line_columns in cls._iterate_object_schema_line_tuples(
+                        field_schema['object'], columns_to_get, field_prefix=current_prefix):
+                    yield line_columns
 
     @classmethod
     def _field_schema_to_columns(cls, field_name, field_schema, field_prefix, columns_to_get):
@@ -453,6 +494,9 @@ class ListOutput(BaseOutput):
     """
     Abstract base class. Preprocessing for outputs with a table like format.
 
+    Lines of data are generated by the PreProcessing class when written (see iterate_lines),
+    unless data_df is used, which holds them in a dataframe.
+
     Class attribute:
     _default_columns: allow to override PreProcessing class default_columns
                         {category: [default_columns]}
@@ -474,11 +518,34 @@ class ListOutput(BaseOutput):
                                 default will use default_columns class attribute
         :param kwargs: unused - exists for a unified interface with other subclasses of BaseOutput
         """
-        data_processor = OutputPreProcessing(category)
-        if not columns_to_get:
-            columns_to_get = self.get_default_columns()[category]
+        self.data_processor = OutputPreProcessing(category)
+        self.data = data
+        self.columns_to_get = columns_to_get or self.get_default_columns()[category]
+        self._data_df = None
 
-        self.data_df = data_processor.convert_to_dataframe(data, columns_to_get=columns_to_get)
+    @property
+    def data_df(self):
+        """Dataframe of lines of data, built on first use"""
+        if self._data_df is None:
+            self._data_df = self.data_processor.convert_to_dataframe(
+                self.data, columns_to_get=self.columns_to_get)
+        return self._data_df
+
+    @data_df.setter
+    def data_df(self, data_df):
+        self._data_df = data_df
+
+    def header(self):
+        """List names of columns of lines"""
+        if self._data_df is not None:
+            return list(self._data_df.columns)
+        return self.data_processor.header(self.columns_to_get)
+
+    def iterate_lines(self):
+        """Iterate over lines of data (lists of values of header columns)"""
+        if self._data_df is not None:
+            return iter(self._data_df.values.tolist())
+        return self.data_processor.iterate_lines(self.data, self.columns_to_get)
 
 
 class JsonOutput(HierarchicalOutput):
@@ -494,7 +561,7 @@ class JsonOutput(HierarchicalOutput):
     def write_data(self, file_descr):
         """Use json module dump function to write into file_descr (opened with opener)."""
         json.dump(self.data, file_descr, indent=4, ensure_ascii=False,
-                  default=json_util.default, sort_keys=True)
+                  default=_bson_json_default, sort_keys=True)
 
 
 class YamlOutput(HierarchicalOutput):
@@ -505,24 +572,28 @@ class YamlOutput(HierarchicalOutput):
 
     def write_data(self, file_descr):
         """Use yaml module safe_dump function to write into file_descr."""
+        import yaml
+
         yaml.safe_dump(self.data, file_descr, default_flow_style=False, encoding='utf-8')
 
 
 class TsvOutput(ListOutput):
     """
-    Write data from self.data_df as a table in csv file.
+    Write lines of data as a table in csv file.
     """
     output_format = 'tsv'
 
     def write_data(self, file_descr):
-        """Use dataframe to_csv method to write into file_descr."""
-        self.data_df.to_csv(file_descr, sep='\t', index=False, encoding="utf-8",
-                            quoting=csv.QUOTE_NONE)
+        """Use csv module to write lines into file_descr one by one (None as empty value)."""
+        writer = csv.writer(file_descr, delimiter='\t', quoting=csv.QUOTE_NONE, quotechar=None,
+                            lineterminator='\n')
+        writer.writerow(self.header())
+        writer.writerows(self.iterate_lines())
 
 
 class HtmlOutput(ListOutput):
     """
-    Write data from self.data_df as a table in html file, one table per collection.
+    Write lines of data as a table in html file, one table per collection.
 
     Uses resources/data_dict.tmpl template.
     """
@@ -537,31 +608,27 @@ class HtmlOutput(ListOutput):
 
     def write_data(self, file_descr):
         """
-        Format data from self.data_df, write into file_descr (opened with opener).
+        Format lines of data, write into file_descr (opened with opener).
         """
-        columns = self.data_df.columns
-        col0 = columns[0]  # First column title (usually Database)
-        col1 = columns[1]  # Second column title (usually Collection or Table)
-        tmpl_variables = OrderedDict()
-        for db in self.data_df[col0].unique():
-            tmpl_variables[db] = OrderedDict()
-            df_db = self.data_df.query('{} == @db'.format(col0)).iloc[:, 1:]
-            for col in df_db[col1].unique():
-                df_col = df_db.query('{} == @col'.format(col1)).iloc[:, 1:]
-                tmpl_variables[db][col] = df_col.values.tolist()
+        # Escape field names such as '<key>' (see extract.MAP_KEY)
+        tmpl_variables = _group_lines(
+            self.iterate_lines(),
+            lambda values: [html.escape(cell, quote=False) if isinstance(cell, basestring)
+                            else cell for cell in values])
 
         tmpl_filename = os.path.join(os.path.dirname(os.path.dirname(__file__)),
                                      'resources', 'data_dict.tmpl')
+        import jinja2
+
         with open(tmpl_filename) as tmpl_fd:
             tmpl = jinja2.Template(tmpl_fd.read())
 
-        file_descr.write(tmpl.render(col_titles=list(self.data_df)[2:],
-                                     data=tmpl_variables))
+        file_descr.write(tmpl.render(col_titles=self.header()[2:], data=tmpl_variables))
 
 
 class MdOutput(ListOutput):
     """
-    Write data from self.data_df as a table in markdown file, one table per Collection.
+    Write lines of data as a table in markdown file, one table per Collection.
     """
     output_format = 'md'
     _default_columns = {
@@ -574,38 +641,39 @@ class MdOutput(ListOutput):
 
     def write_data(self, file_descr):
         """
-        Format data from self.data_df, write into file_descr (opened with opener).
+        Format lines of data, write into file_descr (opened with opener).
         """
-        columns = list(self.data_df.columns)
+        columns = self.header()
         col0 = columns.pop(0)       # First column title (usually Database)
         col1 = columns.pop(0)       # Second column title (usually Collection or Table)
-        columns_length = []
-        for col in columns:
-            columns_length.append(max(self.data_df[col].map(
-                lambda s: len(s) if isinstance(s, basestring) else len(str(s))).max(),
-                                      len(col)) + 5)
-
-        def format_column(col_name, value, repeat=False):
-            """Closure - format columns based on existing data length."""
-            col_length = columns_length[columns.index(col_name)]
-            if repeat:
-                return value * col_length
-            return u'{{:<{}}}'.format(col_length).format(u'{}'.format(value))
-
-        str_column_names = self._make_line([format_column(col, col) for col in columns])
-        str_sep_header = self._make_line([format_column(col, '-', repeat=True) for col in columns])
+        columns_length = [len(col) for col in columns]
+
+        def format_values(values):
+            """Closure - format values as text, updating columns length on the way."""
+            cells = [u'{}'.format(value) for value in values]
+            for i, cell in enumerate(cells):
+                if len(cell) > columns_length[i]:
+                    columns_length[i] = len(cell)
+            return cells
+
+        tables = _group_lines(self.iterate_lines(), format_values)
+        columns_length = [col_length + 5 for col_length in columns_length]
+
+        def format_line(cells):
+            """Closure - pad cells to columns length."""
+            return self._make_line([cell.ljust(col_length)
+                                    for cell, col_length in zip(cells, columns_length)])
+
+        str_column_names = format_line(columns)
+        str_sep_header = self._make_line(['-' * col_length for col_length in columns_length])
         output_str = []
-        for db in self.data_df[col0].unique():
+        for db, db_tables in tables.items():
             output_str.append('\n### {}: {}\n'.format(col0, db))
-            df_db = self.data_df.query('{} == @db'.format(col0)).iloc[:, 1:]
-            for col in df_db[col1].unique():
+            for col, table in db_tables.items():
                 if col:
                     output_str.append('#### {}: {} \n'.format(col1, col))
-                df_col = df_db.query('{} == @col'.format(col1)).iloc[:, 1:]
                 output_str.append("\n".join([str_column_names, str_sep_header] +
-                                            [self._make_line([format_column(columns[i], value)
-                                                              for i, value in enumerate(line)])
-                                             for line in df_col.values.tolist()]))
+                                            [format_line(cells) for cells in table]))
                 output_str.append('\n\n')
 
         file_descr.write("".join(output_str))
@@ -616,7 +684,7 @@ class MdOutput(ListOutput):
 
 class XlsxOutput(ListOutput):
     """
-    Write data from self.data_df as a table in csv file.
+    Write data from self.data_df as a table in xlsx file.
     """
     output_format = 'xlsx'
 
@@ -632,6 +700,9 @@ class XlsxOutput(ListOutput):
         """
         Use dataframe to_excel to write into file_descr (filename) - open first if file exists.
         """
+        import pandas as pd
+        from openpyxl import load_workbook
+
         if os.path.isfile(file_descr):
             print(file_descr, 'exists')
             # Solution to keep existing data
@@ -647,6 +718,32 @@ class XlsxOutput(ListOutput):
                                   float_format='%.2f')
 
 
+def _group_lines(lines, format_values):
+    """ Group lines into tables by their first two values (such as database and collection)
+
+    Lines are grouped in one pass, tables being in order of their first line.
+
+    :param lines: iterable of lists
+    :param format_values: function - called with the other values of each line
+    :return tables: OrderedDict - {first value: OrderedDict({second value: [formatted values]})}
+    """
+    tables = OrderedDict()
+    table_key = table = None
+    for line in lines:
+        if (line[0], line[1]) != table_key:  # lines are mostly sorted by table
+            table_key = (line[0], line[1])
+            table = tables.setdefault(line[0], OrderedDict()).setdefault(line[1], [])
+        table.append(format_values(line[2:]))
+    return tables
+
+
+def _bson_json_default(value):
+    """Serialize values json cannot, with bson.json_util - only imported if such values are met"""
+    from bson import json_util
+
+    return json_util.default(value)
+
+
 def rec_find_right_subclass(attribute_value, attribute='output_format', start_class=BaseOutput):
     """Find which subclass of start_class should be used (has the right attribute value)"""
     for subclass in start_class.__subclasses__():
@@ -22,7 +22,6 @@ Schema are hierarchically nested : (see also README.md)
     }
 
 - An object contains fields.
-Objects are initialized as defaultdict(empty_field_schema) to simplify the code
     {
         "field_name_1" : field_schema_1,
         "field_name_2": field_schema_2
@@ -33,24 +32,142 @@ Objects are initialized as defaultdict(empty_field_schema) to simplify the code
     {
         'count': int,
         'type', 'type_str',
-        'types_count': defaultdict(int) # count for each encountered type
+        'types_count': dict # count for each encountered type
         'array_type', 'type_str', # (optional: if array)
-        'array_types_count': defaultdict(int), # (optional: if array) count for each type  in array
+        'array_types_count': dict, # (optional: if array) count for each type  in array
         'object': {}, # (optional if object) object_schema
     }
+
+While documents are added, objects are initialized as ObjectStats (dicts of FieldStats),
+a compact form of fields counts, converted to the above dicts once with object_schema_to_dict.
+
+Map-like objects, whose keys are values (user ids, dates, ...) rather than field names,
+are collapsed into a single MAP_KEY ('<key>') field, so that the schema size stays bounded.
+Its 'count' is the number of keys of all objects, thus its 'prop_in_object' is the average
+number of keys by object.
+
+The work by document can be bounded (see ExtractionSettings): only some elements of long arrays
+are examined, 'array_types_count' is extrapolated from them and 'sampled_arrays_count' counts
+such arrays; objects nested deeper than a maximum depth are counted but not walked.
+
+Statistics of the values of fields can also be collected in the same pass (see ExtractionSettings):
+null and distinct counts, bounds and percentiles of numbers and strings lengths, top values.
+They are summarized by mergeable sketches in an optional 'value_stats' (see sketches module).
 """
 
 import logging
-from collections import defaultdict
+import random
+import re
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+import bson
 from past.builtins import basestring
 
-from pymongo_schema.mongo_sql_types import get_type_string, common_parent_type
+from pymongo_schema.aggregation import extract_object_schema_with_pipelines
+from pymongo_schema.sampling import sample_documents
+from pymongo_schema.mongo_sql_types import (get_type_code, common_parent_type,
+                                             PYMONGO_TYPE_TO_TYPE_STRING, TYPE_STRINGS,
+                                             TYPE_STRING_TO_TYPE_CODE)
+from pymongo_schema.sketches import ValueStats
 
 logger = logging.getLogger(__name__)
 
+# Name of the single field map-like objects are collapsed into
+MAP_KEY = '<key>'
+
+# Keys of map-like objects: numbers or ids with a short prefix ('123', 'u123'), ObjectId, UUID,
+# and dates ('2020-01', '2020-01-31', '2020-01-31T12:00')
+DEFAULT_MAP_KEY_PATTERN = (r'^([A-Za-z_-]{0,4}\d+|[0-9a-fA-F]{24}|'
+                           r'[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}|'
+                           r'\d{4}-\d{2}(-\d{2}([T ].*)?)?)$')
+
+class ExtractionSettings(object):
+    """ Settings of an extraction, shared by all objects of an object_schema
+
+    Object schemas are initialized with their settings (see init_empty_object_schema),
+    which nested objects inherit, so that extractions with distinct settings do not depend on
+    each other, even within a process.
+
+    Detection of map-like objects, collapsed into a MAP_KEY field (see ObjectStats):
+    :param map_max_keys: int, default 1000
+        Hard cap on the number of fields of an object. 0 disables the cap.
+    :param map_min_keys: int, default 20
+        Minimum number of fields of an object whose keys all match map_key_pattern.
+        0 disables the detection from keys.
+    :param map_key_pattern: str, default DEFAULT_MAP_KEY_PATTERN
+        Regular expression matching keys of map-like objects
+
+    Bounds of the work by document of the python engine:
+    :param max_array_elements: int, default 0
+        Maximum number of elements examined by array. 'array_types_count' of longer arrays is
+        extrapolated from the examined elements, and nested objects only count those.
+        0 examines all elements.
+    :param array_sampling: str, default 'first'
+        'first' or 'random' elements of long arrays are examined
+    :param max_depth: int, default 0
+        Maximum depth of the fields added (1 for the fields of documents, 2 for the fields of
+        their sub-documents, ...). Deeper objects are counted as 'OBJECT' but not walked.
+        0 walks all objects.
+
+    Values statistics of fields, with the python engine:
+    :param value_stats: bool, default False
+        Add scalar values of fields and of their arrays elements to the 'value_stats' of fields
+        (see sketches.ValueStats)
+    :param top_values: int, default 0
+        Number of most frequent strings and integers kept by field, with a fixed number of
+        counters (see sketches.FrequentValues). 0 does not count values. Implies value_stats.
+    """
+    __slots__ = ('map_max_keys', 'map_min_keys', 'map_key_pattern', 'max_array_elements',
+                 'array_sampling', 'max_depth', 'value_stats', 'top_values')
+
+    def __init__(self, map_max_keys=1000, map_min_keys=20, map_key_pattern=DEFAULT_MAP_KEY_PATTERN,
+                 max_array_elements=0, array_sampling='first', max_depth=0, value_stats=False,
+                 top_values=0):
+        if array_sampling not in ('first', 'random'):
+            raise ValueError("Array sampling should be 'first' or 'random', not {}".format(
+                array_sampling))
+        self.map_max_keys = map_max_keys
+        self.map_min_keys = map_min_keys
+        self.map_key_pattern = re.compile(map_key_pattern)
+        self.max_array_elements = max_array_elements
+        self.array_sampling = array_sampling
+        self.max_depth = max_depth
+        self.value_stats = value_stats or bool(top_values)
+        self.top_values = top_values
+
+    @property
+    def map_detection(self):
+        """ Settings of map-like objects detection, as (map_max_keys, map_min_keys,
+        map_key_pattern) arguments"""
+        return self.map_max_keys, self.map_min_keys, self.map_key_pattern.pattern
+
+    def __repr__(self):
+        return 'ExtractionSettings({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__))
+
+
+# Settings of object schemas initialized without settings
+DEFAULT_SETTINGS = ExtractionSettings()
+
+
+def get_extraction_settings(map_max_keys=1000, map_min_keys=20,
+                            map_key_pattern=DEFAULT_MAP_KEY_PATTERN, max_array_elements=0,
+                            array_sampling='first', max_depth=0, value_stats=False, top_values=0,
+                            **kwargs):
+    """ Get the settings of an extraction from its scan options
+
+    :param kwargs: other scan options, ignored (see scan_collection)
+    :return settings: ExtractionSettings
+    """
+    return ExtractionSettings(map_max_keys, map_min_keys, map_key_pattern, max_array_elements,
+                              array_sampling, max_depth, value_stats, top_values)
+
 
-def extract_pymongo_client_schema(pymongo_client, database_names=None, collection_names=None, sample_size=0):
+def extract_pymongo_client_schema(pymongo_client, database_names=None, collection_names=None,
+                                  sample_size=0, workers=1, client_kwargs=None, partitions=1,
+                                  **kwargs):
     """ Extract the schema for every database in database_names
 
     :param pymongo_client: pymongo.mongo_client.MongoClient
@@ -59,6 +176,14 @@ def extract_pymongo_client_schema(pymongo_client, database_names=None, collectio
         Will be used for every database in database_names list
     :param sample_size: int, default 0
         Will be used for all collection
+    :param workers: int, default 1
+        Number of processes extracting collections concurrently
+    :param client_kwargs: dict, default None
+        Arguments used by each worker process to open its own client.
+        Default to the arguments pymongo_client was created with.
+    :param partitions: int, default 1
+        Number of _id ranges each collection is split into, to be scanned concurrently by workers
+    :param kwargs: scan options for all collections, see scan_collection
     :return mongo_schema: dict
     """
 
@@ -70,76 +195,635 @@ def extract_pymongo_client_schema(pymongo_client, database_names=None, collectio
         database_names.remove('admin')
         database_names.remove('local')
 
+    if workers > 1:
+        namespaces = [(database, collection) for database in database_names
+                      for collection in list_collection_names(pymongo_client[database],
+                                                              collection_names)]
+        return extract_namespaces_schema(pymongo_client, namespaces, sample_size,
+                                         workers, client_kwargs, partitions, **kwargs)
+
     mongo_schema = dict()
     for database in database_names:
         logger.info('Extract schema of database %s', database)
         pymongo_database = pymongo_client[database]
-        database_schema = extract_database_schema(pymongo_database, collection_names, sample_size)
+        database_schema = extract_database_schema(pymongo_database, collection_names, sample_size,
+                                                  **kwargs)
         if database_schema:  # Do not add a schema if it is empty
             mongo_schema[database] = database_schema
 
     return mongo_schema
 
 
-def extract_database_schema(pymongo_database, collection_names=None, sample_size=0):
+def extract_database_schema(pymongo_database, collection_names=None, sample_size=0,
+                            workers=1, client_kwargs=None, partitions=1, **kwargs):
     """ Extract the database schema, for every collection in collection_names
 
     :param pymongo_database: pymongo.database.Database
     :param collection_names: str, list of str, default None
     :param sample_size: int, default 0
+    :param workers: int, default 1
+        Number of processes extracting collections concurrently
+    :param client_kwargs: dict, default None
+        Arguments used by each worker process to open its own client.
+        Default to the arguments of the client of pymongo_database.
+    :param partitions: int, default 1
+        Number of _id ranges each collection is split into, to be scanned concurrently by workers
+    :param kwargs: scan options for all collections, see scan_collection
     :return database_schema: dict
     """
-    if isinstance(collection_names, basestring):
-        collection_names = [collection_names]
+    collection_names = list_collection_names(pymongo_database, collection_names)
 
-    database_collections = pymongo_database.list_collection_names()
-    if collection_names is None:
-        collection_names = database_collections
-    else:
-        collection_names = [col for col in collection_names if col in database_collections]
+    if workers > 1:
+        namespaces = [(pymongo_database.name, collection) for collection in collection_names]
+        mongo_schema = extract_namespaces_schema(pymongo_database.client, namespaces, sample_size,
+                                                 workers, client_kwargs, partitions, **kwargs)
+        return mongo_schema.get(pymongo_database.name, dict())
 
     database_schema = dict()
     for collection in collection_names:
         logger.info('...collection %s', collection)
         pymongo_collection = pymongo_database[collection]
-        database_schema[collection] = extract_collection_schema(pymongo_collection, sample_size)
+        database_schema[collection] = extract_collection_schema(pymongo_collection, sample_size,
+                                                                **kwargs)
 
     return database_schema
 
 
-def extract_collection_schema(pymongo_collection, sample_size=0):
+def list_collection_names(pymongo_database, collection_names=None):
+    """ List the collections of pymongo_database to analyze
+
+    :param pymongo_database: pymongo.database.Database
+    :param collection_names: str, list of str, default None
+        Only keep those collections, if present in database. By default keep all collections.
+    :return collection_names: list of str
+    """
+    if isinstance(collection_names, basestring):
+        collection_names = [collection_names]
+
+    database_collections = pymongo_database.list_collection_names()
+    if collection_names is None:
+        return database_collections
+    return [col for col in collection_names if col in database_collections]
+
+
+def extract_namespaces_schema(pymongo_client, namespaces, sample_size=0, workers=1,
+                              client_kwargs=None, partitions=1, **kwargs):
+    """ Extract the schema of each (database, collection) namespace in a pool of processes
+
+    Each worker process opens its own client, as a MongoClient cannot be shared between processes.
+    Unless sampled or checkpointed, collections may be split into several _id ranges,
+    scanned by distinct workers.
+    Workers return partial object schemas, which are merged and post-processed in namespaces order,
+    so that the output does not depend on scheduling.
+
+    :param pymongo_client: pymongo.mongo_client.MongoClient
+    :param namespaces: list of (database, collection) tuples
+    :param sample_size: int, default 0
+    :param workers: int, default 1
+    :param client_kwargs: dict, default None
+        Arguments used by each worker process to open its own client.
+        Default to the arguments pymongo_client was created with.
+    :param partitions: int, default 1
+        Number of _id ranges to split each collection into
+    :param kwargs: scan options for all collections, see scan_collection
+    :return mongo_schema: dict
+    """
+    if client_kwargs is None:
+        client_kwargs = get_client_kwargs(pymongo_client)
+
+    sampled = bool(sample_size or kwargs.get('convergence_size'))
+    scans = []
+    for database, collection in namespaces:
+        id_filters = [{}]
+        if partitions > 1 and not sampled and not kwargs.get('checkpoint_dir'):
+            id_filters = split_collection_id_ranges(pymongo_client[database][collection],
+                                                    partitions)
+        scans += [(database, collection, id_filter) for id_filter in id_filters]
+
+    mongo_schema = dict()
+    # Partial schemas are merged with the map detection of workers
+    settings = get_extraction_settings(**kwargs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker_client,
+                             initargs=(type(pymongo_client), client_kwargs)) as executor:
+        results = executor.map(_scan_namespace, scans, repeat(sample_size), repeat(kwargs))
+        for (database, collection, _), (scanned, object_schema) in zip(scans, results):
+            database_schema = mongo_schema.setdefault(database, dict())
+            if collection not in database_schema:
+                database_schema[collection] = {
+                    'count': pymongo_client[database][collection].estimated_document_count(),
+                    'object': init_empty_object_schema(settings)
+                }
+                if sampled:
+                    database_schema[collection]['analyzed_count'] = 0
+                    database_schema[collection]['sampling'] = get_collection_sampling(
+                        pymongo_client[database][collection], **kwargs)
+            if sampled:
+                database_schema[collection]['analyzed_count'] += scanned
+            add_object_schema_to_object_schema(object_schema,
+                                               database_schema[collection]['object'])
+
+    for database_schema in mongo_schema.values():
+        for collection_schema in database_schema.values():
+            collection_schema['object'] = object_schema_to_dict(
+                collection_schema['object'],
+                collection_schema.get('analyzed_count', collection_schema['count']))
+
+    return mongo_schema
+
+
+def get_client_kwargs(pymongo_client):
+    """ Get the arguments a pymongo client was created with, to open a similar one in workers
+
+    :param pymongo_client: pymongo.mongo_client.MongoClient
+    :return client_kwargs: dict
+    """
+    for attribute in ['_init_kwargs', '_MongoClient__init_kwargs']:
+        client_kwargs = getattr(pymongo_client, attribute, None)
+        if client_kwargs is not None:
+            return dict(client_kwargs)
+    raise ValueError("Cannot find the arguments {} was created with. Pass client_kwargs to "
+                     "extract with several workers".format(pymongo_client))
+
+
+# Client opened once by each worker process of extract_namespaces_schema
+_worker_client = None
+
+
+def _init_worker_client(client_class, client_kwargs):
+    """ Open the client of the current worker process."""
+    global _worker_client
+    _worker_client = client_class(**client_kwargs)
+
+
+def _scan_namespace(scan, sample_size, scan_kwargs):
+    """ Scan a collection (or an _id range of it) in a worker process, using its own client.
+
+    :param scan: (database, collection, id_filter) tuple
+    :param sample_size: int
+    :param scan_kwargs: dict - scan options, see scan_collection
+    :return scanned, object_schema: int, dict
+        number of documents added, and object_schema not post-processed, as regular dicts
+        to be sent back
+    """
+    database, collection, id_filter = scan
+    logger.info('...collection %s.%s %s', database, collection, id_filter or '')
+    object_schema = init_empty_object_schema(get_extraction_settings(**scan_kwargs))
+    scanned = scan_collection(_worker_client[database][collection], object_schema, sample_size,
+                              id_filter, **scan_kwargs)
+    return scanned, object_schema_to_dict(object_schema)
+
+
+# Number of sampled _id per partition, to compute partitions boundaries
+PARTITION_SAMPLE_FACTOR = 100
+
+# $type aliases of _id values which can be split in ranges.
+# Range queries only match values of the same BSON type bracket as their bounds.
+ID_TYPE_ALIASES = {
+    bson.objectid.ObjectId: 'objectId',
+    str: 'string',
+    int: 'number',
+    bson.int64.Int64: 'number',
+    float: 'number',
+    bson.datetime.datetime: 'date',
+}
+
+
+def split_collection_id_ranges(pymongo_collection, partitions):
+    """ Split a collection into contiguous _id ranges of similar sizes
+
+    Boundaries are quantiles of sampled _id values, of the most frequent _id type.
+    Documents with another _id type are gathered in an additional range.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param partitions: int
+    :return id_filters: list of dict - queries on _id which together cover the whole collection
+    """
+    sampled_ids = defaultdict(list)
+    pipeline = [{'$sample': {'size': partitions * PARTITION_SAMPLE_FACTOR}},
+                {'$project': {'_id': 1}}]
+    for document in pymongo_collection.aggregate(pipeline, allowDiskUse=True):
+        id_type_alias = ID_TYPE_ALIASES.get(type(document['_id']))
+        sampled_ids[id_type_alias].append(document['_id'])
+
+    if not sampled_ids:
+        return [{}]
+    id_type_alias = max(sampled_ids, key=lambda alias: len(sampled_ids[alias]))
+    if id_type_alias is None:
+        logger.warning('Cannot split collection %s in _id ranges', pymongo_collection.name)
+        return [{}]
+
+    ids = sorted(sampled_ids[id_type_alias])
+    if len(ids) < partitions:
+        return [{}]
+    boundaries = sorted(set(ids[len(ids) * i // partitions] for i in range(1, partitions)))
+
+    id_filters = [{'_id': {'$lt': boundaries[0]}}]
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        id_filters.append({'_id': {'$gte': lower, '$lt': upper}})
+    id_filters.append({'_id': {'$gte': boundaries[-1]}})
+    id_filters.append({'_id': {'$not': {'$type': id_type_alias}}})
+    return id_filters
+
+
+def extract_collection_schema(pymongo_collection, sample_size=0, workers=1, client_kwargs=None,
+                              partitions=1, **kwargs):
     """ Iterate through all document of a collection to create its schema
 
-    - Init collection schema
+    - Init object schema
     - Add every document from MongoDB collection to the schema
-    - Post-process schema
+    - Convert it to a post-processed collection schema
+
+    If documents are sampled (with sample_size or convergence_size), the number of analyzed
+    documents is recorded in 'analyzed_count', and proportions of fields are computed from it.
+    The sampling strategy is recorded in 'sampling'.
 
     :param pymongo_collection: pymongo.collection.Collection
     :param sample_size: int, default 0
+    :param workers: int, default 1
+    :param client_kwargs: dict, default None
+        Arguments used by each worker process to open its own client.
+    :param partitions: int, default 1
+        Number of _id ranges scanned concurrently by workers, if more than 1 worker
+    :param kwargs: scan options, see scan_collection
     :return collection_schema: dict
     """
-    collection_schema = {
-        'count': 0,
-        "object": init_empty_object_schema()
-    }
+    if workers > 1 and partitions > 1:
+        database = pymongo_collection.database
+        mongo_schema = extract_namespaces_schema(
+            database.client, [(database.name, pymongo_collection.name)], sample_size,
+            workers, client_kwargs, partitions, **kwargs)
+        return mongo_schema[database.name][pymongo_collection.name]
+
+    object_schema = init_empty_object_schema(get_extraction_settings(**kwargs))
 
     n = pymongo_collection.estimated_document_count()
-    collection_schema['count'] = n
-    if sample_size:
-        documents = pymongo_collection.aggregate([{'$sample': {'size': sample_size}}], allowDiskUse=True)
+    scanned = scan_collection(pymongo_collection, object_schema, sample_size,
+                              scan_count=sample_size or n, **kwargs)
+
+    collection_schema = {'count': n}
+    object_count = n
+    if sample_size or kwargs.get('convergence_size'):
+        collection_schema['analyzed_count'] = object_count = scanned
+        collection_schema['sampling'] = get_collection_sampling(pymongo_collection, **kwargs)
+    collection_schema['object'] = object_schema_to_dict(object_schema, object_count)
+    return collection_schema
+
+
+def scan_collection(pymongo_collection, object_schema, sample_size=0, query=None,
+                    scan_count=None, engine='python', shape_cache_size=1024, convergence_size=0,
+                    sampling='random', sampling_options=None, collections_sampling=None,
+                    cursor_options=None, checkpoint_dir=None, checkpoint_every=10 ** 5,
+                    resume=False, retries=3, **kwargs):
+    """ Add documents of a collection to an object_schema
+
+    Three engines are available:
+    - 'python' decodes every document in python, to add it to the object_schema.
+      Counters incremented by the most frequent documents shapes are cached (see DocumentShapeCache)
+    - 'aggregation' makes MongoDB count fields types with aggregation pipelines, one by depth of
+      the schema, so that only counts are sent back (see aggregation module)
+    - 'rawbson' walks raw BSON documents, reading only types and field names,
+      without decoding values into python objects (see rawbson module)
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param object_schema: dict
+        initialized with init_empty_object_schema, with the settings of the scan
+    :param sample_size: int, default 0
+        Only add a sample of documents. By default add all documents.
+    :param query: dict, default None
+        Only add documents matching this query
+    :param scan_count: int, default None
+        Expected number of documents, to log progress
+    :param engine: str, default 'python'
+        'python', 'aggregation' or 'rawbson'
+    :param shape_cache_size: int, default 1024
+        Maximum number of documents shapes cached by 'python' engine. 0 disables the cache.
+    :param convergence_size: int, default 0
+        Adaptive sampling, with 'python' engine: add random documents by batches of increasing
+        size (see sample_documents_batches), and stop once convergence_size documents in a row
+        brought no new field or type (see SchemaConvergence). sample_size, if any, is then the
+        maximum number of documents to add. 0 disables adaptive sampling.
+    :param sampling: str, default 'random'
+        Strategy to sample documents with sample_size (see sampling module). Other strategies than
+        'random' ($sample stage) are only available with 'python' engine.
+    :param sampling_options: dict, default None
+        Options of the sampling strategy, see sampling.sample_documents
+    :param collections_sampling: dict, default None
+        Sampling strategy of some collections, by 'database.collection' or collection name
+    :param cursor_options: dict, default None
+        Options of the find cursor reading all documents, with 'python' and 'rawbson' engines,
+        such as batch_size, no_cursor_timeout or cursor_type (see pymongo Collection.find).
+        batch_size 'auto' is computed from the average size of documents (see auto_batch_size).
+    :param checkpoint_dir: str, default None
+        Directory of state files of checkpointed scans, with 'python' engine and all documents.
+        Documents are then read in _id order, and the partial object_schema is saved with the last
+        _id every checkpoint_every documents (see scan_collection_checkpointed).
+    :param checkpoint_every: int, default 10 ** 5
+    :param resume: bool, default False
+        Resume checkpointed scans from their state file, if any
+    :param retries: int, default 3
+        Number of times checkpointed scans re-open their cursor in a row after retriable errors
+    :param kwargs: extraction settings (see ExtractionSettings), applied by object_schema
+        Bounds of the work by document and values statistics need 'python' engine.
+        With values statistics, documents shapes are not cached, as values are read from every
+        document.
+    :return scanned: int - number of documents added
+    """
+    settings = object_schema.settings
+    sampling = get_collection_sampling(pymongo_collection, sampling, collections_sampling)
+    if convergence_size and engine != 'python':
+        raise ValueError("Adaptive sampling is only available with 'python' engine")
+    if (settings.max_array_elements or settings.max_depth) and engine != 'python':
+        raise ValueError("Limits of arrays elements and depth are only available with "
+                         "'python' engine")
+    if settings.value_stats and engine != 'python':
+        raise ValueError("Values statistics are only available with 'python' engine")
+    if settings.value_stats:
+        shape_cache_size = 0
+    if sampling != 'random' and engine != 'python':
+        raise ValueError("Sampling strategy {} is only available with 'python' engine".format(
+            sampling))
+    if sampling != 'random' and not sample_size:
+        raise ValueError("Sampling strategy {} needs a sample_size".format(sampling))
+    if checkpoint_dir and (engine != 'python' or sample_size or convergence_size):
+        raise ValueError("Checkpoints are only available with 'python' engine, "
+                         "for scans of all documents")
+    if engine == 'aggregation':
+        scanned, pipelines_object_schema = extract_object_schema_with_pipelines(
+            pymongo_collection, sample_size, query, settings)
+        add_object_schema_to_object_schema(pipelines_object_schema, object_schema)
+        return scanned
+    if engine == 'rawbson':
+        # rawbson module builds on this one, thus is imported only when used
+        from pymongo_schema.rawbson import scan_raw_batches
+        return scan_raw_batches(pymongo_collection, object_schema, sample_size, query,
+                                scan_count, get_cursor_options(pymongo_collection, cursor_options))
+    if engine != 'python':
+        raise ValueError("Extraction engine should be 'python', 'aggregation' or 'rawbson', "
+                         "not {}".format(engine))
+
+    if checkpoint_dir:
+        return scan_collection_checkpointed(pymongo_collection, object_schema, checkpoint_dir,
+                                            query, scan_count, shape_cache_size, cursor_options,
+                                            checkpoint_every, resume, retries)
+    if convergence_size and sampling == 'random':
+        documents = sample_documents_batches(pymongo_collection, convergence_size, query,
+                                             max_size=sample_size)
+        scan_count = None
+    elif sample_size:
+        documents = sample_documents(pymongo_collection, sample_size, query, sampling,
+                                     **(sampling_options or {}))
     else:
-        documents = pymongo_collection.find({})
-    scan_count = sample_size or n
+        documents = pymongo_collection.find(
+            query or {}, **get_cursor_options(pymongo_collection, cursor_options))
+    shape_cache = DocumentShapeCache(object_schema, shape_cache_size) if shape_cache_size else None
+    convergence = SchemaConvergence(convergence_size, settings) if convergence_size else None
     i = 0
     for document in documents:
-        add_document_to_object_schema(document, collection_schema['object'])
+        if shape_cache:
+            shape_cache.add_document(document)
+        else:
+            add_document_to_object_schema(document, object_schema)
         i += 1
-        if i % 10 ** 5 == 0 or i == scan_count:
-            logger.info('   scanned %s documents out of %s (%.2f %%)', i, scan_count, (100. * i) / scan_count)
+        if scan_count and (i % 10 ** 5 == 0 or i == scan_count):
+            logger.info('   scanned %s documents out of %s (%.2f %%)', i, scan_count,
+                        (100. * i) / scan_count)
+        elif not scan_count and i % 10 ** 5 == 0:
+            logger.info('   scanned %s documents', i)
+        if convergence and convergence.add_document(document):
+            logger.info('   schema converged after %s documents', i)
+            break
+    if shape_cache:
+        shape_cache.flush()
+    return i
+
+
+def scan_collection_checkpointed(pymongo_collection, object_schema, checkpoint_dir, query=None,
+                                 scan_count=None, shape_cache_size=1024, cursor_options=None,
+                                 checkpoint_every=10 ** 5, resume=False, retries=3):
+    """ Add all documents of a collection to an object_schema, in _id order, saving checkpoints
+
+    The state file of the collection (see checkpoint module) is written every checkpoint_every
+    documents, and marked complete once all documents were added.
+    A resumed scan starts from the object_schema and the last _id of the state file,
+    and a complete scan is not read again.
 
-    post_process_schema(collection_schema)
-    collection_schema = recursive_default_to_regular_dict(collection_schema)
-    return collection_schema
+    :param pymongo_collection: pymongo.collection.Collection
+    :param object_schema: dict
+    :param checkpoint_dir: str
+    :param query: dict, default None
+    :param scan_count: int, default None
+    :param shape_cache_size: int, default 1024
+    :param cursor_options: dict, default None
+    :param checkpoint_every: int, default 10 ** 5
+    :param resume: bool, default False
+    :param retries: int, default 3
+    :return scanned: int - number of documents added, including those of the resumed scan
+    """
+    # checkpoint module needs pymongo, thus is imported only when used
+    from pymongo_schema.checkpoint import (checkpoint_path, find_by_id, load_checkpoint,
+                                           save_checkpoint)
+
+    path = checkpoint_path(checkpoint_dir, pymongo_collection)
+    state = {'namespace': pymongo_collection.full_name, 'query': query or {}, 'scanned': 0,
+             'last_id': None, 'complete': False}
+    if resume:
+        saved_state = load_checkpoint(path, state['namespace'], query)
+        if saved_state is not None:
+            state = saved_state
+            add_object_schema_to_object_schema(state.pop('object'), object_schema)
+            if state['complete']:
+                logger.info('   scan of %s documents is complete', state['scanned'])
+                return state['scanned']
+            logger.info('   resume scan after %s documents, from _id %s',
+                        state['scanned'], state['last_id'])
+
+    documents = find_by_id(pymongo_collection, query, state['last_id'],
+                           get_cursor_options(pymongo_collection, cursor_options), retries)
+    shape_cache = DocumentShapeCache(object_schema, shape_cache_size) if shape_cache_size else None
+
+    def save(complete=False):
+        if shape_cache:
+            shape_cache.flush()
+        state['complete'] = complete
+        save_checkpoint(path, dict(state, object=object_schema_to_dict(object_schema)))
+
+    for document in documents:
+        if shape_cache:
+            shape_cache.add_document(document)
+        else:
+            add_document_to_object_schema(document, object_schema)
+        state['scanned'] += 1
+        state['last_id'] = document['_id']
+        if state['scanned'] % checkpoint_every == 0:
+            save()
+            if scan_count:
+                logger.info('   scanned %s documents out of %s (%.2f %%), checkpoint saved',
+                            state['scanned'], scan_count, (100. * state['scanned']) / scan_count)
+            else:
+                logger.info('   scanned %s documents, checkpoint saved', state['scanned'])
+    save(complete=True)
+    return state['scanned']
+
+
+def get_collection_sampling(pymongo_collection, sampling='random', collections_sampling=None,
+                            **kwargs):
+    """ Get the sampling strategy of a collection
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sampling: str, default 'random' - default sampling strategy
+    :param collections_sampling: dict, default None
+        Sampling strategy of some collections, by 'database.collection' or collection name
+    :param kwargs: other scan options, unused
+    :return sampling: str
+    """
+    collections_sampling = collections_sampling or {}
+    for name in [pymongo_collection.full_name, pymongo_collection.name]:
+        if name in collections_sampling:
+            return collections_sampling[name]
+    return sampling
+
+
+# Size of cursor batches with automatic batch size. MongoDB replies are at most 16 MiB.
+AUTO_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def get_cursor_options(pymongo_collection, cursor_options=None):
+    """ Get the options of a find cursor on a collection, resolving batch_size 'auto'
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param cursor_options: dict, default None
+        Options of pymongo Collection.find. batch_size may be 'auto'.
+    :return cursor_options: dict
+    """
+    cursor_options = dict(cursor_options or {})
+    if cursor_options.get('batch_size') == 'auto':
+        batch_size = auto_batch_size(pymongo_collection)
+        if batch_size:
+            cursor_options['batch_size'] = batch_size
+        else:
+            del cursor_options['batch_size']
+    return cursor_options
+
+
+def auto_batch_size(pymongo_collection, batch_bytes=AUTO_BATCH_BYTES):
+    """ Compute the number of documents filling batch_bytes, from collStats avgObjSize
+
+    Default batches of MongoDB first reply hold only 101 documents, which costs a round trip
+    per batch for small documents.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param batch_bytes: int, default AUTO_BATCH_BYTES
+    :return batch_size: int - 0 if the average size of documents is unknown
+    """
+    from pymongo.errors import PyMongoError
+
+    try:
+        stats = pymongo_collection.database.command('collStats', pymongo_collection.name)
+    except PyMongoError as e:
+        logger.warning('Cannot get average size of documents of collection %s: %s',
+                       pymongo_collection.name, e)
+        return 0
+    avg_obj_size = stats.get('avgObjSize')
+    if not avg_obj_size:
+        return 0
+    batch_size = max(1, int(batch_bytes // avg_obj_size))
+    logger.info('   batches of %s documents of %s bytes on average', batch_size, avg_obj_size)
+    return batch_size
+
+
+def sample_documents_batches(pymongo_collection, first_batch_size, query=None, max_size=0):
+    """ Iterate over random documents, sampled by batches of doubling size
+
+    Each batch is an independent $sample, kept as first stage of its pipeline (unless there is a
+    query) so that MongoDB reads random documents rather than scanning the collection.
+    Documents already sampled by a previous batch are skipped, so that each document is yielded
+    at most once. Iteration ends once max_size documents, or as many documents as the collection
+    holds, were yielded, or a batch gets fewer documents than requested (it contained all
+    documents), or no new document.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param first_batch_size: int
+    :param query: dict, default None
+        Only sample documents matching this query
+    :param max_size: int, default 0
+        Maximum number of documents to sample. By default, no maximum.
+    :return documents: iterator of dict
+    """
+    if not query:
+        count = pymongo_collection.estimated_document_count()
+        max_size = min(max_size, count) if max_size else count
+        if not max_size:
+            return
+    batch_size = first_batch_size
+    # _id may be a document, thus is compared BSON encoded
+    seen_ids = set()
+    while True:
+        if max_size:
+            batch_size = min(batch_size, max_size)
+        pipeline = [{'$match': query}] if query else []
+        pipeline.append({'$sample': {'size': batch_size}})
+        batch_count = 0
+        new_count = 0
+        for document in pymongo_collection.aggregate(pipeline, allowDiskUse=True):
+            batch_count += 1
+            encoded_id = bson.encode({'_id': document['_id']})
+            if encoded_id in seen_ids:
+                continue
+            seen_ids.add(encoded_id)
+            new_count += 1
+            yield document
+            if max_size and len(seen_ids) >= max_size:
+                return
+        if batch_count < batch_size or not new_count:
+            return
+        logger.info('   sampled %s documents, sample %s more', len(seen_ids), 2 * batch_size)
+        batch_size *= 2
+
+
+def add_object_schema_to_object_schema(object_schema, target_object_schema):
+    """ Add the counts of an object_schema (regular dicts, possibly post-processed)
+    to a target object_schema
+
+    :param object_schema: dict
+    :param target_object_schema: dict
+        initialized with init_empty_object_schema
+    """
+    for field, field_schema in object_schema.items():
+        add_field_schema_to_field_stats(field_schema, target_object_schema[field],
+                                        target_object_schema.settings)
+
+
+def add_field_schema_to_field_stats(field_schema, field_stats, settings=DEFAULT_SETTINGS):
+    """ Add the counts of a field_schema (regular dict, possibly post-processed) to field_stats
+
+    :param field_schema: dict
+    :param field_stats: FieldStats
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS - settings of nested objects
+    """
+    field_stats.count += field_schema['count']
+    _add_types_count_dict(field_schema['types_count'], field_stats.types_count)
+    if 'array_types_count' in field_schema:
+        if field_stats.array_types_count is None:
+            field_stats.array_types_count = init_empty_types_count()
+        _add_types_count_dict(field_schema['array_types_count'], field_stats.array_types_count)
+    field_stats.sampled_arrays += field_schema.get('sampled_arrays_count', 0)
+    if 'value_stats' in field_schema:
+        value_stats = ValueStats.from_dict(field_schema['value_stats'])
+        if field_stats.value_stats is None:
+            field_stats.value_stats = value_stats
+        else:
+            field_stats.value_stats.merge(value_stats)
+
+    if 'object' in field_schema:
+        if field_stats.object is None:
+            field_stats.object = init_empty_object_schema(settings)
+        add_object_schema_to_object_schema(field_schema['object'], field_stats.object)
+
+
+def _add_types_count_dict(types_count_dict, types_count):
+    """ Add counts of a {type_string: count} dict to a list of counts indexed by type code"""
+    for type_string, count in types_count_dict.items():
+        types_count[TYPE_STRING_TO_TYPE_CODE[type_string]] += count
 
 
 def recursive_default_to_regular_dict(value):
@@ -157,6 +841,23 @@ def recursive_default_to_regular_dict(value):
         return value
 
 
+def object_schema_to_dict(object_schema, object_count=None):
+    """ Convert an object_schema of FieldStats to regular dicts
+
+    If object_count is given, fields are post-processed on the way, as with post_process_schema.
+
+    :param object_schema: dict
+        initialized with init_empty_object_schema
+    :param object_count: int, default None
+        number of objects the fields belong to
+    :return object_schema: dict
+    """
+    if isinstance(object_schema, ObjectStats):
+        object_schema = object_schema.fields_stats()
+    return {field: field_stats.to_dict(object_count)
+            for field, field_stats in object_schema.items()}
+
+
 def post_process_schema(object_count_schema):
     """ Clean and add information to schema once it has been built
 
@@ -204,68 +905,242 @@ def summarize_types(field_schema):
         field_schema['type'] = common_type
 
 
-def init_empty_object_schema():
-    """ Generate an empty object schema.
+class FieldStats(object):
+    """ Counts of a field, while documents are added to an object_schema
 
-    We use a defaultdict of empty fields schema. This avoid to test for the presence of fields.
-    :return: defaultdict(empty_field_schema)
+    Compact form of a field_schema, before post-processing: types are counted in
+    fixed-size lists indexed by type code (see mongo_sql_types.TYPE_STRINGS),
+    and 'array_types_count' and 'object' are None until an array or an object is met.
+    sampled_arrays counts arrays whose 'array_types_count' was extrapolated
+    (see ExtractionSettings). value_stats is a ValueStats once a scalar value is added with values
+    statistics enabled.
     """
-
-    def empty_field_schema():
-        field_dict = {
-            'types_count': defaultdict(int),
-            'count': 0,
+    __slots__ = ('count', 'types_count', 'array_types_count', 'object', 'sampled_arrays',
+                 'value_stats')
+
+    def __init__(self):
+        self.count = 0
+        self.types_count = init_empty_types_count()
+        self.array_types_count = None
+        self.object = None
+        self.sampled_arrays = 0
+        self.value_stats = None
+
+    def __eq__(self, other):
+        return (isinstance(other, FieldStats) and self.count == other.count and
+                self.types_count == other.types_count and
+                self.array_types_count == other.array_types_count and
+                self.object == other.object and self.sampled_arrays == other.sampled_arrays and
+                self.value_stats == other.value_stats)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'FieldStats({})'.format(self.to_dict())
+
+    def to_dict(self, object_count=None):
+        """ Convert to a field_schema dict
+
+        :param object_count: int, default None
+            number of objects the field belongs to. If given, field_schema is post-processed.
+        :return field_schema: dict
+        """
+        field_schema = {
+            'count': self.count,
+            'types_count': types_count_to_dict(self.types_count)
         }
-        return field_dict
+        if self.array_types_count is not None:
+            field_schema['array_types_count'] = types_count_to_dict(self.array_types_count)
+        if self.sampled_arrays:
+            field_schema['sampled_arrays_count'] = self.sampled_arrays
+        if self.value_stats is not None:
+            field_schema['value_stats'] = self.value_stats.to_dict()
+        if object_count is None:
+            if self.object is not None:
+                field_schema['object'] = object_schema_to_dict(self.object)
+            return field_schema
+
+        summarize_types(field_schema)
+        field_schema['prop_in_object'] = round(self.count / float(object_count), 4)
+        if self.object is not None:
+            field_schema['object'] = object_schema_to_dict(self.object, self.count)
+        return field_schema
 
-    empty_object = defaultdict(empty_field_schema)
-    return empty_object
 
+def init_empty_types_count():
+    """ Generate a list of counts for each type code, all set to 0
+
+    :return types_count: list of int
+    """
+    return [0] * len(TYPE_STRINGS)
 
-def add_document_to_object_schema(document, object_schema):
+
+def types_count_to_dict(types_count):
+    """ Convert a list of counts indexed by type code to a dict of counts of encountered types
+
+    :param types_count: list of int
+    :return types_count: dict - {type_string: count}
+    """
+    return {TYPE_STRINGS[type_code]: count
+            for type_code, count in enumerate(types_count) if count}
+
+
+class ObjectStats(dict):
+    """ Counts of the fields of an object, while documents are added: FieldStats by field name
+
+    Missing fields are initialized with empty FieldStats, as with a defaultdict(FieldStats).
+
+    Objects with more than map_max_keys fields, or with at least map_min_keys fields whose keys
+    all match map_key_pattern (see ExtractionSettings), are collapsed: all fields are merged into
+    a single MAP_KEY field, which is then returned for any other key.
+    settings are those of the extraction, shared with nested objects.
+    FieldStats of collapsed fields may still be incremented through counters cached by
+    DocumentShapeCache, thus they are only merged into MAP_KEY field on conversion
+    (see fields_stats).
+    """
+    __slots__ = ('settings', 'collapsed_fields', 'unmatched_keys')
+
+    def __init__(self, settings=DEFAULT_SETTINGS):
+        dict.__init__(self)
+        self.settings = settings
+        self.collapsed_fields = None
+        self.unmatched_keys = 0
+
+    def __missing__(self, field):
+        if MAP_KEY in self:
+            return dict.__getitem__(self, MAP_KEY)
+
+        field_stats = self[field] = FieldStats()
+        if not self.settings.map_key_pattern.match(field):
+            self.unmatched_keys += 1
+        max_keys = self.settings.map_max_keys
+        min_keys = self.settings.map_min_keys
+        if (field == MAP_KEY or (max_keys and len(self) > max_keys) or
+                (min_keys and len(self) >= min_keys and not self.unmatched_keys)):
+            self.collapse()
+            return dict.__getitem__(self, MAP_KEY)
+        return field_stats
+
+    def collapse(self):
+        """ Collapse all fields into the MAP_KEY field"""
+        map_field_stats = self.pop(MAP_KEY, None) or FieldStats()
+        self.collapsed_fields = (self.collapsed_fields or []) + list(self.values())
+        self.clear()
+        self[MAP_KEY] = map_field_stats
+
+    def fields_stats(self):
+        """ Get FieldStats by field name, with collapsed fields merged into MAP_KEY field
+
+        :return fields_stats: dict
+        """
+        if not self.collapsed_fields:
+            return self
+        map_field_stats = FieldStats()
+        for field_stats in [self[MAP_KEY]] + self.collapsed_fields:
+            add_field_schema_to_field_stats(field_stats.to_dict(), map_field_stats,
+                                            self.settings)
+        return {MAP_KEY: map_field_stats}
+
+
+def init_empty_object_schema(settings=None):
+    """ Generate an empty object schema.
+
+    We use an ObjectStats, initializing missing fields with empty FieldStats.
+    This avoid to test for the presence of fields.
+    :param settings: ExtractionSettings, default None
+        settings of the extraction. By default, DEFAULT_SETTINGS.
+    :return: ObjectStats
+    """
+    return ObjectStats(settings or DEFAULT_SETTINGS)
+
+
+def add_document_to_object_schema(document, object_schema, depth=1):
     """ Add a all fields of a document to a local object_schema.
 
     :param document: dict
     contains a MongoDB Object
     :param object_schema: dict
+    initialized with init_empty_object_schema, whose settings apply
+    :param depth: int, default 1 - depth of the fields of document
     """
+    settings = object_schema.settings
     for field, value in document.items():
-        add_value_to_field_schema(value, object_schema[field])
+        add_value_to_field_schema(value, object_schema[field], depth, settings)
 
 
-def add_value_to_field_schema(value, field_schema):
+def add_value_to_field_schema(value, field_schema, depth=1, settings=DEFAULT_SETTINGS):
     """ Add a value to a field_schema
 
     - Update count or 'null_count' count.
     - Define or check the type of value.
+    - Add scalar values to 'value_stats', if enabled in settings.
     - Recursively add 'list' and 'dict' value to the schema.
 
     :param value:
     value corresponding to a field in a MongoDB Object
-    :param field_schema: dict
-    subdictionary of the global schema dict corresponding to a field
+    :param field_schema: FieldStats
+    counts of the field in the global schema
+    :param depth: int, default 1 - depth of the field
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
     """
-    field_schema['count'] += 1
+    field_schema.count += 1
     add_value_type(value, field_schema)
-    add_potential_list_to_field_schema(value, field_schema)
-    add_potential_document_to_field_schema(value, field_schema)
+    # Elements of long arrays are sampled once, so that types counts and values statistics
+    # describe the same elements
+    elements = sample_array_elements(value, settings) if isinstance(value, list) else None
+    if settings.value_stats:
+        add_value_to_value_stats(value, field_schema, settings, elements)
+    add_potential_list_to_field_schema(value, field_schema, depth, settings, elements)
+    add_potential_document_to_field_schema(value, field_schema, depth, settings)
 
 
-def add_potential_document_to_field_schema(document, field_schema):
+def add_value_to_value_stats(value, field_schema, settings=DEFAULT_SETTINGS, elements=None):
+    """ Add a scalar value, or the scalar elements of an array, to the value_stats of a field
+
+    Only the elements of long arrays examined according to settings are added.
+
+    :param value:
+    :param field_schema: FieldStats
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+    :param elements: list, default None
+        elements of value to examine, if an array. By default, sampled according to settings.
+    """
+    if isinstance(value, dict):
+        return
+    if not isinstance(value, list):
+        elements = (value,)
+    elif elements is None:
+        elements = sample_array_elements(value, settings)
+    value_stats = field_schema.value_stats
+    for element in elements:
+        if not isinstance(element, (list, dict)):
+            if value_stats is None:
+                value_stats = field_schema.value_stats = ValueStats(settings.top_values)
+            value_stats.add(element)
+
+
+def add_potential_document_to_field_schema(document, field_schema, depth=1,
+                                           settings=DEFAULT_SETTINGS):
     """ Add a document to a field_schema
 
-    - Exit if document is not a dict
+    - Exit if document is not a dict, or if the field is at the maximum depth
 
     :param document: dict (or skipped)
-    :param field_schema:
+    :param field_schema: FieldStats
+    :param depth: int, default 1 - depth of the field
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
     """
     if isinstance(document, dict):
-        if 'object' not in field_schema:
-            field_schema['object'] = init_empty_object_schema()
-        add_document_to_object_schema(document, field_schema['object'])
+        if settings.max_depth and depth >= settings.max_depth:
+            return
+        if field_schema.object is None:
+            field_schema.object = init_empty_object_schema(settings)
+        add_document_to_object_schema(document, field_schema.object, depth + 1)
 
 
-def add_potential_list_to_field_schema(value_list, field_schema):
+def add_potential_list_to_field_schema(value_list, field_schema, depth=1,
+                                       settings=DEFAULT_SETTINGS, elements=None):
     """ Add a list of values to a field_schema
 
     - Exit if value_list is not a list
@@ -273,27 +1148,361 @@ def add_potential_list_to_field_schema(value_list, field_schema):
     - Recursively add 'dict' values to the schema.
 
     :param value_list: list (or skipped)
-    :param field_schema: dict
+    :param field_schema: FieldStats
+    :param depth: int, default 1 - depth of the field
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+    :param elements: list, default None
+        elements of value_list to examine. By default, sampled according to settings.
     """
     if isinstance(value_list, list):
-        if 'array_types_count' not in field_schema:
-            field_schema['array_types_count'] = defaultdict(int)
+        if field_schema.array_types_count is None:
+            field_schema.array_types_count = init_empty_types_count()
 
         if not value_list:
             add_value_type(None, field_schema, type_str='array_types_count')
 
+        max_elements = settings.max_array_elements
+        if max_elements and len(value_list) > max_elements:
+            add_sampled_list_to_field_schema(value_list, field_schema, depth, settings, elements)
+            return
+
         for value in value_list:
             add_value_type(value, field_schema, type_str='array_types_count')
-            add_potential_document_to_field_schema(value, field_schema)
+            add_potential_document_to_field_schema(value, field_schema, depth, settings)
+
+
+def add_sampled_list_to_field_schema(value_list, field_schema, depth=1,
+                                     settings=DEFAULT_SETTINGS, elements=None):
+    """ Add some elements of a long list to a field_schema, extrapolating their types counts
+
+    :param value_list: list
+    :param field_schema: FieldStats
+    :param depth: int, default 1 - depth of the field
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+    :param elements: list, default None
+        elements of value_list to examine. By default, sampled according to settings.
+    """
+    if elements is None:
+        elements = sample_array_elements(value_list, settings)
+    types_count = init_empty_types_count()
+    for value in elements:
+        types_count[get_type_code(value)] += 1
+        add_potential_document_to_field_schema(value, field_schema, depth, settings)
+    for type_code, count in enumerate(extrapolate_counts(types_count, len(value_list))):
+        field_schema.array_types_count[type_code] += count
+    field_schema.sampled_arrays += 1
+
+
+def sample_array_elements(array, settings=DEFAULT_SETTINGS):
+    """ Get the elements of an array to examine, according to settings
+
+    :param array: list
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+    :return elements: list
+    """
+    max_elements = settings.max_array_elements
+    if not max_elements or len(array) <= max_elements:
+        return array
+    if settings.array_sampling == 'random':
+        return random.sample(array, max_elements)
+    return array[:max_elements]
+
+
+def extrapolate_counts(counts, total):
+    """ Scale counts so that they sum to total, keeping integers
+
+    The rounding remainder is given to the greatest count.
+
+    >>> extrapolate_counts([2, 1, 0], 10)
+    [7, 3, 0]
+
+    :param counts: list of int
+    :param total: int
+    :return extrapolated_counts: list of int
+    """
+    counts_sum = sum(counts)
+    extrapolated_counts = [count * total // counts_sum for count in counts]
+    greatest = counts.index(max(counts))
+    extrapolated_counts[greatest] += total - sum(extrapolated_counts)
+    return extrapolated_counts
 
 
 def add_value_type(value, field_schema, type_str='types_count'):
     """ Define the type_str in field_schema, or check it is equal to the one previously defined.
 
     :param value:
-    :param field_schema: dict
+    :param field_schema: FieldStats
     :param type_str: str, either 'types_count' or 'array_types_count'
 
     """
-    value_type_str = get_type_string(value)
-    field_schema[type_str][value_type_str] += 1
+    if type_str == 'types_count':
+        field_schema.types_count[get_type_code(value)] += 1
+    else:
+        field_schema.array_types_count[get_type_code(value)] += 1
+
+
+class DocumentShapeCache(object):
+    """ Add documents to an object_schema, caching the counters incremented by each document shape
+
+    Most documents of a collection share a few exact layouts of fields and types: their shape.
+    The first time a shape is met, the object_schema is walked to get the flat list of counters
+    a document of this shape increments. Next documents of this shape are only counted,
+    and counters are incremented by this count when the shape leaves the cache, or on flush.
+
+    Shapes are kept in a least recently used cache of max_size shapes,
+    to bound memory with polymorphic collections.
+
+    If most documents have distinct shapes, the cache stops being used.
+    Counts of object_schema are only complete after a call to flush.
+    """
+    # Number of distinct shapes met before checking that the cache is hit more often than missed
+    MIN_MISSES_TO_DISABLE = 100
+
+    def __init__(self, object_schema, max_size=1024):
+        """
+        :param object_schema: dict - initialized with init_empty_object_schema
+        :param max_size: int, default 1024 - maximum number of cached shapes
+        """
+        self.object_schema = object_schema
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._shapes = OrderedDict()  # {shape: [counters, number of documents not yet counted]}
+
+    def add_document(self, document):
+        """ Add a document to the object_schema, like add_document_to_object_schema
+
+        :param document: dict
+        """
+        if self.misses > self.MIN_MISSES_TO_DISABLE and self.misses > self.hits:
+            # Too many distinct shapes for the cache to be worth it
+            add_document_to_object_schema(document, self.object_schema)
+            return
+
+        try:
+            shape = document_shape(document, self.object_schema.settings.max_array_elements)
+        except UncacheableDocument:
+            add_document_to_object_schema(document, self.object_schema)
+            return
+        cached_shape = self._shapes.get(shape)
+        if cached_shape is not None:
+            self.hits += 1
+            cached_shape[1] += 1
+            self._shapes.move_to_end(shape)
+            return
+
+        self.misses += 1
+        self._shapes[shape] = [document_counters(document, self.object_schema), 1]
+        if len(self._shapes) > self.max_size:
+            _, (counters, documents_count) = self._shapes.popitem(last=False)
+            _increment_counters(counters, documents_count)
+
+    def flush(self):
+        """ Increment counters of object_schema with the documents counted for each cached shape"""
+        for cached_shape in self._shapes.values():
+            _increment_counters(cached_shape[0], cached_shape[1])
+            cached_shape[1] = 0
+
+
+def _increment_counters(counters, documents_count):
+    """ Increment counters for documents_count documents of the same shape"""
+    if documents_count:
+        fields_counters, types_counters = counters
+        for field_schema, increment in fields_counters:
+            field_schema.count += increment * documents_count
+        for types_count, type_code, increment in types_counters:
+            types_count[type_code] += increment * documents_count
+
+
+# Types of values which are neither dict nor list, and thus have no nested shape.
+# It is completed as new types are met.
+_SCALAR_TYPES = set(PYMONGO_TYPE_TO_TYPE_STRING) - {dict, list}
+
+
+class UncacheableDocument(Exception):
+    """ Raised by document_shape for documents whose counters depend on more than their shape:
+    documents with arrays longer than max_array_elements"""
+
+
+def document_shape(document, max_array_elements=0):
+    """ Hashable fingerprint of the fields and types of a document, recursively
+
+    >>> document_shape({'a': 1, 'b': 'c'})
+    (('a', 'b'), (<class 'int'>, <class 'str'>))
+
+    :param document: dict
+    :param max_array_elements: int, default 0
+        UncacheableDocument is raised for arrays longer than this, if not 0
+    :return shape: tuple
+    """
+    value_types = tuple(map(type, document.values()))
+    if _SCALAR_TYPES.issuperset(value_types):
+        return tuple(document), value_types
+    return (tuple(document), value_types,
+            tuple([_nested_shape(value, max_array_elements) for value in document.values()]))
+
+
+def _array_shape(array, max_array_elements=0):
+    """ Hashable fingerprint of the types of the elements of an array, recursively"""
+    if max_array_elements and len(array) > max_array_elements:
+        raise UncacheableDocument()
+    value_types = tuple(map(type, array))
+    if _SCALAR_TYPES.issuperset(value_types):
+        return value_types
+    return value_types, tuple([_nested_shape(value, max_array_elements) for value in array])
+
+
+def _nested_shape(value, max_array_elements=0):
+    """ Hashable fingerprint of the content of a dict or a list, None for other values"""
+    if type(value) in _SCALAR_TYPES:
+        return None
+    if isinstance(value, dict):
+        return document_shape(value, max_array_elements)
+    if isinstance(value, list):
+        return _array_shape(value, max_array_elements)
+    _SCALAR_TYPES.add(type(value))
+    return None
+
+
+def document_counters(document, object_schema):
+    """ Get the counters of object_schema that adding document increments
+
+    Missing fields, 'array_types_count' and 'object' are created in object_schema on the way.
+
+    :param document: dict
+    :param object_schema: dict
+    :return fields_counters, types_counters: list of (FieldStats, increment) tuples for counts,
+        and list of (types_count list, type_code, increment) tuples for types counts
+    """
+    increments = OrderedDict()
+    _add_document_counters(document, object_schema, increments)
+    fields_counters = [(field_schema, increment)
+                       for (field_schema, type_code), increment in increments.values()
+                       if type_code is None]
+    types_counters = [(types_count, type_code, increment)
+                      for (types_count, type_code), increment in increments.values()
+                      if type_code is not None]
+    return fields_counters, types_counters
+
+
+def _add_document_counters(document, object_schema, increments, depth=1):
+    """ Walk document as add_document_to_object_schema, counting increments of each counter"""
+    settings = object_schema.settings
+    for field, value in document.items():
+        field_schema = object_schema[field]
+        _add_counter(increments, field_schema, None)
+        _add_counter(increments, field_schema.types_count, get_type_code(value))
+
+        if isinstance(value, list):
+            if field_schema.array_types_count is None:
+                field_schema.array_types_count = init_empty_types_count()
+            if not value:
+                _add_counter(increments, field_schema.array_types_count, get_type_code(None))
+            for element in value:
+                _add_counter(increments, field_schema.array_types_count, get_type_code(element))
+                _add_potential_document_counters(element, field_schema, increments, depth,
+                                                 settings)
+
+        _add_potential_document_counters(value, field_schema, increments, depth, settings)
+
+
+def _add_potential_document_counters(document, field_schema, increments, depth=1,
+                                     settings=DEFAULT_SETTINGS):
+    """ Walk document as add_potential_document_to_field_schema, counting increments"""
+    if isinstance(document, dict):
+        if settings.max_depth and depth >= settings.max_depth:
+            return
+        if field_schema.object is None:
+            field_schema.object = init_empty_object_schema(settings)
+        _add_document_counters(document, field_schema.object, increments, depth + 1)
+
+
+def _add_counter(increments, counts, type_code):
+    """ Count one more increment of counts[type_code], or of counts.count if type_code is None"""
+    counter_id = (id(counts), type_code)
+    if counter_id in increments:
+        increments[counter_id][1] += 1
+    else:
+        increments[counter_id] = [(counts, type_code), 1]
+
+
+class SchemaConvergence(object):
+    """ Tell when successive documents stop bringing new fields or types
+
+    Paths of fields, with their types, are collected from documents whose shape was not met yet
+    (see document_shape). The schema has converged once documents_size documents in a row brought
+    no new (path, type).
+
+    Seeing no new (path, type) in N random documents bounds how frequent a missed one can be:
+    with 95% confidence, each (path, type) not met occurs in less than 3 / N of documents.
+    """
+    # Number of distinct shapes kept, to bound memory with polymorphic collections
+    MAX_SHAPES = 10 ** 5
+
+    def __init__(self, documents_size, settings=DEFAULT_SETTINGS):
+        """
+        :param documents_size: int - number of documents in a row without new (path, type)
+        :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+            settings of the extraction, for the elements of long arrays to examine
+        """
+        self.documents_size = documents_size
+        self.settings = settings
+        self.documents_without_new = 0
+        self._shapes = set()
+        self._paths_types = set()
+
+    def add_document(self, document):
+        """ Add a document, and tell if the schema has converged
+
+        :param document: dict
+        :return converged: bool
+        """
+        try:
+            shape = document_shape(document, self.settings.max_array_elements)
+        except UncacheableDocument:
+            shape = None
+        if shape is None or shape not in self._shapes:
+            if len(self._shapes) >= self.MAX_SHAPES:
+                self._shapes.clear()
+            if shape is not None:
+                self._shapes.add(shape)
+            paths_types = document_paths_types(document, self.settings)
+            if not self._paths_types.issuperset(paths_types):
+                self._paths_types.update(paths_types)
+                self.documents_without_new = 0
+                return False
+
+        self.documents_without_new += 1
+        return self.documents_without_new >= self.documents_size
+
+
+def document_paths_types(document, settings=DEFAULT_SETTINGS):
+    """ Set of the paths of the values of a document, with their types, recursively
+
+    >>> sorted(document_paths_types({'a': [1, {'b': None}]}))
+    [(('a',), False, 0), (('a',), True, 1), (('a',), True, 4), (('a', 'b'), False, 2)]
+
+    :param document: dict
+    :param settings: ExtractionSettings, default DEFAULT_SETTINGS
+        Only the elements of long arrays examined according to settings are walked
+    :return paths_types: set of (path tuple, in array, type_code) tuples
+    """
+    paths_types = set()
+    _add_document_paths_types(document, (), paths_types, settings)
+    return paths_types
+
+
+def _add_document_paths_types(document, path, paths_types, settings=DEFAULT_SETTINGS):
+    """ Add (path, in array, type_code) of the values of document to paths_types"""
+    for field, value in document.items():
+        field_path = path + (field,)
+        paths_types.add((field_path, False, get_type_code(value)))
+        if isinstance(value, list):
+            if not value:
+                paths_types.add((field_path, True, get_type_code(None)))
+            for element in sample_array_elements(value, settings):
+                paths_types.add((field_path, True, get_type_code(element)))
+                if isinstance(element, dict):
+                    _add_document_paths_types(element, field_path, paths_types, settings)
+        elif isinstance(value, dict):
+            _add_document_paths_types(value, field_path, paths_types, settings)
@@ -0,0 +1,144 @@
+# coding: utf8
+"""
+This module intends to extract schemas incrementally, from the documents added since a previous
+extraction.
+
+Each collection schema records a 'watermark': the greatest value of an indexed key
+(_id by default, whose ObjectId grow with insertion time, or a timestamp field)
+among the documents it counts:
+    {
+        "key": "_id",
+        "value": {"$oid": "..."}  # extended JSON, so that any output format can write it
+    }
+
+An incremental extraction only scans documents whose key is greater than the watermark of the
+previous schema, and merges their counts into it (see merge module).
+Updated and deleted documents are thus not taken into account: it suits append-mostly collections.
+Range queries only match values of the same BSON type as their bound, so documents whose key
+is missing or of another type are never scanned.
+"""
+import json
+import logging
+
+from bson import json_util
+from past.builtins import basestring
+
+from pymongo_schema.extract import (get_extraction_settings, init_empty_object_schema,
+                                    list_collection_names, object_schema_to_dict, scan_collection)
+from pymongo_schema.merge import merge_collection_schemas
+from pymongo_schema.sampling import first_key_value
+
+logger = logging.getLogger(__name__)
+
+
+def extract_pymongo_client_schema_incremental(pymongo_client, previous_schema=None,
+                                              database_names=None, collection_names=None,
+                                              watermark_key='_id', **kwargs):
+    """ Extract the schema of the documents added since previous_schema, and merge it in
+
+    Collections are extracted one after the other: workers and partitions options are ignored.
+
+    :param pymongo_client: pymongo.mongo_client.MongoClient
+    :param previous_schema: dict, default None
+        Post-processed mongo schema with counts, from a previous (incremental) extraction.
+        Collections without a watermark of watermark_key in it are fully scanned again.
+    :param database_names: str, list of str, default None
+    :param collection_names: str, list of str, default None
+    :param watermark_key: str, default '_id' - indexed field
+    :param kwargs: scan options for all collections, see extract.scan_collection
+        Documents cannot be sampled. Query is built from watermarks.
+    :return mongo_schema: dict
+    """
+    if kwargs.get('sample_size') or kwargs.get('convergence_size'):
+        raise ValueError('Incremental extraction cannot sample documents')
+    previous_schema = previous_schema or dict()
+    for option in ['workers', 'client_kwargs', 'partitions']:
+        kwargs.pop(option, None)
+
+    if isinstance(database_names, basestring):
+        database_names = [database_names]
+
+    if database_names is None:
+        database_names = pymongo_client.list_database_names()
+        database_names.remove('admin')
+        database_names.remove('local')
+
+    mongo_schema = dict()
+    for database in database_names:
+        logger.info('Extract schema of database %s incrementally', database)
+        pymongo_database = pymongo_client[database]
+        database_schema = dict()
+        for collection in list_collection_names(pymongo_database, collection_names):
+            logger.info('...collection %s', collection)
+            database_schema[collection] = extract_collection_schema_incremental(
+                pymongo_database[collection], previous_schema.get(database, {}).get(collection),
+                watermark_key, **kwargs)
+        if database_schema:
+            mongo_schema[database] = database_schema
+    return mongo_schema
+
+
+def extract_collection_schema_incremental(pymongo_collection, previous_collection_schema=None,
+                                          watermark_key='_id', **kwargs):
+    """ Extract the schema of the documents added to a collection since its previous schema
+
+    Documents with a watermark_key up to its greatest value when the extraction starts are scanned,
+    so that documents added meanwhile are left to the next extraction.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param previous_collection_schema: dict, default None
+    :param watermark_key: str, default '_id'
+    :param kwargs: scan options, see extract.scan_collection
+    :return collection_schema: dict
+    """
+    lower = None
+    previous_watermark = (previous_collection_schema or {}).get('watermark')
+    if previous_watermark and previous_watermark['key'] == watermark_key:
+        lower = decode_watermark_value(previous_watermark['value'])
+    elif previous_collection_schema is not None:
+        logger.warning('Previous schema of collection %s has no watermark of %s, scan it again',
+                       pymongo_collection.name, watermark_key)
+        previous_collection_schema = None
+
+    upper = first_key_value(pymongo_collection, {}, watermark_key, -1)
+    condition = {}
+    if lower is not None:
+        condition['$gt'] = lower
+    if upper is not None:
+        condition['$lte'] = upper
+
+    settings = get_extraction_settings(**kwargs)
+    object_schema = init_empty_object_schema(settings)
+    scanned = 0
+    if upper is not None:
+        logger.info('   scan documents with %s in %s', watermark_key, condition)
+        scanned = scan_collection(pymongo_collection, object_schema,
+                                  query={watermark_key: condition}, **kwargs)
+    collection_schema = {'count': scanned,
+                         'object': object_schema_to_dict(object_schema, scanned)}
+    if previous_collection_schema is not None:
+        collection_schema = merge_collection_schemas(
+            previous_collection_schema, collection_schema, settings.map_detection)
+    watermark_value = upper if scanned else lower
+    if watermark_value is not None:
+        collection_schema['watermark'] = {'key': watermark_key,
+                                          'value': encode_watermark_value(watermark_value)}
+    return collection_schema
+
+
+def encode_watermark_value(value):
+    """ Encode a watermark value to extended JSON (ObjectId, datetime, ...)
+
+    :param value:
+    :return encoded_value: json serializable value
+    """
+    return json.loads(json_util.dumps(value))
+
+
+def decode_watermark_value(encoded_value):
+    """ Decode a watermark value from extended JSON
+
+    :param encoded_value: json serializable value
+    :return value:
+    """
+    return json_util.loads(json.dumps(encoded_value))
@@ -0,0 +1,231 @@
+# coding: utf8
+"""
+This module intends to extract schemas from JSON Lines files, such as mongoexport output,
+without any MongoDB server.
+
+Each line holds a document in MongoDB Extended JSON ({"$oid": ...}, {"$date": ...}, ...),
+decoded with bson.json_util, so that types match those of documents read from MongoDB.
+Lines without any '$' key are decoded with json module only, which is much faster.
+
+Files are streamed through a pipeline of generators (lines, documents, object_schema),
+so that memory does not depend on file size. Files compressed with gzip (.gz) or
+zstandard (.zst, needs zstandard package) are read as streams.
+Uncompressed files are split into byte ranges, aligned on lines by the worker scanning them,
+so that large files are parsed in parallel.
+
+Each file holds the documents of a collection, named after the file (users.json.gz: 'users'),
+of a database named after the directory of the file, unless given.
+"""
+import gzip
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from bson import json_util
+from past.builtins import basestring
+
+from pymongo_schema.extract import (DEFAULT_MAP_KEY_PATTERN, DocumentShapeCache,
+                                    ExtractionSettings, add_document_to_object_schema,
+                                    add_object_schema_to_object_schema, init_empty_object_schema,
+                                    object_schema_to_dict)
+
+logger = logging.getLogger(__name__)
+
+# Size of byte ranges of uncompressed files scanned by workers
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+COMPRESSION_EXTENSIONS = ['.gz', '.zst']
+JSON_EXTENSIONS = ['.json', '.jsonl', '.ndjson']
+
+
+def extract_json_lines_schema(paths, database_name=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                              shape_cache_size=1024, map_max_keys=1000, map_min_keys=20,
+                              map_key_pattern=DEFAULT_MAP_KEY_PATTERN):
+    """ Extract the schema of collections exported in JSON Lines files
+
+    :param paths: str, list of str - JSON Lines files, one by collection
+    :param database_name: str, default None
+        Database of all collections. Default to the name of the directory of each file.
+    :param workers: int, default 1
+        Number of processes parsing byte ranges of files concurrently
+    :param chunk_size: int, default DEFAULT_CHUNK_SIZE
+        Size in bytes of the ranges uncompressed files are split into
+    :param shape_cache_size: int, default 1024
+        Maximum number of documents shapes cached by range (see extract.DocumentShapeCache).
+        0 disables the cache.
+    :param map_max_keys: int, default 1000
+    :param map_min_keys: int, default 20
+    :param map_key_pattern: str, default DEFAULT_MAP_KEY_PATTERN
+        Detection of map-like objects, see extract.ExtractionSettings
+    :return mongo_schema: dict
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    scan_kwargs = {'shape_cache_size': shape_cache_size,
+                   'settings': ExtractionSettings(map_max_keys, map_min_keys, map_key_pattern)}
+
+    scans = []
+    for path in paths:
+        database, collection = json_lines_namespace(path, database_name)
+        scans += [(database, collection, path, start, end)
+                  for start, end in split_json_lines_file(path, chunk_size)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_scan_json_lines_range, scans, repeat(scan_kwargs)))
+    else:
+        results = map(_scan_json_lines_range, scans, repeat(scan_kwargs))
+
+    namespaces_schemas = dict()
+    mongo_schema = dict()
+    # Partial schemas are merged with the map detection of workers
+    for (database, collection, _, _, _), (scanned, object_schema) in zip(scans, results):
+        namespace_schema = namespaces_schemas.setdefault(
+            (database, collection), [0, init_empty_object_schema(scan_kwargs['settings'])])
+        namespace_schema[0] += scanned
+        add_object_schema_to_object_schema(object_schema, namespace_schema[1])
+
+    for (database, collection), (count, object_schema) in sorted(namespaces_schemas.items()):
+        mongo_schema.setdefault(database, dict())[collection] = {
+            'count': count,
+            'object': object_schema_to_dict(object_schema, count)
+        }
+    return mongo_schema
+
+
+def json_lines_namespace(path, database_name=None):
+    """ Get the (database, collection) namespace of a JSON Lines file
+
+    >>> json_lines_namespace('/exports/shop/users.json.gz')
+    ('shop', 'users')
+
+    :param path: str
+    :param database_name: str, default None - default to the name of the directory of the file
+    :return namespace: (database, collection) tuple
+    """
+    collection = os.path.basename(path)
+    for extensions in [COMPRESSION_EXTENSIONS, JSON_EXTENSIONS]:
+        for extension in extensions:
+            if collection.endswith(extension):
+                collection = collection[:-len(extension)]
+                break
+    if database_name is None:
+        database_name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return database_name, collection
+
+
+def split_json_lines_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Split a JSON Lines file into byte ranges of chunk_size bytes
+
+    Ranges are not aligned on lines: a line belongs to the range it starts in (see iterate_lines).
+    Compressed files cannot be split: they are a single range, whose end is None.
+
+    :param path: str
+    :param chunk_size: int, default DEFAULT_CHUNK_SIZE
+    :return ranges: list of (start, end) tuples
+    """
+    if any(path.endswith(extension) for extension in COMPRESSION_EXTENSIONS):
+        return [(0, None)]
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)] or [(0, 0)]
+
+
+def _scan_json_lines_range(scan, scan_kwargs):
+    """ Add the documents of a byte range of a JSON Lines file to an object_schema,
+    possibly in a worker process
+
+    :param scan: (database, collection, path, start, end) tuple
+    :param scan_kwargs: dict - shape_cache_size and settings (extract.ExtractionSettings)
+    :return scanned, object_schema: int, dict - object_schema as regular dicts
+    """
+    database, collection, path, start, end = scan
+    logger.info('...collection %s.%s from %s, bytes %s to %s', database, collection, path,
+                start, end if end is not None else 'end')
+    object_schema = init_empty_object_schema(scan_kwargs['settings'])
+    with open_json_lines(path) as stream:
+        documents = decode_json_lines(iterate_lines(stream, start, end))
+        scanned = add_documents_to_object_schema(documents, object_schema,
+                                                 scan_kwargs['shape_cache_size'])
+    return scanned, object_schema_to_dict(object_schema)
+
+
+def open_json_lines(path):
+    """ Open a JSON Lines file as a binary stream, decompressing .gz and .zst files
+
+    :param path: str
+    :return stream: file-like object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading zstandard compressed file {} needs zstandard package: '
+                              'pip install zstandard'.format(path))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def iterate_lines(stream, start=0, end=None):
+    """ Iterate over the lines starting in a byte range of a stream
+
+    The line going over start, if any, belongs to the previous range and is skipped.
+
+    :param stream: binary file-like object, seekable if start is not 0
+    :param start: int, default 0
+    :param end: int, default None - by default, up to the end of stream
+    :return lines: iterator of bytes
+    """
+    position = start
+    if start:
+        stream.seek(start - 1)
+        position += len(stream.readline()) - 1
+    for line in stream:
+        if end is not None and position >= end:
+            return
+        position += len(line)
+        yield line
+
+
+def decode_json_lines(lines):
+    """ Decode Extended JSON documents, one by line, skipping blank lines
+
+    :param lines: iterable of bytes or str
+    :return documents: iterator of dict
+    """
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            if b'"$' in line if isinstance(line, bytes) else '"$' in line:
+                yield json_util.loads(line)
+            else:
+                yield json.loads(line)
+        except ValueError as e:
+            raise ValueError('Invalid JSON document at line {} of range: {}'.format(i + 1, e))
+
+
+def add_documents_to_object_schema(documents, object_schema, shape_cache_size=1024):
+    """ Add documents to an object_schema, caching the counters of their shapes
+
+    :param documents: iterable of dict
+    :param object_schema: dict
+    :param shape_cache_size: int, default 1024 - 0 disables the cache
+    :return count: int - number of documents added
+    """
+    shape_cache = DocumentShapeCache(object_schema, shape_cache_size) if shape_cache_size else None
+    count = 0
+    for document in documents:
+        if shape_cache:
+            shape_cache.add_document(document)
+        else:
+            add_document_to_object_schema(document, object_schema)
+        count += 1
+        if count % 10 ** 5 == 0:
+            logger.info('   scanned %s documents', count)
+    if shape_cache:
+        shape_cache.flush()
+    return count
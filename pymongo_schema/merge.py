@@ -0,0 +1,123 @@
+# coding: utf8
+"""
+This module intends to merge mongo schemas (from extract module), extracted from distinct documents.
+
+Counts of both schemas are summed, then types and proportions in objects are computed again.
+Proportions are computed from the number of analyzed documents of sampled schemas,
+whose distinct sampling strategies are listed in 'sampling'.
+Merge is associative and commutative, so that partial schemas (from shards, _id ranges or
+successive days) can be reduced in any order into the schema of all their documents.
+
+Merge is a union of fields: objects are not collapsed into a MAP_KEY field, unless one of the
+schemas already has one in this object, or map detection thresholds are given.
+"""
+from copy import deepcopy
+
+from pymongo_schema.extract import (ExtractionSettings, init_empty_object_schema,
+                                    add_object_schema_to_object_schema, object_schema_to_dict)
+
+# Map detection of merges by default, see extract.ExtractionSettings: no threshold
+UNION_MAP_DETECTION = (0, 0)
+
+
+def merge_schemas(schema, other_schema, map_detection=None, level=None):
+    """ Merge two post-processed schemas of the same level
+
+    Schemas can either be mongo schemas, database schemas or collection schemas.
+    Databases, collections and fields present in only one schema are kept as is.
+
+    >>> merge_schemas({'db': {'coll': {'count': 1, 'object': {}}}},\
+                      {'db': {'coll': {'count': 2, 'object': {}}}})
+    {'db': {'coll': {'count': 3, 'object': {}}}}
+
+    :param schema: dict
+    :param other_schema: dict
+    :param map_detection: tuple, default None
+        (map_max_keys, map_min_keys[, map_key_pattern]) arguments of extract.ExtractionSettings,
+        to collapse map-like objects of the merged schema.
+        By default only objects of which a schema has a MAP_KEY field are collapsed.
+    :param level: str, default None
+        'mongo', 'database' or 'collection'. By default detected from schemas, see schema_level.
+    :return merged_schema: dict - a new schema, input schemas are not modified
+    """
+    if level is None:
+        level = schema_level(schema, other_schema)
+    if level == 'collection':
+        return merge_collection_schemas(schema, other_schema, map_detection)
+
+    names_level = 'database' if level == 'mongo' else 'collection'
+    merged_schema = dict()
+    for name in set(schema) | set(other_schema):
+        if name not in other_schema:
+            merged_schema[name] = deepcopy(schema[name])
+        elif name not in schema:
+            merged_schema[name] = deepcopy(other_schema[name])
+        else:
+            merged_schema[name] = merge_schemas(schema[name], other_schema[name], map_detection,
+                                                names_level)
+    return merged_schema
+
+
+def schema_level(*schemas):
+    """ Detect the level of schemas: 'collection', 'database' or 'mongo'
+
+    Collection schemas have an integer 'count' and an 'object', while databases and collections
+    may be named 'count' or 'object'.
+
+    >>> schema_level({'object': {'count': 1, 'object': {}}})
+    'database'
+
+    :param schemas: dicts
+    :return level: str
+    """
+    if any(is_collection_schema(schema) for schema in schemas):
+        return 'collection'
+    if any(is_collection_schema(value) for schema in schemas for value in schema.values()):
+        return 'database'
+    return 'mongo'
+
+
+def is_collection_schema(schema):
+    """ Check if a schema is a collection schema, with an integer 'count' and an 'object'
+
+    :param schema: dict
+    :return bool
+    """
+    return (isinstance(schema, dict) and isinstance(schema.get('count'), int) and
+            isinstance(schema.get('object'), dict))
+
+
+def merge_collection_schemas(collection_schema, other_collection_schema, map_detection=None):
+    """ Merge two post-processed collection schemas
+
+    :param collection_schema: dict
+    :param other_collection_schema: dict
+    :param map_detection: tuple, default None - see merge_schemas
+    :return merged_collection_schema: dict
+    """
+    merged_object_schema = init_empty_object_schema(
+        ExtractionSettings(*(map_detection or UNION_MAP_DETECTION)))
+    merged_collection_schema = dict()
+    try:
+        merged_collection_schema['count'] = (collection_schema['count'] +
+                                             other_collection_schema['count'])
+        if 'analyzed_count' in collection_schema or 'analyzed_count' in other_collection_schema:
+            merged_collection_schema['analyzed_count'] = (
+                collection_schema.get('analyzed_count', collection_schema['count']) +
+                other_collection_schema.get('analyzed_count', other_collection_schema['count']))
+        # Samplings of merged schemas are lists of strategies
+        samplings = set(strategy
+                        for schema in [collection_schema, other_collection_schema]
+                        if 'sampling' in schema for strategy in schema['sampling'].split(', '))
+        if samplings:
+            merged_collection_schema['sampling'] = ', '.join(sorted(samplings))
+        object_schemas = [collection_schema['object'], other_collection_schema['object']]
+    except KeyError as e:
+        raise ValueError("Only schemas with counts can be merged. Missing key {}".format(e))
+
+    for object_schema in object_schemas:
+        add_object_schema_to_object_schema(object_schema, merged_object_schema)
+    merged_collection_schema['object'] = object_schema_to_dict(
+        merged_object_schema,
+        merged_collection_schema.get('analyzed_count', merged_collection_schema['count']))
+    return merged_collection_schema
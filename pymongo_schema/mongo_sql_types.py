@@ -8,7 +8,7 @@ Module grouping all TYPE's related issues
 
  - type_string_tree, to get the least common parent type_string from a list of type_string
     - used in extract while post-processing
-    - to be refactored
+    - precomputed as a table of the least common parent of each pair of type_string
 
  - mapping from type_string to psql_type
     - used while mapping mongo_schema tosql
@@ -16,9 +16,9 @@ Module grouping all TYPE's related issues
 """
 
 import logging
+from collections import OrderedDict
 
 import bson
-from ete4 import Tree
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +49,76 @@ try:
 except NameError:
     pass
 
+# Type codes: index of each type_string in TYPE_STRINGS.
+# Counts of types are kept in fixed-size lists indexed by type code while extracting.
+TYPE_STRINGS = tuple(OrderedDict.fromkeys(list(PYMONGO_TYPE_TO_TYPE_STRING.values()) +
+                                          ['unknown']))
+TYPE_STRING_TO_TYPE_CODE = {type_string: type_code
+                            for type_code, type_string in enumerate(TYPE_STRINGS)}
+PYMONGO_TYPE_TO_TYPE_CODE = {pymongo_type: TYPE_STRING_TO_TYPE_CODE[type_string]
+                             for pymongo_type, type_string in PYMONGO_TYPE_TO_TYPE_STRING.items()}
+
+# Mapping from BSON type aliases (as returned by $type aggregation operator) to type_string.
+# Values are typed as they would be once decoded by pymongo, then mapped with
+# PYMONGO_TYPE_TO_TYPE_STRING ('missing' is returned for empty arrays, typed as 'null').
+BSON_TYPE_ALIAS_TO_TYPE_STRING = {
+    'array': 'ARRAY',
+    'object': 'OBJECT',
+    'null': 'null',
+    'undefined': 'null',
+    'missing': 'null',
+
+    'bool': 'boolean',
+    'int': 'integer',
+    'long': 'biginteger',
+    'double': 'float',
+
+    'string': 'string',
+    'symbol': 'string',
+
+    'date': 'date',
+    'timestamp': 'timestamp',
+
+    'dbPointer': 'dbref',
+    'objectId': 'oid',
+}
+
+
+# Mapping from BSON element type codes (as in raw BSON bytes) to BSON type aliases
+BSON_TYPE_CODE_TO_ALIAS = {
+    0x01: 'double',
+    0x02: 'string',
+    0x03: 'object',
+    0x04: 'array',
+    0x05: 'binData',
+    0x06: 'undefined',
+    0x07: 'objectId',
+    0x08: 'bool',
+    0x09: 'date',
+    0x0A: 'null',
+    0x0B: 'regex',
+    0x0C: 'dbPointer',
+    0x0D: 'javascript',
+    0x0E: 'symbol',
+    0x0F: 'javascriptWithScope',
+    0x10: 'int',
+    0x11: 'timestamp',
+    0x12: 'long',
+    0x13: 'decimal',
+    0xFF: 'minKey',
+    0x7F: 'maxKey',
+}
+
+
+def get_bson_type_alias_string(bson_type_alias):
+    """ Return mongo type string from a BSON type alias
+
+    :param bson_type_alias: str
+    :return type_string: str
+    """
+    return BSON_TYPE_ALIAS_TO_TYPE_STRING.get(bson_type_alias, 'unknown')
+
+
 def get_type_string(value):
     """ Return mongo type string from a value
 
@@ -67,35 +137,68 @@ def get_type_string(value):
     return type_string
 
 
+def get_type_code(value):
+    """ Return mongo type code (index in TYPE_STRINGS) from a value
+
+    :param value:
+    :return type_code: int
+    """
+    try:
+        return PYMONGO_TYPE_TO_TYPE_CODE[type(value)]
+    except KeyError:
+        type_code = TYPE_STRING_TO_TYPE_CODE[get_type_string(value)]
+        PYMONGO_TYPE_TO_TYPE_CODE[type(value)] = type_code
+        return type_code
+
+
 ###
 # Define and use type_string_tree,
 # to get the least common parent type_string from a list of type_string
 
-def _build_types_string_tree():
-    t = Tree()
-    t.name = 'mixed_scalar_object'
+# Parent of each type_string in the tree, whose root is 'mixed_scalar_object'.
+# Parents are listed before their children.
+TYPES_STRING_PARENT = OrderedDict([
+    ('general_scalar', 'mixed_scalar_object'),
 
-    general = t.add_child(name='general_scalar')
+    ('number', 'general_scalar'),
+    ('float', 'number'),
+    ('biginteger', 'number'),
+    ('integer', 'biginteger'),
+    ('boolean', 'integer'),
 
-    number = general.add_child(name='number')
-    number.add_child(name='float')
-    biginteger = number.add_child(name='biginteger')
-    integer = biginteger.add_child(name='integer')
-    integer.add_child(name='boolean')
+    ('string', 'general_scalar'),
+    ('oid', 'string'),
+    ('dbref', 'string'),
 
-    string = general.add_child(name='string')
-    string.add_child(name='oid')
-    string.add_child(name='dbref')
+    ('date', 'general_scalar'),
+    ('timestamp', 'general_scalar'),
+    ('unknown', 'general_scalar'),
 
-    general.add_child(name='date')
-    general.add_child(name='timestamp')
-    general.add_child(name='unknown')
+    ('OBJECT', 'mixed_scalar_object'),
+])
 
-    t.add_child(name='OBJECT')
 
-    return t
+def _type_string_ancestors(type_string):
+    """ List type_string and its ancestors, up to the root of the tree"""
+    ancestors = [type_string]
+    while ancestors[-1] in TYPES_STRING_PARENT:
+        ancestors.append(TYPES_STRING_PARENT[ancestors[-1]])
+    return ancestors
+
+
+def _build_common_parent_type_table():
+    """ Precompute the least common parent of every pair of type_string in the tree"""
+    type_strings = ['mixed_scalar_object'] + list(TYPES_STRING_PARENT)
+    table = dict()
+    for type_string in type_strings:
+        ancestors = _type_string_ancestors(type_string)
+        for other_type_string in type_strings:
+            other_ancestors = set(_type_string_ancestors(other_type_string))
+            table[type_string, other_type_string] = next(ancestor for ancestor in ancestors
+                                                         if ancestor in other_ancestors)
+    return table
 
-TYPES_STRING_TREE = _build_types_string_tree()
+COMMON_PARENT_TYPE = _build_common_parent_type_table()
 
 
 def common_parent_type(list_of_type_string):
@@ -106,11 +209,24 @@ def common_parent_type(list_of_type_string):
     """
     if not list_of_type_string:
         return 'null'
-    # avoid duplicates as get_common_ancestor('integer', 'integer') -> 'number'
-    list_of_type_string = list(set(list_of_type_string))
-    if len(list_of_type_string) == 1:
-        return list_of_type_string[0]
-    return TYPES_STRING_TREE.common_ancestor(*list_of_type_string).name
+    type_strings = iter(list_of_type_string)
+    common_type = next(type_strings)
+    for type_string in type_strings:
+        if type_string != common_type:
+            common_type = COMMON_PARENT_TYPE[common_type, type_string]
+    return common_type
+
+
+def _build_types_string_tree():
+    """ Build the ete4 Tree of type_string, to render it"""
+    from ete4 import Tree
+
+    t = Tree()
+    t.name = 'mixed_scalar_object'
+    nodes = {t.name: t}
+    for type_string, parent in TYPES_STRING_PARENT.items():
+        nodes[type_string] = nodes[parent].add_child(name=type_string)
+    return t
 
 
 def generate_type_tree_figure(output_file):
@@ -142,7 +258,7 @@ def generate_type_tree_figure(output_file):
 
     ts.layout_fn = my_layout
 
-    TYPES_STRING_TREE.render(output_file, tree_style=ts)
+    _build_types_string_tree().render(output_file, tree_style=ts)
 
 
 ###
@@ -0,0 +1,238 @@
+# coding: utf8
+"""
+This module intends to add raw BSON documents to an object schema, without decoding them.
+
+PyMongo decodes every value of a document into a python object (datetime, ObjectId, str, bytes...),
+while the schema only needs its type. Here, documents are walked directly in BSON bytes:
+only element type codes and field names are read, and values are skipped using their length.
+
+Batches of raw BSON documents are requested with find_raw_batches or aggregate_raw_batches.
+
+Types match those of the python engine, that is of values once decoded by pymongo
+(see mongo_sql_types.BSON_TYPE_ALIAS_TO_TYPE_STRING).
+"""
+import logging
+import struct
+
+from pymongo_schema.extract import init_empty_object_schema, init_empty_types_count
+from pymongo_schema.mongo_sql_types import (BSON_TYPE_CODE_TO_ALIAS, TYPE_STRING_TO_TYPE_CODE,
+                                             get_bson_type_alias_string)
+
+logger = logging.getLogger(__name__)
+
+_UNPACK_INT = struct.Struct('<i').unpack_from
+
+# Mapping from BSON element type codes to mongo type codes (see mongo_sql_types.TYPE_STRINGS)
+BSON_TYPE_CODE_TO_TYPE_CODE = {
+    bson_type_code: TYPE_STRING_TO_TYPE_CODE[get_bson_type_alias_string(alias)]
+    for bson_type_code, alias in BSON_TYPE_CODE_TO_ALIAS.items()}
+UNKNOWN_TYPE_CODE = TYPE_STRING_TO_TYPE_CODE['unknown']
+
+OBJECT_CODE = 0x03
+ARRAY_CODE = 0x04
+
+# Length of values with a fixed size, by type code
+FIXED_SIZES = {
+    0x01: 8,   # double
+    0x06: 0,   # undefined
+    0x07: 12,  # objectId
+    0x08: 1,   # bool
+    0x09: 8,   # date
+    0x0A: 0,   # null
+    0x10: 4,   # int
+    0x11: 8,   # timestamp
+    0x12: 8,   # long
+    0x13: 16,  # decimal
+    0xFF: 0,   # minKey
+    0x7F: 0,   # maxKey
+}
+
+# Type codes of values prefixed by an int32 length:
+# string, symbol and javascript (length excludes the int32), binData (length excludes int32 and
+# subtype), object, array and javascriptWithScope (length includes the int32)
+LENGTH_PREFIXED_SIZES = {
+    0x02: 4,
+    0x0D: 4,
+    0x0E: 4,
+    0x05: 5,
+    0x03: 0,
+    0x04: 0,
+    0x0F: 0,
+}
+
+
+def scan_raw_batches(pymongo_collection, object_schema, sample_size=0, query=None,
+                     scan_count=None, cursor_options=None):
+    """ Add raw BSON documents of a collection to an object_schema
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param object_schema: dict
+    :param sample_size: int, default 0
+        Only add a random sample of documents. By default add all documents.
+    :param query: dict, default None
+        Only add documents matching this query
+    :param scan_count: int, default None
+        Expected number of documents, to log progress
+    :param cursor_options: dict, default None
+        Options of the cursor reading all documents, see pymongo Collection.find_raw_batches
+    :return scanned: int - number of documents added
+    """
+    if sample_size:
+        pipeline = [{'$match': query}] if query else []
+        pipeline.append({'$sample': {'size': sample_size}})
+        batches = pymongo_collection.aggregate_raw_batches(pipeline, allowDiskUse=True)
+    else:
+        batches = pymongo_collection.find_raw_batches(query or {}, **(cursor_options or {}))
+
+    scanned = 0
+    for batch in batches:
+        scanned += add_bson_documents_to_object_schema(batch, object_schema)
+        if scan_count:
+            logger.info('   scanned %s documents out of %s (%.2f %%)',
+                        scanned, scan_count, (100. * scanned) / scan_count)
+        else:
+            logger.info('   scanned %s documents', scanned)
+    return scanned
+
+
+def add_bson_documents_to_object_schema(data, object_schema, position=0, end=None):
+    """ Add concatenated BSON documents to an object_schema
+
+    :param data: bytes or mmap.mmap
+    :param object_schema: dict
+    :param position: int, default 0 - position of the first document in data
+    :param end: int, default None - position after the last document. Default to len(data).
+    :return count: int - number of documents added
+    """
+    if end is None:
+        end = len(data)
+    count = 0
+    while position < end:
+        document_size = _UNPACK_INT(data, position)[0]
+        add_bson_elements_to_object_schema(data, position + 4, position + document_size - 1,
+                                           object_schema)
+        position += document_size
+        count += 1
+    return count
+
+
+def add_bson_elements_to_object_schema(data, position, end, object_schema):
+    """ Add the elements of a BSON document to an object_schema
+
+    :param data: bytes
+    :param position: int - position of the first element, after the document int32 size
+    :param end: int - position of the trailing null byte of the document
+    :param object_schema: dict
+    """
+    settings = object_schema.settings
+    while position < end:
+        type_code = data[position]
+        key_end = data.find(b'\x00', position + 1)
+        field_schema = object_schema[bytes(data[position + 1:key_end]).decode('utf-8')]
+        field_schema.count += 1
+        position = add_bson_value_to_field_schema(data, type_code, key_end + 1, field_schema,
+                                                  settings=settings)
+
+
+def add_bson_value_to_field_schema(data, type_code, position, field_schema,
+                                   type_str='types_count', settings=None):
+    """ Add a BSON value to a field_schema, like extract.add_value_to_field_schema
+
+    - Update the count of its type in type_str
+    - Recursively add arrays elements (only for 'types_count') and documents to the schema
+
+    :param data: bytes
+    :param type_code: int - BSON type code of the element
+    :param position: int - position of the value
+    :param field_schema: extract.FieldStats
+    :param type_str: str, either 'types_count' or 'array_types_count'
+    :param settings: extract.ExtractionSettings, default None - settings of nested objects
+    :return position: int - position after the value
+    """
+    if type_str == 'types_count':
+        types_count = field_schema.types_count
+    else:
+        types_count = field_schema.array_types_count
+
+    if type_code == OBJECT_CODE:
+        size = _UNPACK_INT(data, position)[0]
+        if is_bson_dbref(data, position + 4, position + size - 1):
+            types_count[TYPE_STRING_TO_TYPE_CODE['dbref']] += 1
+        else:
+            types_count[TYPE_STRING_TO_TYPE_CODE['OBJECT']] += 1
+            if field_schema.object is None:
+                field_schema.object = init_empty_object_schema(settings)
+            add_bson_elements_to_object_schema(data, position + 4, position + size - 1,
+                                               field_schema.object)
+        return position + size
+
+    if type_code == ARRAY_CODE and type_str == 'types_count':
+        size = _UNPACK_INT(data, position)[0]
+        types_count[TYPE_STRING_TO_TYPE_CODE['ARRAY']] += 1
+        if field_schema.array_types_count is None:
+            field_schema.array_types_count = init_empty_types_count()
+        add_bson_array_to_field_schema(data, position + 4, position + size - 1, field_schema,
+                                       settings)
+        return position + size
+
+    types_count[BSON_TYPE_CODE_TO_TYPE_CODE.get(type_code, UNKNOWN_TYPE_CODE)] += 1
+    return skip_bson_value(data, type_code, position)
+
+
+def add_bson_array_to_field_schema(data, position, end, field_schema, settings=None):
+    """ Add the elements of a BSON array to 'array_types_count' of a field_schema
+
+    :param data: bytes
+    :param position: int - position of the first element, after the array int32 size
+    :param end: int - position of the trailing null byte of the array
+    :param field_schema: extract.FieldStats
+    :param settings: extract.ExtractionSettings, default None - settings of nested objects
+    """
+    if position == end:
+        field_schema.array_types_count[TYPE_STRING_TO_TYPE_CODE['null']] += 1
+    while position < end:
+        type_code = data[position]
+        position = data.find(b'\x00', position + 1) + 1
+        position = add_bson_value_to_field_schema(data, type_code, position, field_schema,
+                                                  type_str='array_types_count',
+                                                  settings=settings)
+
+
+def is_bson_dbref(data, position, end):
+    """ Check if BSON document elements describe a DBRef, as pymongo would decode it
+
+    :param data: bytes
+    :param position: int - position of the first element
+    :param end: int - position of the trailing null byte of the document
+    :return bool
+    """
+    if data.find(b'$ref\x00', position, end) == -1:  # Fast path for most documents
+        return False
+    keys_types = dict()
+    while position < end:
+        type_code = data[position]
+        key_end = data.find(b'\x00', position + 1)
+        keys_types[bytes(data[position + 1:key_end])] = type_code
+        position = skip_bson_value(data, type_code, key_end + 1)
+    return (keys_types.get(b'$ref') == 0x02 and b'$id' in keys_types and
+            keys_types.get(b'$db', 0x02) in (0x02, 0x0A))
+
+
+def skip_bson_value(data, type_code, position):
+    """ Return the position after a BSON value, reading only lengths
+
+    :param data: bytes
+    :param type_code: int
+    :param position: int - position of the value
+    :return position: int
+    """
+    if type_code in FIXED_SIZES:
+        return position + FIXED_SIZES[type_code]
+    if type_code in LENGTH_PREFIXED_SIZES:
+        return position + LENGTH_PREFIXED_SIZES[type_code] + _UNPACK_INT(data, position)[0]
+    if type_code == 0x0B:  # regex: pattern and options cstrings
+        position = data.find(b'\x00', position) + 1
+        return data.find(b'\x00', position) + 1
+    if type_code == 0x0C:  # dbPointer: string and objectId
+        return position + 4 + _UNPACK_INT(data, position)[0] + 12
+    raise ValueError('Unknown BSON type code {} at position {}'.format(type_code, position))
@@ -0,0 +1,224 @@
+# coding: utf8
+"""
+This module intends to sample the documents of a collection, with several strategies.
+
+- 'random': MongoDB $sample stage. If the sample is more than 5% of the collection,
+  MongoDB scans the whole collection and sorts it randomly in memory.
+- 'stratified': the range of an indexed key (_id by default) is split into strata of equal
+  length (in time for ObjectId and dates), and the first documents of each stratum are sampled,
+  so that both old and recent documents are represented.
+- 'reservoir': uniform random sample drawn client side, while reading at most scan_size documents.
+- 'first', 'last': first or last documents by key order ('$natural' for insertion order).
+
+All strategies but 'random' only read documents with index-friendly find queries,
+so that their cost is predictable.
+"""
+import logging
+import random
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+
+def sample_documents(pymongo_collection, sample_size, query=None, strategy='random', **kwargs):
+    """ Sample documents of a collection
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int - number of documents to sample
+    :param query: dict, default None
+        Only sample documents matching this query
+    :param strategy: str, default 'random'
+        key of SAMPLING_STRATEGIES
+    :param kwargs: options of the sampling strategy
+        key: str, default '_id' - field ordering documents for 'stratified', 'first' and 'last'
+        strata: int, default 10 - number of strata of 'stratified'
+        scan_size: int, default 0 - maximum number of documents read by 'reservoir'
+    :return documents: iterable of dict
+    """
+    try:
+        sampling_function = SAMPLING_STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError("Sampling strategy should be one of {}, not {}".format(
+            ', '.join(SAMPLING_STRATEGIES), strategy))
+    return sampling_function(pymongo_collection, sample_size, query, **kwargs)
+
+
+def sample_random(pymongo_collection, sample_size, query=None, **kwargs):
+    """ Sample documents with MongoDB $sample stage
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int
+    :param query: dict, default None
+    :return documents: iterable of dict
+    """
+    pipeline = [{'$match': query}] if query else []
+    pipeline.append({'$sample': {'size': sample_size}})
+    return pymongo_collection.aggregate(pipeline, allowDiskUse=True)
+
+
+def sample_stratified(pymongo_collection, sample_size, query=None, key='_id', strata=10,
+                      **kwargs):
+    """ Sample the first documents of strata of equal length of key range
+
+    Documents without key, or whose key type differs from bounds of key range, are not sampled.
+    If key values can not be interpolated (neither numbers, dates nor ObjectId),
+    documents are sampled randomly.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int
+    :param query: dict, default None
+    :param key: str, default '_id' - indexed field
+    :param strata: int, default 10
+    :return documents: iterator of dict
+    """
+    query = query or {}
+    lower = first_key_value(pymongo_collection, query, key, 1)
+    upper = first_key_value(pymongo_collection, query, key, -1)
+    if lower is None or upper is None:
+        return
+
+    boundaries = interpolate_boundaries(lower, upper, strata)
+    if boundaries is None:
+        logger.warning('Cannot split %s values of collection %s in strata, sample it randomly',
+                       type(lower).__name__, pymongo_collection.name)
+        for document in sample_random(pymongo_collection, sample_size, query):
+            yield document
+        return
+
+    stratum_size = -(-sample_size // len(boundaries))
+    sampled = 0
+    for i, stratum_lower in enumerate(boundaries):
+        condition = {'$gte': stratum_lower}
+        if i + 1 < len(boundaries):
+            condition['$lt'] = boundaries[i + 1]
+        stratum_query = {'$and': [query, {key: condition}]} if query else {key: condition}
+        limit = min(stratum_size, sample_size - sampled)
+        for document in pymongo_collection.find(stratum_query).sort(key, 1).limit(limit):
+            sampled += 1
+            yield document
+        if sampled >= sample_size:
+            return
+
+
+def first_key_value(pymongo_collection, query, key, direction):
+    """ Return the first value of key in direction order, or None if no document has key
+
+    Documents whose key is missing or null, which come first in ascending order, are skipped.
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param query: dict
+    :param key: str - indexed field, possibly dotted ('meta.updated_at')
+    :param direction: int - 1 for the lowest value, -1 for the greatest
+    :return value:
+    """
+    key_query = {key: {'$ne': None}}
+    key_query = {'$and': [query, key_query]} if query else key_query
+    for document in pymongo_collection.find(key_query, {key: 1}).sort(key, direction).limit(1):
+        return get_key_value(document, key)
+    return None
+
+
+def get_key_value(document, key):
+    """ Get the value of a dotted key in a document
+
+    >>> get_key_value({'meta': {'updated_at': 1}}, 'meta.updated_at')
+    1
+
+    :param document: dict
+    :param key: str
+    :return value:
+    :raise KeyError: if a field of the key path is missing, or is not a sub-document
+    """
+    value = document
+    for field in key.split('.'):
+        if not isinstance(value, dict) or field not in value:
+            raise KeyError("Document {} has no key {}".format(document.get('_id'), key))
+        value = value[field]
+    return value
+
+
+def interpolate_boundaries(lower, upper, strata):
+    """ Split the range from lower to upper into strata of equal length
+
+    ObjectId are split by their generation time.
+
+    >>> interpolate_boundaries(0, 10, 4)
+    [0, 2.5, 5.0, 7.5]
+
+    :param lower: number, datetime or ObjectId
+    :param upper: same type as lower
+    :param strata: int
+    :return boundaries: list - lower bound of each stratum, or None if values can not be split
+    """
+    if isinstance(lower, bson.objectid.ObjectId) and isinstance(upper, bson.objectid.ObjectId):
+        times = interpolate_boundaries(lower.generation_time, upper.generation_time, strata)
+        return [lower] + [bson.objectid.ObjectId.from_datetime(time) for time in times[1:]]
+
+    are_numbers = all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                      for value in (lower, upper))
+    are_dates = all(isinstance(value, bson.datetime.datetime) for value in (lower, upper))
+    if not (are_numbers or are_dates):
+        return None
+    if lower == upper:
+        return [lower]
+    return [lower] + [lower + (upper - lower) * i / strata for i in range(1, strata)]
+
+
+def sample_reservoir(pymongo_collection, sample_size, query=None, scan_size=0, **kwargs):
+    """ Sample documents uniformly at random client side, while reading them in natural order
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int
+    :param query: dict, default None
+    :param scan_size: int, default 0
+        Maximum number of documents to read, the sample is uniform among them.
+        By default, read all documents.
+    :return documents: list of dict
+    """
+    cursor = pymongo_collection.find(query or {})
+    if scan_size:
+        cursor = cursor.limit(scan_size)
+
+    reservoir = []
+    for i, document in enumerate(cursor):
+        if i < sample_size:
+            reservoir.append(document)
+        else:
+            j = random.randint(0, i)
+            if j < sample_size:
+                reservoir[j] = document
+    return reservoir
+
+
+def sample_first(pymongo_collection, sample_size, query=None, key='_id', **kwargs):
+    """ Sample the first documents in key order
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int
+    :param query: dict, default None
+    :param key: str, default '_id' - indexed field, or '$natural' for insertion order
+    :return documents: iterable of dict
+    """
+    return pymongo_collection.find(query or {}).sort(key, 1).limit(sample_size)
+
+
+def sample_last(pymongo_collection, sample_size, query=None, key='_id', **kwargs):
+    """ Sample the last documents in key order
+
+    :param pymongo_collection: pymongo.collection.Collection
+    :param sample_size: int
+    :param query: dict, default None
+    :param key: str, default '_id' - indexed field, or '$natural' for insertion order
+    :return documents: iterable of dict
+    """
+    return pymongo_collection.find(query or {}).sort(key, -1).limit(sample_size)
+
+
+SAMPLING_STRATEGIES = {
+    'random': sample_random,
+    'stratified': sample_stratified,
+    'reservoir': sample_reservoir,
+    'first': sample_first,
+    'last': sample_last,
+}
@@ -0,0 +1,461 @@
+# coding: utf8
+"""
+This module intends to summarize the values of a field in constant memory, while documents are
+added to a schema (see extract.ExtractionSettings).
+
+Sketches are mergeable, so that value statistics of partial schemas (from workers, partitions,
+checkpoints or merge module) still combine:
+- HyperLogLog estimates the number of distinct values
+- KLL sketches estimate quantiles of numbers and of strings lengths
+- FrequentValues keeps the most frequent strings (by a bounded prefix) and integers, if top values
+  are requested
+
+ValueStats gathers them with exact counts and bounds, and is serialized in field schemas as:
+    'value_stats': {
+        'count': int,  # values added, including elements of arrays
+        'null_count': int,
+        'distinct_count': int,  # estimated
+        'min', 'max': number,  # (optional: if numbers)
+        'percentiles': {'50': number, '90': number, '99': number},  # (idem)
+        'length_min', 'length_max': int,  # (optional: if strings)
+        'length_percentiles': {'50': int, '90': int, '99': int},  # (idem)
+        'top_values': [[value, count], ...],  # (optional: if top values are requested)
+        'sketches': dict  # state of sketches, to merge value_stats
+    }
+"""
+import base64
+import hashlib
+import math
+import zlib
+
+from pymongo_schema.mongo_sql_types import TYPE_STRING_TO_TYPE_CODE, get_type_code
+
+# Number of bits of hashes indexing HyperLogLog registers: 4096 registers, 1.6 % standard error
+DEFAULT_HLL_PRECISION = 12
+
+# Capacity of the top compactor of KLL sketches: about 3 * k values kept, 2 % rank error
+DEFAULT_KLL_K = 64
+
+# Percentiles of numbers and strings lengths written in value_stats
+PERCENTILES = (50, 90, 99)
+
+NULL_TYPE_CODE = TYPE_STRING_TO_TYPE_CODE['null']
+STRING_TYPE_CODE = TYPE_STRING_TO_TYPE_CODE['string']
+NUMBER_TYPE_CODES = {TYPE_STRING_TO_TYPE_CODE[type_string]
+                     for type_string in ['integer', 'biginteger', 'float']}
+
+# Number of counters of FrequentValues, by top value reported
+FREQUENT_VALUES_CAPACITY_FACTOR = 10
+
+# Maximum length of strings counted by FrequentValues: longer strings are counted by their prefix
+# of this length, followed by TRUNCATED_SUFFIX, so that the memory of counters is bounded
+MAX_TOP_VALUE_LENGTH = 100
+TRUNCATED_SUFFIX = '...'
+
+# Types of values counted by FrequentValues: enum-like values, written as is in json
+TOP_VALUE_TYPE_CODES = {TYPE_STRING_TO_TYPE_CODE[type_string]
+                        for type_string in ['string', 'integer', 'biginteger']}
+
+
+def hash_value(value, type_code=None):
+    """ Hash a value to a 64 bits integer, stable across processes (unlike hash builtin)
+
+    Values of distinct types, such as 1 and '1', have distinct hashes.
+
+    :param value:
+    :param type_code: int, default None - type code of value, if already known
+    :return hash: int
+    """
+    if type_code is None:
+        type_code = get_type_code(value)
+    if type_code == STRING_TYPE_CODE:
+        data = value.encode('utf8')
+    elif isinstance(value, bytes):
+        data = value
+    else:
+        data = repr(value).encode('utf8')
+    digest = hashlib.blake2b(data, digest_size=8, salt=bytes([type_code])).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HyperLogLog(object):
+    """ Estimate the number of distinct hashes added, with 2 ** precision registers of 1 byte"""
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=DEFAULT_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, hash_64):
+        """ Add a 64 bits hash
+
+        :param hash_64: int
+        """
+        rest_bits = 64 - self.precision
+        index = hash_64 >> rest_bits
+        rank = rest_bits - (hash_64 & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """ Add the hashes of another HyperLogLog of the same precision
+
+        :param other: HyperLogLog
+        """
+        if other.precision != self.precision:
+            raise ValueError('HyperLogLog of precisions {} and {} cannot be merged'.format(
+                self.precision, other.precision))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """ Estimate the number of distinct hashes added
+
+        Small cardinalities are estimated by linear counting of empty registers.
+
+        :return distinct_count: int
+        """
+        registers_count = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers_count)
+        estimate = alpha * registers_count ** 2 / sum(2. ** -rank for rank in self.registers)
+        empty_registers = self.registers.count(0)
+        if estimate <= 2.5 * registers_count and empty_registers:
+            estimate = registers_count * math.log(float(registers_count) / empty_registers)
+        return int(round(estimate))
+
+    def to_dict(self):
+        """ Serialize to a json dict, registers being compressed
+
+        :return hll: dict
+        """
+        return {'precision': self.precision,
+                'registers': base64.b64encode(zlib.compress(bytes(self.registers))).decode()}
+
+    @classmethod
+    def from_dict(cls, hll_dict):
+        """
+        :param hll_dict: dict - from to_dict
+        :return hll: HyperLogLog
+        """
+        hll = cls(hll_dict['precision'])
+        hll.registers = bytearray(zlib.decompress(base64.b64decode(hll_dict['registers'])))
+        return hll
+
+
+class KLLSketch(object):
+    """ Estimate quantiles of the values added, keeping O(k) of them
+
+    Values are appended to the compactor of level 0. Once the sketch is full, a compactor over its
+    capacity is sorted, and every other value is promoted to the next level, where values weigh
+    twice as much. Capacities decrease by a factor 2/3 from the top level down.
+    Compactions alternate between keeping odd and even values, so that sketches are deterministic.
+    """
+    __slots__ = ('k', 'compactors', 'size', 'max_size', '_compactions')
+
+    def __init__(self, k=DEFAULT_KLL_K):
+        self.k = k
+        self.compactors = []
+        self.size = 0
+        self._compactions = 0
+        self._grow(1)
+
+    def _capacity(self, level):
+        return int(math.ceil((2. / 3) ** (len(self.compactors) - level - 1) * self.k)) + 1
+
+    def _grow(self, levels):
+        """ Add compactors up to this number of levels, and update max_size"""
+        while len(self.compactors) < levels:
+            self.compactors.append([])
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def add(self, value):
+        """ Add a value
+
+        :param value: number
+        """
+        self.compactors[0].append(value)
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def _compress(self):
+        for level, compactor in enumerate(self.compactors):
+            if len(compactor) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self._grow(level + 2)
+                compactor.sort()
+                self._compactions += 1
+                self.compactors[level + 1].extend(compactor[self._compactions % 2::2])
+                del compactor[:]
+                self.size = sum(len(c) for c in self.compactors)
+                return
+
+    def merge(self, other):
+        """ Add the values of another KLLSketch
+
+        :param other: KLLSketch
+        """
+        self._grow(len(other.compactors))
+        for compactor, other_compactor in zip(self.compactors, other.compactors):
+            compactor.extend(other_compactor)
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """ Estimate percentiles of the values added
+
+        :param percentiles: iterable of number, from 0 to 100
+        :return percentiles: dict - {str(percentile): value}, empty if no value was added
+        """
+        weighted_values = sorted((value, 1 << level)
+                                 for level, compactor in enumerate(self.compactors)
+                                 for value in compactor)
+        if not weighted_values:
+            return {}
+        total_weight = sum(weight for _, weight in weighted_values)
+        result = dict()
+        percentiles = sorted(percentiles)
+        i = cumulated_weight = 0
+        for value, weight in weighted_values:
+            cumulated_weight += weight
+            while i < len(percentiles) and cumulated_weight >= percentiles[i] * total_weight / 100.:
+                result[str(percentiles[i])] = value
+                i += 1
+        for percentile in percentiles[i:]:
+            result[str(percentile)] = weighted_values[-1][0]
+        return result
+
+    def to_dict(self):
+        """
+        :return kll: dict
+        """
+        return {'k': self.k, 'compactors': [list(compactor) for compactor in self.compactors]}
+
+    @classmethod
+    def from_dict(cls, kll_dict):
+        """
+        :param kll_dict: dict - from to_dict
+        :return kll: KLLSketch
+        """
+        kll = cls(kll_dict['k'])
+        kll.compactors = [list(compactor) for compactor in kll_dict['compactors']]
+        kll.size = sum(len(c) for c in kll.compactors)
+        kll._grow(1)
+        return kll
+
+
+class FrequentValues(object):
+    """ Keep the k most frequent values added, with a fixed number of counters
+
+    Misra-Gries summary, the mergeable form of SpaceSaving: once all counters are used,
+    a new value decrements every counter instead, and counters down to 0 are dropped.
+    Counts are thus underestimated by at most 'error', the number of decrements,
+    which is at most the number of values added divided by the number of counters.
+
+    Strings longer than MAX_TOP_VALUE_LENGTH are truncated, so that counters hold at most
+    capacity * (MAX_TOP_VALUE_LENGTH + len(TRUNCATED_SUFFIX)) characters: long strings sharing
+    a prefix are counted together.
+    """
+    __slots__ = ('k', 'capacity', 'counters', 'error')
+
+    def __init__(self, k, capacity=None):
+        """
+        :param k: int - number of top values reported
+        :param capacity: int, default None
+            Number of counters. Default to FREQUENT_VALUES_CAPACITY_FACTOR * k.
+        """
+        self.k = k
+        self.capacity = capacity or FREQUENT_VALUES_CAPACITY_FACTOR * k
+        self.counters = dict()
+        self.error = 0
+
+    def add(self, value):
+        """ Add a hashable value, truncating long strings
+
+        :param value:
+        """
+        if isinstance(value, str) and len(value) > MAX_TOP_VALUE_LENGTH:
+            value = value[:MAX_TOP_VALUE_LENGTH] + TRUNCATED_SUFFIX
+        count = self.counters.get(value)
+        if count is not None:
+            self.counters[value] = count + 1
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = 1
+        else:
+            self.error += 1
+            self.counters = {counted_value: count - 1
+                             for counted_value, count in self.counters.items() if count > 1}
+
+    def merge(self, other):
+        """ Add the values of another FrequentValues
+
+        Counters are summed, then decremented by the count of the first counter over capacity.
+
+        :param other: FrequentValues
+        """
+        for value, count in other.counters.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self.error += other.error
+        if len(self.counters) > self.capacity:
+            decrement = sorted(self.counters.values(), reverse=True)[self.capacity]
+            self.error += decrement
+            self.counters = {value: count - decrement
+                             for value, count in self.counters.items() if count > decrement}
+
+    def top(self):
+        """ Get the k most frequent values, with their (underestimated) counts
+
+        :return top_values: list of [value, count], by decreasing count
+        """
+        return [[value, count] for value, count in sorted(
+            self.counters.items(), key=lambda item: (-item[1], str(item[0])))[:self.k]]
+
+    def to_dict(self):
+        """
+        :return frequent_values: dict
+        """
+        return {'k': self.k, 'capacity': self.capacity, 'error': self.error,
+                'counters': [[value, count] for value, count in self.counters.items()]}
+
+    @classmethod
+    def from_dict(cls, frequent_values_dict):
+        """
+        :param frequent_values_dict: dict - from to_dict
+        :return frequent_values: FrequentValues
+        """
+        frequent_values = cls(frequent_values_dict['k'], frequent_values_dict['capacity'])
+        frequent_values.error = frequent_values_dict['error']
+        frequent_values.counters = {value: count
+                                    for value, count in frequent_values_dict['counters']}
+        return frequent_values
+
+
+class ValueStats(object):
+    """ Statistics of the values of a field: null count, distinct count,
+    bounds and percentiles of numbers and of strings lengths, and optionally top values"""
+    __slots__ = ('count', 'null_count', 'min', 'max', 'length_min', 'length_max',
+                 'distinct', 'numbers', 'lengths', 'frequent_values')
+
+    def __init__(self, top_values=0):
+        """
+        :param top_values: int, default 0
+            Number of most frequent strings and integers to keep (see FrequentValues).
+            0 does not count values.
+        """
+        self.count = 0
+        self.null_count = 0
+        self.min = self.max = None
+        self.length_min = self.length_max = None
+        self.distinct = HyperLogLog()
+        self.numbers = KLLSketch()
+        self.lengths = KLLSketch()
+        self.frequent_values = FrequentValues(top_values) if top_values else None
+
+    def __eq__(self, other):
+        return isinstance(other, ValueStats) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def add(self, value):
+        """ Add a scalar value
+
+        Integers and floats, but NaN, are numbers. Booleans are not.
+
+        :param value:
+        """
+        self.count += 1
+        type_code = get_type_code(value)
+        if type_code == NULL_TYPE_CODE:
+            self.null_count += 1
+            return
+        self.distinct.add_hash(hash_value(value, type_code))
+        if self.frequent_values is not None and type_code in TOP_VALUE_TYPE_CODES:
+            self.frequent_values.add(value)
+        if type_code == STRING_TYPE_CODE:
+            length = len(value)
+            self.lengths.add(length)
+            if self.length_min is None or length < self.length_min:
+                self.length_min = length
+            if self.length_max is None or length > self.length_max:
+                self.length_max = length
+        elif type_code in NUMBER_TYPE_CODES and value == value:
+            self.numbers.add(value)
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """ Add the values of another ValueStats
+
+        :param other: ValueStats
+        """
+        self.count += other.count
+        self.null_count += other.null_count
+        self.distinct.merge(other.distinct)
+        self.numbers.merge(other.numbers)
+        self.lengths.merge(other.lengths)
+        self.min = _bound(min, self.min, other.min)
+        self.max = _bound(max, self.max, other.max)
+        self.length_min = _bound(min, self.length_min, other.length_min)
+        self.length_max = _bound(max, self.length_max, other.length_max)
+        if other.frequent_values is not None:
+            if self.frequent_values is None:
+                self.frequent_values = FrequentValues(other.frequent_values.k,
+                                                      other.frequent_values.capacity)
+            self.frequent_values.merge(other.frequent_values)
+
+    def to_dict(self):
+        """ Convert to a value_stats dict, with summaries and sketches
+
+        :return value_stats: dict
+        """
+        value_stats = {
+            'count': self.count,
+            'null_count': self.null_count,
+            'distinct_count': self.distinct.estimate(),
+            'sketches': {
+                'distinct': self.distinct.to_dict(),
+                'numbers': self.numbers.to_dict(),
+                'lengths': self.lengths.to_dict(),
+            }
+        }
+        if self.min is not None:
+            value_stats.update(min=self.min, max=self.max,
+                               percentiles=self.numbers.percentiles())
+        if self.length_min is not None:
+            value_stats.update(length_min=self.length_min, length_max=self.length_max,
+                               length_percentiles=self.lengths.percentiles())
+        if self.frequent_values is not None:
+            value_stats['top_values'] = self.frequent_values.top()
+            value_stats['sketches']['frequent_values'] = self.frequent_values.to_dict()
+        return value_stats
+
+    @classmethod
+    def from_dict(cls, value_stats_dict):
+        """
+        :param value_stats_dict: dict - from to_dict
+        :return value_stats: ValueStats
+        """
+        value_stats = cls()
+        value_stats.count = value_stats_dict['count']
+        value_stats.null_count = value_stats_dict['null_count']
+        for bound in ['min', 'max', 'length_min', 'length_max']:
+            setattr(value_stats, bound, value_stats_dict.get(bound))
+        sketches = value_stats_dict['sketches']
+        value_stats.distinct = HyperLogLog.from_dict(sketches['distinct'])
+        value_stats.numbers = KLLSketch.from_dict(sketches['numbers'])
+        value_stats.lengths = KLLSketch.from_dict(sketches['lengths'])
+        if 'frequent_values' in sketches:
+            value_stats.frequent_values = FrequentValues.from_dict(sketches['frequent_values'])
+        return value_stats
+
+
+def _bound(function, value, other_value):
+    """ Apply min or max function to values which may be None"""
+    if value is None:
+        return other_value
+    if other_value is None:
+        return value
+    return function(value, other_value)
@@ -9,6 +9,7 @@ https://github.com/Hopwork/mongo-connector-postgresql
 
 import logging
 
+from pymongo_schema.extract import MAP_KEY
 from pymongo_schema.mongo_sql_types import psql_type
 
 logger = logging.getLogger(__name__)
@@ -78,6 +79,14 @@ def add_object_to_mapping(object_schema, mapping, table_name, field_prefix=''):
         from table's parent object (either collection or ARRAY(OBJECT))
     """
     for field, field_info in object_schema.items():
+        if field == MAP_KEY:
+            # keys of map-like objects are data, not columns
+            logger.warning(
+                "WARNING : 'JSON' SQL type is not managed yet. Map-like object '%s' from table "
+                "'%s' is skipped from the mapping.",
+                field_prefix[:-1] or table_name, table_name)
+            continue
+
         # Assemble mongo_field_name, the full field name from table's parent object,
         # either collection or ARRAY(OBJECT)
         mongo_field_name = field_prefix + field
@@ -86,7 +95,8 @@ def add_object_to_mapping(object_schema, mapping, table_name, field_prefix=''):
         if mongo_type == 'ARRAY':
             mongo_array_type = field_info['array_type']
             if mongo_array_type == 'OBJECT':
-                add_object_array_to_mapping(mongo_field_name, field_info['object'],
+                # 'object' is missing below the maximum depth of extraction
+                add_object_array_to_mapping(mongo_field_name, field_info.get('object', {}),
                                             mapping, table_name)
             else:
                 add_scalar_array_field_to_mapping(field, mongo_field_name, mongo_array_type,
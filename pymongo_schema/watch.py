@@ -0,0 +1,150 @@
+# coding: utf8
+"""
+This module intends to keep a mongo schema up to date from a stream of change events,
+as opened by pymongo watch method on a client, a database or a collection.
+
+Full documents of 'insert', 'replace' and 'update' events (with full_document='updateLookup')
+are added to the schema of their collection. Other events, such as deletes, are ignored.
+The schema thus describes the versions of documents written while watching:
+'count' is the number of documents added, and a document updated twice is counted twice.
+
+Any iterable of change events can be watched, so that events can be replayed.
+"""
+import logging
+import time
+
+from pymongo_schema.extract import (DocumentShapeCache, add_document_to_object_schema,
+                                    add_object_schema_to_object_schema, init_empty_object_schema,
+                                    object_schema_to_dict)
+
+logger = logging.getLogger(__name__)
+
+# Operation types of change events whose full document is added to the schema
+DOCUMENT_OPERATION_TYPES = {'insert', 'replace', 'update'}
+
+
+class SchemaWatcher(object):
+    """ Add full documents of change events to the object_schema of their collection"""
+
+    def __init__(self, mongo_schema=None, shape_cache_size=1024):
+        """
+        :param mongo_schema: dict, default None
+            Post-processed mongo schema with counts to start from, such as a previous extraction
+        :param shape_cache_size: int, default 1024
+            Maximum number of documents shapes cached by collection (see DocumentShapeCache).
+            0 disables the cache.
+        """
+        self.shape_cache_size = shape_cache_size
+        self.events = 0
+        self.added = 0
+        self._collections = dict()  # {(database, collection): [count, object_schema, shape_cache]}
+
+        for database, database_schema in (mongo_schema or {}).items():
+            for collection, collection_schema in database_schema.items():
+                watched_collection = self._get_collection(database, collection)
+                watched_collection[0] = collection_schema.get('analyzed_count',
+                                                              collection_schema['count'])
+                add_object_schema_to_object_schema(collection_schema['object'],
+                                                   watched_collection[1])
+
+    def _get_collection(self, database, collection):
+        watched_collection = self._collections.get((database, collection))
+        if watched_collection is None:
+            object_schema = init_empty_object_schema()
+            shape_cache = (DocumentShapeCache(object_schema, self.shape_cache_size)
+                           if self.shape_cache_size else None)
+            watched_collection = self._collections[database, collection] = [0, object_schema,
+                                                                            shape_cache]
+        return watched_collection
+
+    def add_event(self, event):
+        """ Add the full document of a change event to the schema of its collection
+
+        :param event: dict - change event
+        :return added: bool - False if the event has no full document
+        """
+        self.events += 1
+        document = event.get('fullDocument')
+        if event.get('operationType') not in DOCUMENT_OPERATION_TYPES or document is None:
+            return False
+        watched_collection = self._get_collection(event['ns']['db'], event['ns']['coll'])
+        watched_collection[0] += 1
+        if watched_collection[2]:
+            watched_collection[2].add_document(document)
+        else:
+            add_document_to_object_schema(document, watched_collection[1])
+        self.added += 1
+        return True
+
+    def get_schema(self):
+        """ Get the post-processed mongo schema of the documents added so far
+
+        :return mongo_schema: dict
+        """
+        mongo_schema = dict()
+        for (database, collection), watched_collection in sorted(self._collections.items()):
+            count, object_schema, shape_cache = watched_collection
+            if shape_cache:
+                shape_cache.flush()
+            mongo_schema.setdefault(database, dict())[collection] = {
+                'count': count,
+                'object': object_schema_to_dict(object_schema, count)
+            }
+        return mongo_schema
+
+
+def watch_schema(change_events, flush=None, mongo_schema=None, flush_interval=10., max_events=0,
+                 shape_cache_size=1024):
+    """ Keep a mongo schema up to date from change events, flushing it periodically
+
+    Watching stops once change_events are exhausted, max_events were received,
+    or on KeyboardInterrupt.
+
+    :param change_events: pymongo.change_stream.ChangeStream or iterable of change events
+        ChangeStream are polled with try_next, so that the schema is flushed even without events
+    :param flush: function, default None
+        Called with the post-processed mongo schema every flush_interval seconds
+    :param mongo_schema: dict, default None
+        Post-processed mongo schema with counts to start from
+    :param flush_interval: float, default 10.
+    :param max_events: int, default 0
+        Number of events to receive before returning. By default, no maximum.
+    :param shape_cache_size: int, default 1024
+    :return mongo_schema: dict
+    """
+    watcher = SchemaWatcher(mongo_schema, shape_cache_size)
+    start_time = last_flush_time = time.time()
+    try:
+        for event in iterate_change_events(change_events):
+            if event is not None:
+                watcher.add_event(event)
+                if max_events and watcher.events >= max_events:
+                    break
+            if flush and time.time() - last_flush_time >= flush_interval:
+                flush(watcher.get_schema())
+                last_flush_time = time.time()
+                logger.info('   %s events (%.0f events/s), %s documents added',
+                            watcher.events, watcher.events / (last_flush_time - start_time),
+                            watcher.added)
+    except KeyboardInterrupt:
+        logger.info('Stop watching')
+
+    duration = time.time() - start_time
+    logger.info('%s events in %.2f s (%.0f events/s), %s documents added', watcher.events,
+                duration, watcher.events / duration if duration else 0., watcher.added)
+    return watcher.get_schema()
+
+
+def iterate_change_events(change_events):
+    """ Iterate over change events, yielding None while a change stream has no new event
+
+    :param change_events: pymongo.change_stream.ChangeStream or iterable of change events
+    :return events: iterator of dict or None
+    """
+    if not hasattr(change_events, 'try_next'):
+        for event in change_events:
+            yield event
+        return
+    with change_events:
+        while change_events.alive:
+            yield change_events.try_next()
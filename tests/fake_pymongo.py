@@ -0,0 +1,168 @@
+# coding: utf8
+"""
+In-memory stand-in for the few pymongo client features used by the extract module.
+
+A FakeClient is built from a {database_name: {collection_name: [documents]}} dict,
+so that it can be re-created from its arguments in worker processes.
+
+Queries only support '$and', and conditions on fields (possibly dotted) with '$lt', '$lte',
+'$gt', '$gte', '$ne', '$nin' and '$not': {'$type': alias}.
+Cursors only support sort on one key (or '$natural') and limit, and ignore find options.
+Database commands only support 'collStats', with the average size of BSON encoded documents.
+Pipelines only support '$sample' (evenly spaced documents are returned), '$project' and '$match'
+stages.
+"""
+import bson
+
+TYPE_ALIASES = {
+    bson.objectid.ObjectId: 'objectId',
+    str: 'string',
+    int: 'number',
+    float: 'number',
+    bson.datetime.datetime: 'date',
+}
+
+
+class FakeClient(object):
+    """Stand-in for pymongo.MongoClient"""
+
+    def __init__(self, databases):
+        self.databases = databases
+
+    def __getitem__(self, name):
+        return FakeDatabase(self, name)
+
+    def list_database_names(self):
+        return list(self.databases) + ['admin', 'local']
+
+
+class FakeDatabase(object):
+    """Stand-in for pymongo.database.Database"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+    def list_collection_names(self):
+        return list(self.client.databases[self.name])
+
+    def command(self, command, value):
+        if command != 'collStats':
+            raise NotImplementedError(command)
+        documents = self.client.databases[self.name][value]
+        stats = {'ns': '{}.{}'.format(self.name, value), 'count': len(documents)}
+        if documents:
+            stats['avgObjSize'] = sum(len(bson.encode(doc)) for doc in documents) // len(documents)
+        return stats
+
+
+class FakeCollection(object):
+    """Stand-in for pymongo.collection.Collection"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.documents = database.client.databases[database.name][name]
+
+    @property
+    def full_name(self):
+        return '{}.{}'.format(self.database.name, self.name)
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return FakeCursor([doc for doc in self.documents if match(doc, filter or {})])
+
+    def find_raw_batches(self, filter=None, **kwargs):
+        return raw_batches(self.find(filter))
+
+    def aggregate_raw_batches(self, pipeline, **kwargs):
+        return raw_batches(self.aggregate(pipeline))
+
+    def aggregate(self, pipeline, **kwargs):
+        documents = self.documents
+        for stage in pipeline:
+            if '$sample' in stage:
+                size = min(stage['$sample']['size'], len(documents))
+                documents = [documents[i * len(documents) // size] for i in range(size)]
+            elif '$project' in stage:
+                documents = [{k: doc[k] for k in stage['$project'] if k in doc}
+                             for doc in documents]
+            elif '$match' in stage:
+                documents = [doc for doc in documents if match(doc, stage['$match'])]
+            else:
+                raise NotImplementedError(stage)
+        return iter(documents)
+
+
+class FakeCursor(object):
+    """Stand-in for pymongo.cursor.Cursor"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def sort(self, key, direction=1):
+        if key == '$natural':
+            documents = list(self.documents)
+        else:
+            documents = sorted(self.documents, key=lambda doc: get_path(doc, key))
+        return FakeCursor(documents[::direction])
+
+    def limit(self, limit):
+        return FakeCursor(self.documents[:limit or None])
+
+
+def raw_batches(documents, batch_size=2):
+    """Group BSON encoded documents in batches"""
+    documents = [bson.encode(document) for document in documents]
+    return [b''.join(documents[i:i + batch_size]) for i in range(0, len(documents), batch_size)]
+
+
+def match(document, filter):
+    """Check if a document matches a query"""
+    for key, conditions in filter.items():
+        if key == '$and':
+            if not all(match(document, sub_filter) for sub_filter in conditions):
+                return False
+            continue
+        for operator, operand in conditions.items():
+            value = get_path(document, key)
+            if operator == '$ne':
+                if value == operand:
+                    return False
+                continue
+            if operator == '$nin':
+                if value in operand:
+                    return False
+                continue
+            if operator == '$not':
+                if TYPE_ALIASES.get(type(value)) == operand['$type']:
+                    return False
+                continue
+            if TYPE_ALIASES.get(type(value)) != TYPE_ALIASES.get(type(operand)):
+                return False
+            if operator == '$lt' and not value < operand:
+                return False
+            if operator == '$lte' and not value <= operand:
+                return False
+            if operator == '$gte' and not value >= operand:
+                return False
+            if operator == '$gt' and not value > operand:
+                return False
+    return True
+
+
+def get_path(document, key):
+    """Get the value of a dotted key in a document, None if missing"""
+    for field in key.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(field)
+    return document
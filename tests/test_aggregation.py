@@ -0,0 +1,128 @@
+from pymongo_schema.aggregation import *
+from pymongo_schema.extract import (MAP_KEY, init_empty_object_schema,
+                                    add_document_to_object_schema, object_schema_to_dict,
+                                    post_process_schema)
+
+
+def group(field, bson_type, count):
+    return {'_id': {'k': field, 't': bson_type}, 'count': count}
+
+
+def facet_result(*objects_results):
+    """Result of a pipeline, from the results of sub-pipelines of each objects of a depth"""
+    return {'o{}_{}'.format(i, key): value for i, objects_result in enumerate(objects_results)
+            for key, value in objects_result.items()}
+
+
+class CannedCollection(object):
+    """Return sampled _id, then facet results in the order of pipelines, one pipeline by depth"""
+
+    def __init__(self, facet_results, sampled_ids=()):
+        self.facet_results = facet_results
+        self.sampled_ids = sampled_ids
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        if pipeline[-1] == {'$project': {'_id': 1}}:
+            return iter([{'_id': _id} for _id in self.sampled_ids])
+        self.pipelines.append(pipeline)
+        return iter([self.facet_results[len(self.pipelines) - 1]])
+
+
+def test00_facet_result_to_object_schema():
+    facet_result = {'count': [{'count': 3}],
+                    'types': [group('a', 'int', 2), group('a', 'long', 1),
+                              group('b', 'array', 1), group('b', 'regex', 1),
+                              group('b', 'javascript', 1)],
+                    'array_types': [group('b', 'missing', 1)]}
+    count, object_schema = facet_result_to_object_schema(facet_result)
+    assert count == 3
+    assert object_schema == {
+        'a': {'count': 3, 'types_count': {'integer': 2, 'biginteger': 1}},
+        'b': {'count': 3, 'types_count': {'ARRAY': 1, 'unknown': 2},
+              'array_types_count': {'null': 1}}}
+
+
+def test01_facet_result_to_object_schema_empty():
+    assert facet_result_to_object_schema({'count': [], 'types': [], 'array_types': []}) == (0, {})
+
+
+def test02_extract_object_schema_with_pipelines():
+    documents = [{'a': {'b': 1}, 'c': [{'b': 'x'}, 2]}, {'a': 2}]
+    collection = CannedCollection([
+        facet_result({'count': [{'count': 2}],
+                      'types': [group('a', 'object', 1), group('a', 'int', 1),
+                                group('c', 'array', 1)],
+                      'array_types': [group('c', 'object', 1), group('c', 'int', 1)]}),
+        facet_result({'count': [{'count': 1}], 'types': [group('b', 'int', 1)],
+                      'array_types': []},
+                     {'count': [{'count': 1}], 'types': [group('b', 'int', 1)],
+                      'array_types': []}),
+    ])
+    count, object_schema = extract_object_schema_with_pipelines(collection)
+    assert count == 2
+
+    expected = init_empty_object_schema()
+    for document in documents:
+        add_document_to_object_schema(document, expected)
+    expected = object_schema_to_dict(expected)
+    expected['c']['object']['b']['types_count'] = {'integer': 1}  # from canned result
+    assert object_schema == expected
+    # One pipeline by depth
+    assert len(collection.pipelines) == 2
+    assert sorted(collection.pipelines[1][-1]['$facet']) == [
+        'o0_array_types', 'o0_count', 'o0_types', 'o1_array_types', 'o1_count', 'o1_types']
+
+
+def test03_pipelines_stages():
+    collection = CannedCollection([facet_result({'count': [], 'types': [], 'array_types': []})])
+    extract_object_schema_with_pipelines(collection, query={'_id': {'$lt': 5}})
+    assert collection.pipelines[0][:2] == [{'$match': {'_id': {'$lt': 5}}},
+                                           {'$project': {'_v': '$$ROOT'}}]
+    assert '$facet' in collection.pipelines[0][2]
+
+
+def test04_sampled_pipelines():
+    # a is an object in both sampled documents, with b in one of them
+    collection = CannedCollection([
+        facet_result({'count': [{'count': 2}], 'types': [group('a', 'object', 2)],
+                      'array_types': []}),
+        facet_result({'count': [{'count': 2}], 'types': [group('b', 'int', 1)],
+                      'array_types': []}),
+    ], sampled_ids=[3, 1])
+    count, object_schema = extract_object_schema_with_pipelines(collection, sample_size=2)
+    # Each depth analyzes the same sampled documents
+    for pipeline in collection.pipelines:
+        assert pipeline[:2] == [{'$match': {'_id': {'$in': [3, 1]}}},
+                                {'$project': {'_v': '$$ROOT'}}]
+        assert not any('$sample' in stage for stage in pipeline)
+    collection_schema = {'count': count, 'object': object_schema}
+    post_process_schema(collection_schema)
+    assert collection_schema['object']['a']['prop_in_object'] == 1
+    assert collection_schema['object']['a']['object']['b']['prop_in_object'] == 0.5
+
+
+def test05_collapse_map_like_objects():
+    documents = [{'by_year': {str(2000 + j): {'n': j} for j in range(30)}} for _ in range(2)]
+    collection = CannedCollection([
+        facet_result({'count': [{'count': 2}], 'types': [group('by_year', 'object', 2)],
+                      'array_types': []}),
+        facet_result({'count': [{'count': 2}],
+                      'types': [group(str(2000 + j), 'object', 2) for j in range(30)],
+                      'array_types': []}),
+        facet_result({'count': [{'count': 60}], 'types': [group('n', 'int', 60)],
+                      'array_types': []}),
+    ])
+    count, object_schema = extract_object_schema_with_pipelines(collection)
+    expected = init_empty_object_schema()
+    for document in documents:
+        add_document_to_object_schema(document, expected)
+    assert object_schema == object_schema_to_dict(expected)
+    assert list(object_schema['by_year']['object']) == [MAP_KEY]
+
+    # Values of all keys are analyzed by a single sub-pipeline
+    assert len(collection.pipelines) == 3
+    map_key_stages = collection.pipelines[2][-1]['$facet']['o0_count']
+    assert map_key_stages[:-1] == nested_objects_stages('by_year') + \
+        nested_objects_stages(MAP_KEY)
+    assert {'$match': {'_v.k': MAP_KEY}} not in map_key_stages
@@ -0,0 +1,90 @@
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+from pymongo_schema.checkpoint import *
+from pymongo_schema.extract import extract_collection_schema
+from tests.fake_pymongo import FakeClient, FakeCollection
+
+DOCUMENTS = [{'_id': i, 'a': i if i % 2 else str(i)} for i in range(10)]
+
+
+class FlakyCollection(FakeCollection):
+    """Collection whose successive cursors raise error after reading some documents"""
+
+    def __init__(self, documents, fail_after, error):
+        super(FlakyCollection, self).__init__(FakeClient({'db': {'coll': documents}})['db'],
+                                              'coll')
+        self.fail_after = list(fail_after)
+        self.error = error
+        self.opened = 0
+
+    def find(self, filter=None, projection=None, **kwargs):
+        self.opened += 1
+        fail_after = self.fail_after.pop(0) if self.fail_after else None
+        return FlakyCursor(super(FlakyCollection, self).find(filter, projection), fail_after,
+                           self.error)
+
+
+class FlakyCursor(object):
+    def __init__(self, cursor, fail_after, error):
+        self.cursor = cursor
+        self.fail_after = fail_after
+        self.error = error
+
+    def sort(self, key, direction=1):
+        return FlakyCursor(self.cursor.sort(key, direction), self.fail_after, self.error)
+
+    def __iter__(self):
+        for i, document in enumerate(self.cursor):
+            if i == self.fail_after:
+                raise self.error
+            yield document
+
+
+def test00_save_load_checkpoint(tmpdir):
+    path = str(tmpdir.join('db.coll.json'))
+    assert load_checkpoint(path, 'db.coll') is None
+    state = {'namespace': 'db.coll', 'query': {}, 'scanned': 2, 'last_id': ObjectId(),
+             'complete': False, 'object': {'a': {'count': 2, 'types_count': {'integer': 2}}}}
+    save_checkpoint(path, state)
+    assert load_checkpoint(path, 'db.coll') == state
+    with pytest.raises(ValueError):
+        load_checkpoint(path, 'db.other')
+    with pytest.raises(ValueError):
+        load_checkpoint(path, 'db.coll', {'a': 1})
+
+
+def test01_find_by_id_retries():
+    collection = FlakyCollection(DOCUMENTS[::-1], [3, 0, 4], AutoReconnect('failover'))
+    assert list(find_by_id(collection, retry_delay=0)) == DOCUMENTS
+    assert collection.opened == 4
+    assert list(find_by_id(collection, last_id=7)) == DOCUMENTS[8:]
+
+    collection = FlakyCollection(DOCUMENTS, [3, 0, 0], AutoReconnect('failover'))
+    with pytest.raises(AutoReconnect):
+        list(find_by_id(collection, retries=1, retry_delay=0))
+
+
+def test02_extract_collection_schema_resume(tmpdir):
+    checkpoint_dir = str(tmpdir)
+    expected = extract_collection_schema(FakeClient({'db': {'coll': DOCUMENTS}})['db']['coll'])
+
+    collection = FlakyCollection(DOCUMENTS, [7], RuntimeError('out of memory'))
+    with pytest.raises(RuntimeError):
+        extract_collection_schema(collection, checkpoint_dir=checkpoint_dir, checkpoint_every=3)
+    state = load_checkpoint(checkpoint_path(checkpoint_dir, collection), 'db.coll')
+    assert (state['scanned'], state['last_id'], state['complete']) == (6, 5, False)
+
+    collection = FlakyCollection(DOCUMENTS, [], None)
+    assert extract_collection_schema(collection, checkpoint_dir=checkpoint_dir,
+                                     checkpoint_every=3, resume=True) == expected
+    state = load_checkpoint(checkpoint_path(checkpoint_dir, collection), 'db.coll')
+    assert (state['scanned'], state['complete']) == (10, True)
+
+    assert extract_collection_schema(collection, checkpoint_dir=checkpoint_dir,
+                                     resume=True) == expected
+    assert collection.opened == 1
+
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, sample_size=5, checkpoint_dir=checkpoint_dir)
@@ -0,0 +1,104 @@
+import gzip
+import io
+import os
+import struct
+
+import bson
+import pytest
+
+from pymongo_schema.dump import *
+from pymongo_schema.extract import extract_pymongo_client_schema, init_empty_object_schema
+from tests.fake_pymongo import FakeClient
+
+DATABASES = {
+    'db1': {'col1': [{'_id': i, 'a': i if i % 3 else str(i), 'b': {'c': [1.5, None]}}
+                     for i in range(100)],
+            'col/2': [{'_id': bson.ObjectId(), 'd': bson.Int64(1)}]},
+    'db2': {'col1': [{'_id': 1, 'e': True}, {'_id': 2}]},
+}
+
+
+def write_dump_dir(dump_dir, gzipped=False):
+    """Write DATABASES as mongodump would, with escaped file names and system collections"""
+    for database, collections in dict(DATABASES, admin={'system.version': [{'_id': 1}]}).items():
+        os.mkdir(os.path.join(dump_dir, database))
+        for collection, documents in collections.items():
+            path = os.path.join(dump_dir, database, collection.replace('/', '%2F'))
+            with (gzip.open(path + '.bson.gz', 'wb') if gzipped
+                  else open(path + '.bson', 'wb')) as f:
+                for document in documents:
+                    f.write(bson.encode(document))
+            with open(path + '.metadata.json', 'w') as f:
+                f.write('{}')
+
+
+def write_dump_archive(path):
+    """Write DATABASES in a mongodump archive, with interleaved blocks of 10 documents"""
+    terminator = struct.pack('<i', -1)
+    blocks = []
+    for database, collections in DATABASES.items():
+        for collection, documents in collections.items():
+            header = {'db': database, 'collection': collection, 'EOF': False, 'CRC': 0}
+            for i in range(0, len(documents), 10):
+                blocks.append([header] + documents[i:i + 10])
+            blocks.append([dict(header, EOF=True)])
+    blocks.sort(key=lambda block: len(block))  # interleave collections
+    with gzip.open(path, 'wb') as f:
+        f.write(struct.pack('<I', ARCHIVE_MAGIC_NUMBER))
+        f.write(bson.encode({'concurrent_collections': 4, 'version': '0.1'}))
+        for database, collections in DATABASES.items():
+            for collection in collections:
+                f.write(bson.encode({'db': database, 'collection': collection,
+                                     'metadata': '{}', 'size': 0, 'type': 'collection'}))
+        f.write(terminator)
+        for block in blocks:
+            for document in block:
+                f.write(bson.encode(document))
+            f.write(terminator)
+
+
+@pytest.fixture(scope='module')
+def expected_schema():
+    return extract_pymongo_client_schema(FakeClient(DATABASES))
+
+
+def test00_split_dump_file(tmpdir):
+    write_dump_dir(str(tmpdir))
+    path = str(tmpdir.join('db1', 'col1.bson'))
+    document_size = len(bson.encode(DATABASES['db1']['col1'][0]))
+    chunks = split_dump_file(path, chunk_size=30 * document_size)
+    assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize(path)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:]))
+    assert 3 <= len(chunks) <= 4
+    assert split_dump_file(path) == [(0, os.path.getsize(path))]
+
+
+def test01_extract_dump_schema_dir(tmpdir, expected_schema):
+    write_dump_dir(str(tmpdir))
+    assert extract_dump_schema(str(tmpdir)) == expected_schema
+    assert extract_dump_schema(str(tmpdir), workers=2, chunk_size=500) == expected_schema
+    assert list(extract_dump_schema(str(tmpdir), 'db1', ['col/2'])['db1']) == ['col/2']
+
+
+def test02_extract_dump_schema_gzip(tmpdir, expected_schema):
+    write_dump_dir(str(tmpdir), gzipped=True)
+    assert extract_dump_schema(str(tmpdir)) == expected_schema
+
+
+def test03_extract_dump_schema_archive(tmpdir, expected_schema):
+    path = str(tmpdir.join('dump.archive.gz'))
+    write_dump_archive(path)
+    assert extract_dump_schema(path) == expected_schema
+    assert list(extract_dump_schema(path, collection_names='col1')) == ['db1', 'db2']
+
+    with open(path, 'wb') as f:
+        f.write(bson.encode({'a': 1}))
+    with pytest.raises(ValueError):
+        extract_dump_schema(path)
+
+
+def test04_add_bson_stream_to_object_schema_truncated():
+    data = bson.encode({'a': 1}) * 3
+    with pytest.raises(ValueError):
+        add_bson_stream_to_object_schema(io.BytesIO(data[:-2]), init_empty_object_schema(),
+                                          read_size=5)
@@ -3,7 +3,9 @@ import filecmp
 from datetime import datetime
 
 import pytest
-from bson import ObjectId
+import pandas as pd
+from bson import ObjectId, json_util
+from openpyxl import load_workbook
 from pandas.testing import assert_frame_equal
 
 from pymongo_schema.export import *
@@ -400,4 +402,60 @@ def test18_schema_from_code():
            'columns': ['Field_compact_name', 'Field_name', 'Default', 'Field', 'Count']}
     transform_data_to_file(schema, **arg)
     assert filecmp.cmp(output_file, expected_file)
-    os.remove(output_file)
\ No newline at end of file
+    os.remove(output_file)
+
+
+def test19_html_escapes_map_key():
+    schema = {'db': {'coll': {'count': 1, 'object': {'scores': {
+        'count': 1, 'prop_in_object': 1.0, 'type': 'OBJECT', 'types_count': {'OBJECT': 1},
+        'object': {'<key>': {'count': 3, 'prop_in_object': 3.0, 'type': 'integer',
+                             'types_count': {'integer': 3}}}}}}}}
+    output_file = os.path.join(TEST_DIR, 'output_map_key.html')
+    transform_data_to_file(schema, formats=['html'], output=output_file)
+    with open(output_file) as f:
+        html_output = f.read()
+    assert '<td>&lt;key&gt;</td>' in html_output
+    assert '<key>' not in html_output
+    os.remove(output_file)
+
+
+def test20_value_stats_columns():
+    schema = {'db': {'coll': {'count': 3, 'object': {'status': {
+        'count': 3, 'prop_in_object': 1.0, 'type': 'string', 'types_count': {'string': 3},
+        'value_stats': {'count': 3, 'null_count': 0, 'distinct_count': 2, 'length_min': 2,
+                        'length_max': 4, 'top_values': [['done', 2], ['ok', 1]],
+                        'sketches': {}}}}}}}
+    columns = ['Field_full_name', 'Distinct_count', 'Length_max', 'Top_values']
+    res = _SchemaPreProcessing.convert_to_dataframe(schema, columns)
+    assert res.values.tolist() == [['db', 'coll', 'status', 2, 4, 'done : 2, ok : 1']]
+    assert 'sketches' not in _SchemaPreProcessing.filter_data(schema)['db']['coll']['object'][
+        'status']['value_stats']
+
+
+def test21_list_outputs_stream_lines(schema_ex_dict, columns, long_diff):
+    import io
+    lines = list(_SchemaPreProcessing.iterate_lines(schema_ex_dict, columns))
+    assert lines == _SchemaPreProcessing.convert_to_dataframe(
+        schema_ex_dict, columns).values.tolist()
+    for output_class in [TsvOutput, MdOutput, HtmlOutput]:
+        output_maker = output_class(schema_ex_dict, columns_to_get=columns)
+        output_maker.write_data(io.StringIO())
+        assert output_maker._data_df is None
+
+    tsv = io.StringIO()
+    TsvOutput(long_diff, category='diff').write_data(tsv)
+    assert tsv.getvalue().splitlines()[1] == 'db0\t\t\tdb0\t'
+
+
+def test22_md_groups_unsorted_lines():
+    import io
+    output_maker = MdOutput({})
+    output_maker.data_df = pd.DataFrame([['db1', 'c1', 'a', 1], ['db2', 'c1', 'bbbbbbbb', None],
+                                         ['db1', 'c2', 'c', 2.5], ['db1', 'c1', 'd', 3]],
+                                        columns=['Database', 'Collection', 'Field', 'Count'])
+    md = io.StringIO()
+    output_maker.write_data(md)
+    assert [line for line in md.getvalue().splitlines() if line.startswith('#')] == [
+        '### Database: db1', '#### Collection: c1 ', '#### Collection: c2 ',
+        '### Database: db2', '#### Collection: c1 ']
+    assert '|a            |1.0       |' in md.getvalue()
@@ -6,6 +6,15 @@ from pymongo import MongoClient
 
 from pymongo_schema.extract import *
 from tests import TEST_DIR
+from tests.fake_pymongo import FakeClient
+
+
+FAKE_DATABASES = {
+    'db1': {'col1': [{'a': 1, 'b': 'x'}, {'a': 2.5}],
+            'col2': [{'c': [1, {'d': None}]}]},
+    'db2': {'col1': [{'e': True}, {'e': {'f': 1}}, {}]},
+    'db3': {},
+}
 
 
 @pytest.yield_fixture(scope='module')
@@ -30,52 +39,55 @@ def test01_default_to_regular_dict_rec():
 
 
 def test02_add_value_type():
-    schema = {'types_count': {'integer': 5}}
+    schema = FieldStats()
     add_value_type(2, schema)
-    assert schema == {'types_count': {'integer': 6}}
+    add_value_type(3, schema)
+    assert schema.to_dict() == {'count': 0, 'types_count': {'integer': 2}}
 
 
 def test03_add_list_to_schema_simple():
-    schema = {}
+    schema = FieldStats()
     add_potential_list_to_field_schema([1, 2, 3], schema)
-    assert schema == {'array_types_count': {'integer': 3}}
+    assert schema.to_dict() == {'count': 0, 'types_count': {},
+                                'array_types_count': {'integer': 3}}
 
 
 def test04_add_list_to_schema_empty():
-    schema = {}
+    schema = FieldStats()
     add_potential_list_to_field_schema([], schema)
-    assert schema == {'array_types_count': {'null': 1}}
+    assert schema.to_dict() == {'count': 0, 'types_count': {}, 'array_types_count': {'null': 1}}
 
 
 def test05_add_list_to_schema_empty_not_list():
-    schema = {}
+    schema = FieldStats()
     add_potential_list_to_field_schema(5, schema)
-    assert schema == {}
+    assert schema == FieldStats()
 
 
 def test06_add_list_to_schema_empty_long():
-    schema = {}
+    schema = FieldStats()
     add_potential_list_to_field_schema([{"a": 1}], schema)
-    assert schema == {'array_types_count': {"OBJECT": 1},
-                      "object": {"a": {"types_count": {"integer": 1}, "count": 1}}}
+    assert schema.to_dict() == {'count': 0, 'types_count': {}, 'array_types_count': {"OBJECT": 1},
+                                "object": {"a": {"types_count": {"integer": 1}, "count": 1}}}
 
 
 def test07_add_doc_to_schema_simple():
-    schema = {}
+    schema = FieldStats()
     add_potential_document_to_field_schema({"a": 1}, schema)
-    assert schema == {"object": {"a": {"types_count": {"integer": 1}, "count": 1}}}
+    assert schema.to_dict() == {'count': 0, 'types_count': {},
+                                "object": {"a": {"types_count": {"integer": 1}, "count": 1}}}
 
 
 def test08_add_doc_to_schema_empty():
-    schema = {}
+    schema = FieldStats()
     add_potential_document_to_field_schema({}, schema)
-    assert schema == {"object": {}}
+    assert schema.to_dict() == {'count': 0, 'types_count': {}, "object": {}}
 
 
 def test09_add_doc_to_schema_not_dict():
-    schema = {}
+    schema = FieldStats()
     add_potential_document_to_field_schema(5, schema)
-    assert schema == {}
+    assert schema == FieldStats()
 
 
 def test10_add_doc_to_object_schema():
@@ -87,7 +99,7 @@ def test10_add_doc_to_object_schema():
                                        'array_types_count': {'null': 1}}}},
                 'b': {'types_count': {'ARRAY': 1}, 'count': 1, 'object': {},
                       'array_types_count': {'integer': 2, 'OBJECT': 1}}}
-    assert schema == expected
+    assert object_schema_to_dict(schema) == expected
 
 
 def test11_summarize_types_simple():
@@ -116,3 +128,382 @@ def test_extract_schema(pymongo_client):
                                                      database_names='test_db',
                                                      collection_names='test_col')
     assert mongo_schema_expected == mongo_schema_got
+
+
+def test13_extract_schema_workers():
+    client = FakeClient(FAKE_DATABASES)
+    expected = extract_pymongo_client_schema(client)
+    got = extract_pymongo_client_schema(client, workers=2,
+                                        client_kwargs={'databases': FAKE_DATABASES})
+    assert got == expected
+    assert list(got) == ['db1', 'db2']
+    assert list(got['db1']) == ['col1', 'col2']
+
+
+def test14_extract_database_schema_workers():
+    client = FakeClient(FAKE_DATABASES)
+    got = extract_database_schema(client['db1'], collection_names=['col2', 'col1'], workers=2,
+                                  client_kwargs={'databases': FAKE_DATABASES})
+    assert list(got) == ['col2', 'col1']
+    assert got['col2'] == extract_collection_schema(client['db1']['col2'])
+
+
+def test15_get_client_kwargs():
+    assert get_client_kwargs(MongoClient(port=27018, connect=False))['port'] == 27018
+    with pytest.raises(ValueError):
+        get_client_kwargs(FakeClient(FAKE_DATABASES))
+
+
+def test16_split_collection_id_ranges():
+    documents = [{'_id': i} for i in range(1000)] + [{'_id': 'str_id'}]
+    collection = FakeClient({'db': {'col': documents}})['db']['col']
+    id_filters = split_collection_id_ranges(collection, 4)
+    assert id_filters[0] == {'_id': {'$lt': 250}}
+    assert id_filters[-1] == {'_id': {'$not': {'$type': 'number'}}}
+    assert len(id_filters) == 5
+    matched = sorted(len(list(collection.find(id_filter))) for id_filter in id_filters)
+    assert matched == [1, 250, 250, 250, 250]
+
+
+def test17_split_collection_id_ranges_too_few_ids():
+    collection = FakeClient({'db': {'col': [{'_id': 1}]}})['db']['col']
+    assert split_collection_id_ranges(collection, 4) == [{}]
+
+
+def test18_extract_collection_schema_partitions():
+    documents = [{'_id': i, 'a': i if i % 3 else str(i), 'b': [{'c': i}]} for i in range(500)]
+    databases = {'db': {'col': documents}}
+    collection = FakeClient(databases)['db']['col']
+    got = extract_collection_schema(collection, workers=3, partitions=4,
+                                    client_kwargs={'databases': databases})
+    assert got == extract_collection_schema(collection)
+
+
+def test19_add_object_schema_to_object_schema():
+    object_schema = init_empty_object_schema()
+    add_document_to_object_schema({'a': 1, 'b': [{'c': 1}]}, object_schema)
+    other_schema = init_empty_object_schema()
+    add_document_to_object_schema({'a': 'x', 'b': []}, other_schema)
+    add_object_schema_to_object_schema(object_schema_to_dict(other_schema), object_schema)
+    expected = init_empty_object_schema()
+    for document in [{'a': 1, 'b': [{'c': 1}]}, {'a': 'x', 'b': []}]:
+        add_document_to_object_schema(document, expected)
+    assert object_schema == expected
+
+
+def test20_extract_collection_schema_wrong_engine():
+    collection = FakeClient(FAKE_DATABASES)['db1']['col1']
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, engine='javascript')
+
+
+def test21_extract_collection_schema_rawbson():
+    client = FakeClient(FAKE_DATABASES)
+    for database, collection in [('db1', 'col1'), ('db1', 'col2'), ('db2', 'col1')]:
+        pymongo_collection = client[database][collection]
+        assert extract_collection_schema(pymongo_collection, engine='rawbson') == \
+            extract_collection_schema(pymongo_collection)
+        assert extract_collection_schema(pymongo_collection, sample_size=1, engine='rawbson') == \
+            extract_collection_schema(pymongo_collection, sample_size=1)
+
+
+SHAPE_DOCUMENTS = [
+    {'a': 1, 'b': [1, {'c': 'x'}], 'd': {'e': None}},
+    {'a': 2, 'b': [1, {'c': 'y'}], 'd': {'e': None}},
+    {'a': 'x', 'b': [1, {'c': 'x'}], 'd': {'e': None}},
+    {'a': 1, 'b': [1, {'c': 1}], 'd': {'e': None}},
+    {'a': 1, 'b': [], 'd': [{'e': None}, {'f': 1}]},
+    {'a': 1, 'b': [1, {'c': 'x'}], 'd': {'e': None}},
+]
+
+
+def plain_object_schema(documents):
+    object_schema = init_empty_object_schema()
+    for document in documents:
+        add_document_to_object_schema(document, object_schema)
+    return object_schema
+
+
+def test22_document_shape():
+    shapes = set(document_shape(document) for document in SHAPE_DOCUMENTS)
+    assert len(shapes) == 4
+    assert document_shape({'a': [{}]}) != document_shape({'a': [[]]})
+    assert document_shape({'a': 1, 'b': 2}) != document_shape({'b': 1, 'a': 2})
+
+
+def test23_document_shape_cache():
+    object_schema = init_empty_object_schema()
+    shape_cache = DocumentShapeCache(object_schema)
+    for document in SHAPE_DOCUMENTS * 3:
+        shape_cache.add_document(document)
+    shape_cache.flush()
+    assert (shape_cache.hits, shape_cache.misses) == (14, 4)
+    assert object_schema == plain_object_schema(SHAPE_DOCUMENTS * 3)
+
+
+def test24_document_shape_cache_eviction():
+    object_schema = init_empty_object_schema()
+    shape_cache = DocumentShapeCache(object_schema, max_size=2)
+    for document in SHAPE_DOCUMENTS * 3:
+        shape_cache.add_document(document)
+    shape_cache.flush()
+    shape_cache.flush()
+    assert object_schema == plain_object_schema(SHAPE_DOCUMENTS * 3)
+
+
+def test25_document_shape_cache_disabled():
+    documents = [{'a': list(range(i))} for i in range(300)]
+    object_schema = init_empty_object_schema()
+    shape_cache = DocumentShapeCache(object_schema)
+    for document in documents:
+        shape_cache.add_document(document)
+    shape_cache.flush()
+    assert shape_cache.misses == DocumentShapeCache.MIN_MISSES_TO_DISABLE + 1
+    assert object_schema == plain_object_schema(documents)
+
+
+def test26_extract_collection_schema_without_shape_cache():
+    collection = FakeClient({'db': {'col': SHAPE_DOCUMENTS}})['db']['col']
+    assert extract_collection_schema(collection, shape_cache_size=0) == \
+        extract_collection_schema(collection)
+
+
+def test27_object_schema_to_dict_post_processed():
+    documents = SHAPE_DOCUMENTS + [{'a': [], 'd': {'e': [1.5, {'f': None}]}}]
+    object_schema = plain_object_schema(documents)
+    expected = {'count': len(documents), 'object': object_schema_to_dict(object_schema)}
+    post_process_schema(expected)
+    assert object_schema_to_dict(object_schema, len(documents)) == expected['object']
+
+
+def test28_schema_convergence():
+    convergence = SchemaConvergence(3)
+    documents = [{'a': 1}, {'a': 2}, {'a': 'x'}, {'a': 3, 'b': [{'c': 1}]}, {'a': 4},
+                 {'a': 5, 'b': [{'c': 2}]}, {'a': 6}]
+    assert [convergence.add_document(document) for document in documents] == \
+        [False, False, False, False, False, False, True]
+
+
+def test29_sample_documents_batches():
+    collection = FakeClient({'db': {'coll': [{'_id': i} for i in range(10)]}})['db']['coll']
+    ids = [document['_id'] for document in sample_documents_batches(collection, 2)]
+    assert sorted(ids) == list(range(10))
+    assert len(list(sample_documents_batches(collection, 2, max_size=5))) == 2 + 3
+    assert len(list(sample_documents_batches(collection, 2, max_size=50))) == 10
+    ids = [document['_id']
+           for document in sample_documents_batches(collection, 2, query={'_id': {'$lt': 3}})]
+    assert sorted(ids) == [0, 1, 2]
+
+    collection_schema = extract_collection_schema(collection, convergence_size=2)
+    assert collection_schema['analyzed_count'] <= collection_schema['count']
+
+    # $sample stays the first stage, so that MongoDB does not scan the collection
+    pipelines = []
+    aggregate = collection.aggregate
+    collection.aggregate = lambda pipeline, **kwargs: pipelines.append(pipeline) or \
+        aggregate(pipeline, **kwargs)
+    list(sample_documents_batches(collection, 2))
+    assert len(pipelines) > 1
+    assert all(list(pipeline[0]) == ['$sample'] for pipeline in pipelines)
+
+
+def test30_extract_collection_schema_convergence():
+    documents = [{'_id': i, 'a': i} for i in range(1000)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    collection_schema = extract_collection_schema(collection, convergence_size=10)
+    assert collection_schema['count'] == 1000
+    assert collection_schema['analyzed_count'] == 11
+    assert collection_schema['object']['a']['prop_in_object'] == 1
+    assert extract_collection_schema(collection, convergence_size=10, sample_size=5)[
+        'analyzed_count'] == 5
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, convergence_size=10, engine='rawbson')
+
+
+def test31_extract_collection_schema_sampling():
+    collection = FakeClient({'db': {'coll': [{'_id': i, 'a': i} for i in range(100)]}})['db']['coll']
+    collection_schema = extract_collection_schema(collection, sample_size=10)
+    assert collection_schema['sampling'] == 'random'
+    collection_schema = extract_collection_schema(collection, sample_size=10,
+                                                  collections_sampling={'db.coll': 'last'})
+    assert collection_schema['sampling'] == 'last'
+    assert collection_schema['analyzed_count'] == 10
+    collection_schema = extract_collection_schema(collection, sample_size=10,
+                                                  sampling='stratified', convergence_size=3,
+                                                  sampling_options={'strata': 5})
+    assert collection_schema['sampling'] == 'stratified'
+    assert collection_schema['analyzed_count'] == 4
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, sample_size=10, sampling='first', engine='rawbson')
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, sampling='first')
+
+
+def test32_cursor_options():
+    documents = [{'_id': i, 'a': 'x' * 100} for i in range(10)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    avg_obj_size = len(bson.encode(documents[0]))
+    assert auto_batch_size(collection, batch_bytes=10 * avg_obj_size) == 10
+    assert get_cursor_options(collection, {'batch_size': 'auto', 'no_cursor_timeout': True}) == \
+        {'batch_size': AUTO_BATCH_BYTES // avg_obj_size, 'no_cursor_timeout': True}
+    empty_collection = FakeClient({'db': {'coll': []}})['db']['coll']
+    assert get_cursor_options(empty_collection, {'batch_size': 'auto'}) == {}
+
+    for engine in ['python', 'rawbson']:
+        assert extract_collection_schema(collection, engine=engine,
+                                         cursor_options={'batch_size': 'auto'}) == \
+            extract_collection_schema(collection, engine=engine)
+
+
+def test33_collapse_map_like_objects():
+    documents = [{'_id': i, 'scores': {'u{}'.format(i * 10 + j): j for j in range(5)},
+                  'dates': {'2020-01-{:02d}'.format(i + 1): 'x' if i else 1.5}}
+                 for i in range(25)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    for shape_cache_size in [0, 1024]:
+        collection_schema = extract_collection_schema(collection, map_min_keys=20,
+                                                      shape_cache_size=shape_cache_size)
+        scores_schema = collection_schema['object']['scores']['object']
+        assert list(scores_schema) == [MAP_KEY]
+        assert scores_schema[MAP_KEY]['count'] == 5 * 25
+        assert scores_schema[MAP_KEY]['prop_in_object'] == 5
+        assert scores_schema[MAP_KEY]['types_count'] == {'integer': 5 * 25}
+        dates_schema = collection_schema['object']['dates']['object']
+        assert dates_schema[MAP_KEY]['types_count'] == {'float': 1, 'string': 24}
+
+    collection_schema = extract_collection_schema(collection, map_min_keys=0, map_max_keys=100)
+    assert list(collection_schema['object']['scores']['object']) == [MAP_KEY]
+    assert len(collection_schema['object']['dates']['object']) == 25
+
+
+def test34_collapse_map_like_objects_from_schema():
+    object_schema = init_empty_object_schema()
+    add_object_schema_to_object_schema({'a': {'count': 2, 'types_count': {'integer': 2}}},
+                                       object_schema)
+    add_object_schema_to_object_schema({MAP_KEY: {'count': 3, 'types_count': {'string': 3}}},
+                                       object_schema)
+    add_document_to_object_schema({'b': None}, object_schema)
+    assert object_schema_to_dict(object_schema) == {
+        MAP_KEY: {'count': 6, 'types_count': {'integer': 2, 'string': 3, 'null': 1}}}
+
+
+def test35_extrapolate_counts():
+    assert extrapolate_counts([2, 1, 0], 10) == [7, 3, 0]
+    assert extrapolate_counts([1, 1, 1], 100) == [34, 33, 33]
+
+
+def test36_max_array_elements():
+    documents = [{'a': [1] * 6 + ['x'] * 4 + [{'b': 1}] * 10}, {'a': [2.5, {'c': 1}]}]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    for shape_cache_size in [0, 1024]:
+        field_schema = extract_collection_schema(
+            collection, max_array_elements=5, shape_cache_size=shape_cache_size)['object']['a']
+        assert field_schema['array_types_count'] == {'integer': 20, 'float': 1, 'OBJECT': 1}
+        assert field_schema['sampled_arrays_count'] == 1
+        assert list(field_schema['object']) == ['c']
+
+    field_schema = extract_collection_schema(collection, max_array_elements=5,
+                                             array_sampling='random')['object']['a']
+    assert sum(field_schema['array_types_count'].values()) == 22
+    assert field_schema['sampled_arrays_count'] == 1
+
+
+def test37_max_depth():
+    documents = [{'a': {'b': {'c': 1}, 'd': [{'e': 1}]}, 'f': 1}]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    for shape_cache_size in [0, 1024]:
+        object_schema = extract_collection_schema(collection, max_depth=2,
+                                                  shape_cache_size=shape_cache_size)['object']
+        assert object_schema['a']['object']['b']['type'] == 'OBJECT'
+        assert 'object' not in object_schema['a']['object']['b']
+        assert 'object' not in object_schema['a']['object']['d']
+        assert object_schema['a']['object']['d']['array_type'] == 'OBJECT'
+
+
+def test38_value_stats():
+    documents = [{'a': i, 'b': 'x' * (i % 5), 'c': [i, None, 'yy']} for i in range(100)]
+    documents += [{'a': None, 'b': None}]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    object_schema = extract_collection_schema(collection, value_stats=True)['object']
+    a_stats = object_schema['a']['value_stats']
+    assert (a_stats['count'], a_stats['null_count']) == (101, 1)
+    assert (a_stats['min'], a_stats['max'], a_stats['distinct_count']) == (0, 99, 100)
+    assert a_stats['percentiles']['50'] == 49
+    b_stats = object_schema['b']['value_stats']
+    assert (b_stats['length_min'], b_stats['length_max'], b_stats['distinct_count']) == (0, 4, 5)
+    assert 'min' not in b_stats
+    c_stats = object_schema['c']['value_stats']
+    assert (c_stats['count'], c_stats['null_count'], c_stats['distinct_count']) == (300, 100, 101)
+
+    # Partial schemas combine into the statistics of all values
+    merged_object_schema = init_empty_object_schema()
+    for i in range(0, 101, 20):
+        collection = FakeClient({'db': {'coll': documents[i:i + 20]}})['db']['coll']
+        schema = json.loads(json.dumps(extract_collection_schema(collection, value_stats=True)))
+        add_object_schema_to_object_schema(schema['object'], merged_object_schema)
+    merged_schema = object_schema_to_dict(merged_object_schema, 101)
+    for field in ['a', 'b', 'c']:
+        for stat in ['count', 'null_count', 'distinct_count', 'min', 'max', 'length_max']:
+            assert (merged_schema[field]['value_stats'].get(stat) ==
+                    object_schema[field]['value_stats'].get(stat))
+    assert abs(merged_schema['a']['value_stats']['percentiles']['50'] - 49) <= 3
+
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, value_stats=True, engine='rawbson')
+
+
+def test39_top_values():
+    documents = [{'status': ['new', 'done', 'done'][i % 3], 'tags': ['x', i]} for i in range(300)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    object_schema = extract_collection_schema(collection, top_values=2)['object']
+    assert object_schema['status']['value_stats']['top_values'] == [['done', 200], ['new', 100]]
+    # Unique integers decrement counters, thus the count of 'x' is underestimated
+    assert object_schema['tags']['value_stats']['top_values'][0][0] == 'x'
+
+
+def test40_extraction_settings_by_object_schema():
+    document = {'n': {'m': {str(i): i for i in range(5)}}, 'a': [1, 2, {'b': 1}]}
+    object_schema = init_empty_object_schema(ExtractionSettings(map_min_keys=5,
+                                                                max_array_elements=1))
+    other_object_schema = init_empty_object_schema()
+    # Adding documents alternately to schemas with distinct settings does not mix them
+    for _ in range(2):
+        add_document_to_object_schema(document, object_schema)
+        add_document_to_object_schema(document, other_object_schema)
+    object_schema = object_schema_to_dict(object_schema, 2)
+    other_object_schema = object_schema_to_dict(other_object_schema, 2)
+    assert list(object_schema['n']['object']['m']['object']) == [MAP_KEY]
+    assert len(other_object_schema['n']['object']['m']['object']) == 5
+    assert object_schema['a']['sampled_arrays_count'] == 2
+    assert 'sampled_arrays_count' not in other_object_schema['a']
+
+    collection = FakeClient({'db': {'coll': [{'a': [1, 2, {'b': 1}]}]}})['db']['coll']
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, map_min_keys=0, array_sampling='last')
+    with pytest.raises(ValueError):
+        extract_collection_schema(collection, map_min_keys=0, value_stats=True,
+                                  engine='rawbson')
+
+
+def test41_extract_schema_workers_map_detection():
+    databases = {'db': {'coll': [{'_id': i, 'by_year': {str(2000 + j): j for j in range(30)}}
+                                 for i in range(10)]}}
+    client = FakeClient(databases)
+    for map_detection in [{}, {'map_max_keys': 0, 'map_min_keys': 0}]:
+        expected = extract_pymongo_client_schema(client, **map_detection)
+        got = extract_pymongo_client_schema(client, workers=2, partitions=2,
+                                            client_kwargs={'databases': databases},
+                                            **map_detection)
+        assert got == expected
+    assert len(got['db']['coll']['object']['by_year']['object']) == 30
+
+
+def test42_value_stats_of_sampled_arrays():
+    documents = [{'a': [None] * 10 + [1] * 10} for _ in range(20)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    field_schema = extract_collection_schema(collection, value_stats=True, max_array_elements=10,
+                                             array_sampling='random')['object']['a']
+    # Types counts and values statistics come from the same random elements
+    assert field_schema['value_stats']['count'] == 20 * 10
+    assert field_schema['array_types_count']['null'] == \
+        2 * field_schema['value_stats']['null_count']
@@ -190,4 +190,97 @@ def test07_compare_detailed():
     exp = [cell.value for row in load_workbook("{}.xlsx".format(exp)).active for cell in row]
     assert res == exp
     for output in outputs.values():
-        os.remove(output)
\ No newline at end of file
+        os.remove(output)
+
+
+def test08_merge():
+    output = os.path.join(TEST_DIR, "output_fctl_merged_schema.json")
+    argv = ['merge', SCHEMA_FILE, SCHEMA_FILE, '--output', output]
+    main(argv)
+
+    with open(output) as out_fd, open(SCHEMA_FILE) as exp_fd:
+        merged_schema = json.load(out_fd)
+        schema = json.load(exp_fd)
+    assert merged_schema['test_db1']['test_col1']['count'] == 2 * 25359
+    assert merged_schema['test_db1']['test_col1']['object']['name']['type'] == 'string'
+    assert set(merged_schema) == set(schema)
+    os.remove(output)
+
+
+@pytest.mark.parametrize('command', ['compare', 'transform'])
+def test09_light_commands_do_not_import_heavy_modules(command):
+    from benchmarks.startup import COMMANDS, run_command
+    output = os.path.join(TEST_DIR, "output_fctl_startup_{}".format(command))
+    _, heavy_modules = run_command(COMMANDS[command], output)
+    assert heavy_modules == []
+    os.remove(output + '.json')
+
+
+def test10_watch_replay():
+    from bson import json_util
+    from tests.test_watch import EVENTS
+    events_file = os.path.join(TEST_DIR, "output_fctl_events.jsonl")
+    with open(events_file, 'w') as f:
+        f.writelines(json_util.dumps(event) + '\n' for event in EVENTS)
+    output = os.path.join(TEST_DIR, "output_fctl_watched_schema")
+    main(['watch', '--replay', events_file, '--output', output, '--formats', 'json', 'md'])
+
+    with open(output + '.json') as f:
+        watched_schema = json.load(f)
+    assert watched_schema['db']['coll']['count'] == 3
+    assert watched_schema['db']['coll']['object']['a']['type'] == 'general_scalar'
+    assert set(watched_schema['db']) == {'coll', 'other'}
+    for path in [events_file, output + '.json', output + '.md']:
+        os.remove(path)
+
+    with pytest.raises(SystemExit):
+        main(['watch', '--collection', 'coll', '--max-events', '1'])
+
+
+def test11_extract_dump(tmpdir):
+    from tests.test_dump import DATABASES, write_dump_archive
+    archive = str(tmpdir.join('dump.archive.gz'))
+    write_dump_archive(archive)
+    output = str(tmpdir.join('dump_schema'))
+    main(['extract-dump', archive, '--databases', 'db1', '--output', output, '--formats', 'json'])
+
+    with open(output + '.json') as f:
+        dump_schema = json.load(f)
+    assert set(dump_schema['db1']) == set(DATABASES['db1'])
+    assert dump_schema['db1']['col1']['count'] == 100
+
+
+def test12_extract_json(tmpdir):
+    from tests.test_json_lines import DOCUMENTS, write_json_lines
+    path = str(tmpdir.join('users.json.gz'))
+    write_json_lines(path)
+    output = str(tmpdir.join('json_schema'))
+    main(['extract-json', path, '--database', 'shop', '--output', output, '--formats', 'json'])
+
+    with open(output + '.json') as f:
+        json_schema = json.load(f)
+    assert json_schema['shop']['users']['count'] == len(DOCUMENTS)
+    assert json_schema['shop']['users']['object']['b']['object']['c']['array_type'] == 'float'
+
+
+def test13_extraction_benchmark():
+    from benchmarks.extraction import benchmark_extraction, compare_to_baseline
+    results = benchmark_extraction(['map_like'], documents=50, runs=1, cases=['python'],
+                                   trace_documents=10)
+    python_results = results['scenarios']['map_like']['python']
+    assert python_results['docs_per_s'] > 0 and python_results['peak_rss_mib'] > 0
+    assert 'peak_bytes_per_doc' in python_results
+    assert results['scenarios']['map_like']['conversion']['fields'] > 0
+
+    compare_to_baseline(results, json.loads(json.dumps(results)))
+    assert python_results['docs_per_s_ratio'] == 1
+    assert 'bson_bytes_per_doc_ratio' not in python_results
+
+
+def test14_export_benchmark():
+    from benchmarks.export import benchmark_export, output_formats
+    assert output_formats() == ['html', 'json', 'md', 'tsv', 'xlsx', 'yaml']
+    results = benchmark_export([50], ['md', 'json'], ['diff'], timeout=60)
+    for output_format in ['md', 'json']:
+        format_results = results['scenarios']['diff']['50'][output_format]
+        assert format_results['duration_s'] > 0 and format_results['output_bytes'] > 0
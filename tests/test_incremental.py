@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from pymongo_schema.extract import extract_collection_schema
+from pymongo_schema.incremental import *
+from tests.fake_pymongo import FakeClient
+
+START = datetime(2020, 1, 1)
+DOCUMENTS = [{'_id': ObjectId.from_datetime(START + timedelta(days=i)),
+              'created': START + timedelta(days=i),
+              'a': i if i < 6 else str(i)} for i in range(10)]
+
+
+def test00_encode_decode_watermark_value():
+    for value in [DOCUMENTS[0]['_id'], START, 3, 'x']:
+        encoded_value = encode_watermark_value(value)
+        assert json.loads(json.dumps(encoded_value)) == encoded_value
+        assert decode_watermark_value(encoded_value) == value
+
+
+def test01_extract_collection_schema_incremental():
+    collection = FakeClient({'db': {'coll': DOCUMENTS[:6]}})['db']['coll']
+    schema = extract_collection_schema_incremental(collection)
+    assert schema['watermark'] == {'key': '_id',
+                                   'value': encode_watermark_value(DOCUMENTS[5]['_id'])}
+    expected = extract_collection_schema(collection)
+    assert dict(schema, watermark=None) == dict(expected, watermark=None)
+
+    # Saved as json, then extracted again with new documents
+    schema = json.loads(json.dumps(schema))
+    collection = FakeClient({'db': {'coll': DOCUMENTS}})['db']['coll']
+    schema = extract_collection_schema_incremental(collection, schema)
+    assert schema['count'] == 10
+    assert schema['watermark']['value'] == encode_watermark_value(DOCUMENTS[9]['_id'])
+    assert schema['object'] == extract_collection_schema(collection)['object']
+
+    # Without new documents
+    assert extract_collection_schema_incremental(collection, schema) == schema
+
+
+def test02_extract_pymongo_client_schema_incremental_timestamp():
+    client = FakeClient({'db': {'coll': DOCUMENTS[:3]}})
+    schema = extract_pymongo_client_schema_incremental(client, watermark_key='created')
+    assert schema['db']['coll']['watermark'] == {'key': 'created',
+                                                 'value': encode_watermark_value(START +
+                                                                                 timedelta(days=2))}
+    client = FakeClient({'db': {'coll': DOCUMENTS}})
+    schema = extract_pymongo_client_schema_incremental(client, schema, watermark_key='created',
+                                                       workers=2)
+    assert schema['db']['coll']['count'] == 10
+    assert schema['db']['coll']['object'] == \
+        extract_collection_schema(client['db']['coll'])['object']
+
+    # Previous schema without watermark of this key is replaced
+    schema = extract_pymongo_client_schema_incremental(client, schema)
+    assert schema['db']['coll']['count'] == 10
+
+
+def test03_extract_collection_schema_incremental_dotted_key():
+    documents = [dict(document, meta={'updated_at': document['created']})
+                 for document in DOCUMENTS]
+    collection = FakeClient({'db': {'coll': documents[:4]}})['db']['coll']
+    schema = extract_collection_schema_incremental(collection, watermark_key='meta.updated_at')
+    assert schema['count'] == 4
+    assert schema['watermark']['value'] == encode_watermark_value(START + timedelta(days=3))
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    schema = extract_collection_schema_incremental(collection, schema,
+                                                   watermark_key='meta.updated_at')
+    assert schema['count'] == 10
+    assert schema['object'] == extract_collection_schema(collection)['object']
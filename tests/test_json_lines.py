@@ -0,0 +1,71 @@
+import gzip
+import io
+import os
+
+import pytest
+from bson import ObjectId, json_util
+
+from pymongo_schema.extract import extract_collection_schema
+from pymongo_schema.json_lines import *
+from tests.fake_pymongo import FakeClient
+
+DOCUMENTS = [{'_id': ObjectId(), 'a': i if i % 3 else str(i), 'b': {'c': [1.5, None]}, 'd': []}
+             for i in range(100)] + [{'_id': 1, 'e': True}]
+
+
+def write_json_lines(path, documents=DOCUMENTS):
+    with (gzip.open(path, 'wt') if path.endswith('.gz') else open(path, 'w')) as f:
+        for document in documents:
+            f.write(json_util.dumps(document) + '\n')
+        f.write('\n')
+
+
+@pytest.fixture(scope='module')
+def expected_collection_schema():
+    return extract_collection_schema(FakeClient({'db': {'coll': DOCUMENTS}})['db']['coll'])
+
+
+def test00_json_lines_namespace():
+    assert json_lines_namespace('/exports/shop/users.json.gz') == ('shop', 'users')
+    assert json_lines_namespace('users.2020.ndjson', 'shop') == ('shop', 'users.2020')
+
+
+def test01_iterate_lines():
+    data = b'a\nbb\n\nccc\nd'
+    for chunk_size in range(1, 12):
+        lines = []
+        for start in range(0, len(data), chunk_size):
+            lines += iterate_lines(io.BytesIO(data), start, start + chunk_size)
+        assert lines == [b'a\n', b'bb\n', b'\n', b'ccc\n', b'd']
+
+
+def test02_decode_json_lines():
+    lines = [b'{"a": 1}\n', b' \n', b'{"b": {"$oid": "5f0000000000000000000000"}}']
+    assert list(decode_json_lines(lines)) == [{'a': 1}, {'b': ObjectId('5f0000000000000000000000')}]
+    with pytest.raises(ValueError):
+        list(decode_json_lines([b'{"a": 1']))
+
+
+def test03_extract_json_lines_schema(tmpdir, expected_collection_schema):
+    os.mkdir(str(tmpdir.join('db')))
+    path = str(tmpdir.join('db', 'coll.json'))
+    write_json_lines(path)
+    assert extract_json_lines_schema(path) == {'db': {'coll': expected_collection_schema}}
+    assert extract_json_lines_schema(path, workers=2, chunk_size=1000, shape_cache_size=0) == \
+        {'db': {'coll': expected_collection_schema}}
+
+    gzip_path = str(tmpdir.join('coll.jsonl.gz'))
+    write_json_lines(gzip_path)
+    assert extract_json_lines_schema([gzip_path], 'db') == \
+        {'db': {'coll': expected_collection_schema}}
+
+
+def test04_extract_json_lines_schema_workers_map_detection(tmpdir):
+    path = str(tmpdir.join('coll.json'))
+    write_json_lines(path, [{'by_year': {str(2000 + j): j for j in range(30)}}
+                            for _ in range(100)])
+    for map_detection in [{}, {'map_max_keys': 0, 'map_min_keys': 0}]:
+        schema = extract_json_lines_schema(path, 'db', workers=2, chunk_size=2000,
+                                           **map_detection)
+        assert schema == extract_json_lines_schema(path, 'db', **map_detection)
+    assert len(schema['db']['coll']['object']['by_year']['object']) == 30
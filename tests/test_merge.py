@@ -0,0 +1,124 @@
+import json
+import os
+
+import pytest
+
+from pymongo_schema.compare import compare_schemas_bases
+from pymongo_schema.extract import MAP_KEY, extract_collection_schema
+from pymongo_schema.merge import *
+from tests import TEST_DIR
+from tests.fake_pymongo import FakeClient
+
+DOCUMENTS = [
+    {'a': 1, 'b': [1, {'c': 'x'}], 'd': {'e': None}},
+    {'a': 2.5, 'b': []},
+    {'a': 'x', 'd': {'e': 1, 'f': [1, 2]}},
+    {'b': 'y', 'd': 3},
+]
+
+
+def collection_schema(documents):
+    collection = FakeClient({'db': {'col': documents}})['db']['col']
+    return extract_collection_schema(collection)
+
+
+def test00_merge_collection_schemas():
+    merged = merge_schemas(collection_schema(DOCUMENTS[:2]), collection_schema(DOCUMENTS[2:]))
+    assert merged == collection_schema(DOCUMENTS)
+
+
+def test01_merge_schemas_commutative():
+    schema = collection_schema(DOCUMENTS[:1])
+    other_schema = collection_schema(DOCUMENTS[1:])
+    assert merge_schemas(schema, other_schema) == merge_schemas(other_schema, schema)
+
+
+def test02_merge_schemas_associative():
+    schemas = [collection_schema([document]) for document in DOCUMENTS[:3]]
+    left = merge_schemas(merge_schemas(schemas[0], schemas[1]), schemas[2])
+    right = merge_schemas(schemas[0], merge_schemas(schemas[1], schemas[2]))
+    assert left == right
+
+
+def test03_merge_mongo_schemas():
+    schema = {'db': {'coll': collection_schema(DOCUMENTS[:2])},
+              'db1': {'coll': collection_schema(DOCUMENTS)}}
+    other_schema = {'db': {'coll': collection_schema(DOCUMENTS[2:]),
+                           'coll2': collection_schema(DOCUMENTS)}}
+    expected = {'db': {'coll': collection_schema(DOCUMENTS),
+                       'coll2': collection_schema(DOCUMENTS)},
+                'db1': {'coll': collection_schema(DOCUMENTS)}}
+    assert merge_schemas(schema, other_schema) == expected
+
+
+def test04_merge_schemas_inputs_unchanged():
+    schema = {'db': {'coll': collection_schema(DOCUMENTS)}}
+    merged = merge_schemas(schema, {})
+    merged['db']['coll']['count'] = 0
+    assert schema['db']['coll']['count'] == len(DOCUMENTS)
+
+
+def test05_merge_schemas_without_counts():
+    with pytest.raises(ValueError):
+        merge_schemas({'object': {'a': {'type': 'integer'}}},
+                      {'object': {'a': {'type': 'integer'}}})
+
+
+def test06_merge_schema_file():
+    with open(os.path.join(TEST_DIR, 'resources', 'input', 'test_schema.json')) as f:
+        schema = json.load(f)
+    merged = merge_schemas(schema, schema)
+    assert merged['test_db1']['test_col1']['count'] == 2 * 25359
+    assert merged['test_db1']['test_col1']['object']['grades']['array_types_count'] == {
+        'OBJECT': 2 * 93463, 'null': 2 * 738}
+    assert compare_schemas_bases(schema, merged) == []
+
+
+def test07_merge_sampled_schemas():
+    collection = FakeClient({'db': {'col': DOCUMENTS}})['db']['col']
+    sampled_schema = extract_collection_schema(collection, sample_size=2)
+    merged = merge_schemas(sampled_schema, collection_schema(DOCUMENTS))
+    assert merged['count'] == 2 * len(DOCUMENTS)
+    assert merged['analyzed_count'] == 2 + len(DOCUMENTS)
+    assert merged['sampling'] == 'random'
+    a_count = sampled_schema['object']['a']['count'] + 3
+    assert merged['object']['a']['prop_in_object'] == round(a_count / (2. + len(DOCUMENTS)), 4)
+
+
+def test08_merge_schemas_union_of_fields():
+    documents = [{'by_year': {str(2000 + i): i for i in range(25)}}]
+    collection = FakeClient({'db': {'col': documents}})['db']['col']
+    schema = extract_collection_schema(collection, map_min_keys=0)
+    assert len(merge_schemas(schema, schema)['object']['by_year']['object']) == 25
+    assert list(merge_schemas(schema, schema, map_detection=(1000, 20))['object']['by_year'][
+        'object']) == [MAP_KEY]
+    collapsed_schema = extract_collection_schema(collection)
+    assert list(merge_schemas(schema, collapsed_schema)['object']['by_year']['object']) == \
+        [MAP_KEY]
+
+
+def test09_merge_samplings():
+    documents = [dict(document, _id=i) for i, document in enumerate(DOCUMENTS)]
+    collection = FakeClient({'db': {'col': documents}})['db']['col']
+    schemas = [extract_collection_schema(collection, sample_size=2, sampling=sampling)
+               for sampling in ['random', 'last', 'first', 'last']]
+    left = merge_schemas(merge_schemas(schemas[0], schemas[1]),
+                         merge_schemas(schemas[2], schemas[3]))
+    right = merge_schemas(schemas[2],
+                          merge_schemas(schemas[3], merge_schemas(schemas[1], schemas[0])))
+    assert left['sampling'] == right['sampling'] == 'first, last, random'
+    assert merge_schemas(left, right)['sampling'] == 'first, last, random'
+
+
+def test10_merge_schemas_named_object():
+    schema = {'object': {'object': collection_schema(DOCUMENTS[:2])}}
+    other_schema = {'object': {'object': collection_schema(DOCUMENTS[2:]),
+                               'count': collection_schema(DOCUMENTS)}}
+    expected = {'object': {'object': collection_schema(DOCUMENTS),
+                           'count': collection_schema(DOCUMENTS)}}
+    assert merge_schemas(schema, other_schema) == expected
+    assert merge_schemas(schema['object'], other_schema['object']) == expected['object']
+    assert merge_schemas(schema['object'], other_schema['object'], level='database') == \
+        expected['object']
+    assert schema_level(schema) == 'mongo'
+    assert schema_level(other_schema['object']) == 'database'
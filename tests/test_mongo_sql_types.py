@@ -21,3 +21,12 @@ def test01_common_parent_type():
     assert common_parent_type(['integer', 'float']) == 'number'
     assert common_parent_type(['integer', 'unknown']) == 'general_scalar'
     assert common_parent_type(['integer', 'OBJECT']) == 'mixed_scalar_object'
+
+
+def test02_common_parent_type_table():
+    assert common_parent_type(['boolean', 'biginteger']) == 'biginteger'
+    assert common_parent_type(['oid', 'dbref', 'oid']) == 'string'
+    assert common_parent_type(['boolean', 'float', 'date']) == 'general_scalar'
+    assert common_parent_type(['number', 'mixed_scalar_object']) == 'mixed_scalar_object'
+    for type_string in TYPES_STRING_PARENT:
+        assert COMMON_PARENT_TYPE[type_string, type_string] == type_string
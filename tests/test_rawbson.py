@@ -0,0 +1,69 @@
+import mmap
+from datetime import datetime
+
+import bson
+import pytest
+from bson import ObjectId, Int64, DBRef, Regex, Code, Binary, Timestamp, Decimal128, MinKey, \
+    MaxKey
+
+from pymongo_schema.extract import init_empty_object_schema, add_document_to_object_schema
+from pymongo_schema.rawbson import *
+from tests.fake_pymongo import FakeClient
+
+DOCUMENTS = [
+    {'_id': ObjectId(), 'int': 1, 'long': Int64(2), 'float': 1.5, 'bool': True, 'null': None,
+     'str': u'été', 'date': datetime(2020, 1, 1), 'ts': Timestamp(1, 2),
+     'ref': DBRef('col', 1), 'ref_db': DBRef('col', ObjectId(), 'db'),
+     'not_ref': {'$ref': 1, '$id': 2}, 'regex': Regex('^a', 'i'), 'code': Code('f()'),
+     'code_scope': Code('f()', {'a': 1}), 'bytes': b'\x00\x01', 'binary': Binary(b'ab', 5),
+     'decimal': Decimal128('1.5'), 'min': MinKey(), 'max': MaxKey()},
+    {'int': 'x', 'array': [1, [2, {'a': 1}], {'b': [{'c': 1}]}, None, DBRef('col', 1)],
+     'empty': [], 'obj': {'a': {'b': {}}, 'c': []}},
+    {'array': 1, 'obj': [{'a': 'x'}, {}], 'empty': {}},
+]
+
+
+def python_object_schema(documents):
+    object_schema = init_empty_object_schema()
+    for document in documents:
+        add_document_to_object_schema(document, object_schema)
+    return object_schema
+
+
+def test00_add_bson_documents_to_object_schema():
+    data = b''.join(bson.encode(document) for document in DOCUMENTS)
+    object_schema = init_empty_object_schema()
+    assert add_bson_documents_to_object_schema(data, object_schema) == 3
+    assert object_schema == python_object_schema(DOCUMENTS)
+
+
+def test01_add_bson_documents_with_bounds():
+    data = b'header' + bson.encode(DOCUMENTS[1]) + bson.encode(DOCUMENTS[2]) + b'footer'
+    object_schema = init_empty_object_schema()
+    assert add_bson_documents_to_object_schema(data, object_schema, 6, len(data) - 6) == 2
+    assert object_schema == python_object_schema(DOCUMENTS[1:])
+
+
+def test02_add_bson_documents_from_mmap(tmpdir):
+    path = tmpdir.join('documents.bson')
+    path.write_binary(b''.join(bson.encode(document) for document in DOCUMENTS))
+    with open(str(path), 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        object_schema = init_empty_object_schema()
+        add_bson_documents_to_object_schema(data, object_schema)
+        data.close()
+    assert object_schema == python_object_schema(DOCUMENTS)
+
+
+def test03_skip_bson_value_unknown_type():
+    with pytest.raises(ValueError):
+        skip_bson_value(b'\x00', 0x42, 0)
+
+
+def test04_scan_raw_batches_filtered_sample():
+    documents = [{'_id': i, 'a': i if i < 10 else str(i)} for i in range(20)]
+    collection = FakeClient({'db': {'coll': documents}})['db']['coll']
+    object_schema = init_empty_object_schema()
+    assert scan_raw_batches(collection, object_schema, sample_size=5,
+                            query={'_id': {'$lt': 10}}) == 5
+    assert object_schema == python_object_schema(documents[:10:2])
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from pymongo_schema.sampling import *
+from tests.fake_pymongo import FakeClient
+
+DOCUMENTS = [{'_id': i, 'a': i % 3} for i in range(100)]
+
+
+def fake_collection(documents):
+    return FakeClient({'db': {'coll': documents}})['db']['coll']
+
+
+def test00_interpolate_boundaries():
+    assert interpolate_boundaries(0, 10, 4) == [0, 2.5, 5., 7.5]
+    assert interpolate_boundaries(3, 3, 4) == [3]
+    assert interpolate_boundaries(datetime(2020, 1, 1), datetime(2020, 1, 3), 2) == \
+        [datetime(2020, 1, 1), datetime(2020, 1, 2)]
+    lower = ObjectId.from_datetime(datetime(2020, 1, 1))
+    upper = ObjectId.from_datetime(datetime(2020, 1, 3))
+    assert interpolate_boundaries(lower, upper, 2) == \
+        [lower, ObjectId.from_datetime(datetime(2020, 1, 2))]
+    assert interpolate_boundaries('a', 'b', 2) is None
+    assert interpolate_boundaries(True, 2, 2) is None
+
+
+def test01_sample_stratified():
+    documents = list(sample_stratified(fake_collection(DOCUMENTS), 10, strata=5))
+    assert [document['_id'] for document in documents] == [0, 1, 20, 21, 40, 41, 60, 61, 80, 81]
+    documents = list(sample_stratified(fake_collection(DOCUMENTS), 3, strata=5))
+    assert [document['_id'] for document in documents] == [0, 20, 40]
+    documents = list(sample_stratified(fake_collection(DOCUMENTS), 4, query={'_id': {'$lt': 50}},
+                                       strata=2))
+    assert [document['_id'] for document in documents] == [0, 1, 25, 26]
+    assert list(sample_stratified(fake_collection([]), 10)) == []
+
+
+def test02_sample_stratified_not_interpolable():
+    documents = [{'_id': str(i)} for i in range(10)]
+    assert len(list(sample_stratified(fake_collection(documents), 5))) == 5
+
+
+def test03_sample_reservoir():
+    documents = sample_reservoir(fake_collection(DOCUMENTS), 10)
+    assert len(documents) == 10
+    assert len(set(document['_id'] for document in documents)) == 10
+    documents = sample_reservoir(fake_collection(DOCUMENTS), 10, scan_size=20)
+    assert all(document['_id'] < 20 for document in documents)
+    assert len(sample_reservoir(fake_collection(DOCUMENTS[:5]), 10)) == 5
+
+
+def test04_sample_first_last():
+    collection = fake_collection(DOCUMENTS[::-1])
+    assert [doc['_id'] for doc in sample_first(collection, 3)] == [0, 1, 2]
+    assert [doc['_id'] for doc in sample_last(collection, 3)] == [99, 98, 97]
+    assert [doc['_id'] for doc in sample_first(collection, 3, key='$natural')] == [99, 98, 97]
+    assert [doc['_id'] for doc in sample_last(collection, 2, query={'_id': {'$lt': 50}})] == \
+        [49, 48]
+
+
+def test05_sample_documents():
+    collection = fake_collection(DOCUMENTS)
+    assert len(list(sample_documents(collection, 5))) == 5
+    assert len(list(sample_documents(collection, 5, strategy='stratified', strata=2))) == 5
+    with pytest.raises(ValueError):
+        sample_documents(collection, 5, strategy='systematic')
+
+
+def test06_first_key_value_dotted_key():
+    documents = [{'_id': i, 'meta': {'updated_at': 10 - i}} for i in range(5)] + [{'_id': 5}]
+    collection = fake_collection(documents)
+    assert first_key_value(collection, {}, 'meta.updated_at', 1) == 6
+    assert first_key_value(collection, {'_id': {'$lt': 3}}, 'meta.updated_at', -1) == 10
+    assert first_key_value(collection, {}, 'meta.created_at', -1) is None
+    assert [doc['_id'] for doc in sample_stratified(collection, 2, key='meta.updated_at',
+                                                    strata=2)] == [4, 2]
+    with pytest.raises(KeyError):
+        get_key_value({'meta': [{'updated_at': 1}]}, 'meta.updated_at')
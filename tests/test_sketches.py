@@ -0,0 +1,98 @@
+import json
+import random
+
+from bson import ObjectId
+
+from pymongo_schema.sketches import *
+
+
+def test00_hash_value():
+    assert hash_value('1') == hash_value('1')
+    assert hash_value('1') != hash_value(1)
+    assert hash_value(ObjectId('5f0000000000000000000000')) == \
+        hash_value(ObjectId('5f0000000000000000000000'))
+    assert 0 <= hash_value(2.5) < 2 ** 64
+
+
+def test01_hyperloglog():
+    hll, other_hll = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        hll.add_hash(hash_value(i))
+        other_hll.add_hash(hash_value(i + 10000))
+    assert abs(hll.estimate() - 20000) < 20000 * 0.05
+    hll.merge(other_hll)
+    assert abs(hll.estimate() - 30000) < 30000 * 0.05
+
+    small_hll = HyperLogLog()
+    for value in ['a', 'b', 'c', 'a']:
+        small_hll.add_hash(hash_value(value))
+    assert small_hll.estimate() == 3
+    assert HyperLogLog.from_dict(json.loads(json.dumps(hll.to_dict()))).registers == hll.registers
+
+
+def test02_kll_sketch():
+    values = list(range(100000))
+    random.Random(0).shuffle(values)
+    kll, other_kll = KLLSketch(), KLLSketch()
+    for value in values[:50000]:
+        kll.add(value)
+    for value in values[50000:]:
+        other_kll.add(value)
+    assert kll.size < 4 * kll.k
+    kll.merge(KLLSketch.from_dict(json.loads(json.dumps(other_kll.to_dict()))))
+    for percentile, value in kll.percentiles().items():
+        assert abs(value - 1000 * int(percentile)) < 100000 * 0.03
+
+    small_kll = KLLSketch()
+    for value in [3, 1, 2]:
+        small_kll.add(value)
+    assert small_kll.percentiles([0, 50, 100]) == {'0': 1, '50': 2, '100': 3}
+    assert KLLSketch().percentiles() == {}
+
+
+def test03_value_stats():
+    value_stats = ValueStats()
+    for value in [1, 2.5, True, float('nan'), None, 'abc', '', ObjectId()]:
+        value_stats.add(value)
+    value_stats_dict = value_stats.to_dict()
+    assert value_stats_dict['count'] == 8
+    assert value_stats_dict['null_count'] == 1
+    assert value_stats_dict['distinct_count'] == 7
+    assert (value_stats_dict['min'], value_stats_dict['max']) == (1, 2.5)
+    assert (value_stats_dict['length_min'], value_stats_dict['length_max']) == (0, 3)
+
+    other_value_stats = ValueStats()
+    other_value_stats.add(-1)
+    other_value_stats.merge(ValueStats.from_dict(json.loads(json.dumps(value_stats_dict))))
+    assert other_value_stats.to_dict()['min'] == -1
+    assert other_value_stats.to_dict()['distinct_count'] == 8
+    assert other_value_stats.to_dict()['length_max'] == 3
+
+
+def test04_frequent_values():
+    values = ['a'] * 50 + ['b'] * 30 + ['c'] * 10 + ['u{}'.format(i) for i in range(200)]
+    random.Random(0).shuffle(values)
+    frequent_values, other_frequent_values = FrequentValues(2, 10), FrequentValues(2, 10)
+    for value in values[:150]:
+        frequent_values.add(value)
+    for value in values[150:]:
+        other_frequent_values.add(value)
+    assert len(frequent_values.counters) <= 10
+    frequent_values.merge(FrequentValues.from_dict(
+        json.loads(json.dumps(other_frequent_values.to_dict()))))
+    assert len(frequent_values.counters) <= 10
+    assert [value for value, _ in frequent_values.top()] == ['a', 'b']
+    for value, count in frequent_values.top():
+        assert count <= values.count(value) <= count + frequent_values.error
+
+    value_stats = ValueStats(top_values=2)
+    for value in [1, 1, '1', True, 2.5, None]:
+        value_stats.add(value)
+    assert value_stats.to_dict()['top_values'] == [[1, 2], ['1', 1]]
+    assert 'top_values' not in ValueStats().to_dict()
+
+    # Long strings are counted by their prefix
+    frequent_values = FrequentValues(2)
+    for value in ['x' * 1000 + str(i) for i in range(3)] + ['y']:
+        frequent_values.add(value)
+    assert frequent_values.top() == [['x' * MAX_TOP_VALUE_LENGTH + TRUNCATED_SUFFIX, 3], ['y', 1]]
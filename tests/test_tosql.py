@@ -173,3 +173,24 @@ def test11_schema_from_code_to_mapping():
     with open(os.path.join(TEST_DIR, 'resources', 'expected', 'mapping_from_code.json')) as f:
         exp_mapping = json.load(f)
     assert mongo_schema_to_mapping(schema) == exp_mapping
+
+
+def test12_mongo_schema_to_mapping_skips_map_like_object(simple_schema):
+    schema = {'db': {'coll': {
+        'count': 2,
+        'object': {
+            '_id': simple_schema['object']['_id'],
+            'scores': {'types_count': {'OBJECT': 2}, 'count': 2, 'type': 'OBJECT',
+                       'prop_in_object': 1.0,
+                       'object': {'<key>': {'types_count': {'integer': 40}, 'count': 40,
+                                            'type': 'integer', 'prop_in_object': 1.0}}},
+            'items': {'types_count': {'ARRAY': 2}, 'count': 2, 'type': 'ARRAY',
+                      'prop_in_object': 1.0, 'array_types_count': {'OBJECT': 2},
+                      'array_type': 'OBJECT',
+                      'object': {'<key>': {'types_count': {'string': 40}, 'count': 40,
+                                           'type': 'string', 'prop_in_object': 1.0}}}}}}}
+    res = mongo_schema_to_mapping(schema)
+    exp = {'db': {'coll': {'pk': '_id', '_id': {'type': 'TEXT', 'dest': '_id'},
+                           'items': {'dest': 'coll__items', 'fk': 'id_coll', 'type': '_ARRAY'}},
+                  'coll__items': {'pk': '_id_postgres', 'id_coll': {'type': 'TEXT'}}}}
+    assert res == exp
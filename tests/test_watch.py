@@ -0,0 +1,76 @@
+from pymongo_schema.extract import extract_collection_schema
+from pymongo_schema.watch import *
+from tests.fake_pymongo import FakeClient
+
+DOCUMENTS = [{'_id': 1, 'a': 1}, {'_id': 2, 'a': 'x', 'b': [1.5]}, {'_id': 1, 'a': 2, 'c': {}}]
+
+EVENTS = [
+    {'operationType': 'insert', 'ns': {'db': 'db', 'coll': 'coll'}, 'fullDocument': DOCUMENTS[0]},
+    {'operationType': 'insert', 'ns': {'db': 'db', 'coll': 'coll'}, 'fullDocument': DOCUMENTS[1]},
+    {'operationType': 'delete', 'ns': {'db': 'db', 'coll': 'coll'}, 'documentKey': {'_id': 2}},
+    {'operationType': 'update', 'ns': {'db': 'db', 'coll': 'coll'}, 'fullDocument': DOCUMENTS[2]},
+    {'operationType': 'update', 'ns': {'db': 'db', 'coll': 'coll'}, 'fullDocument': None},
+    {'operationType': 'replace', 'ns': {'db': 'db', 'coll': 'other'}, 'fullDocument': {'d': 1}},
+]
+
+
+def collection_schema(documents):
+    return extract_collection_schema(FakeClient({'db': {'coll': documents}})['db']['coll'])
+
+
+class FakeChangeStream(object):
+    """Stand-in for pymongo.change_stream.ChangeStream, without events once in a while"""
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.polls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def alive(self):
+        return bool(self.events)
+
+    def try_next(self):
+        self.polls += 1
+        if self.polls % 2:
+            return None
+        return self.events.pop(0)
+
+
+def test00_schema_watcher():
+    watcher = SchemaWatcher()
+    assert [watcher.add_event(event) for event in EVENTS] == [True, True, False, True, False, True]
+    assert (watcher.events, watcher.added) == (6, 4)
+    assert watcher.get_schema() == {'db': {'coll': collection_schema(DOCUMENTS),
+                                           'other': collection_schema([{'d': 1}])}}
+
+
+def test01_schema_watcher_initial_schema():
+    watcher = SchemaWatcher({'db': {'coll': collection_schema(DOCUMENTS[:1])}}, shape_cache_size=0)
+    for event in EVENTS[1:4]:
+        watcher.add_event(event)
+    assert watcher.get_schema() == {'db': {'coll': collection_schema(DOCUMENTS)}}
+
+
+def test02_watch_schema():
+    flushed = []
+    mongo_schema = watch_schema(EVENTS, flushed.append, flush_interval=0)
+    assert len(flushed) == len(EVENTS)
+    assert flushed[-1] == mongo_schema
+    assert flushed[0] == {'db': {'coll': collection_schema(DOCUMENTS[:1])}}
+
+    assert watch_schema(EVENTS, max_events=2) == {'db': {'coll': collection_schema(DOCUMENTS[:2])}}
+
+
+def test03_watch_schema_change_stream():
+    change_stream = FakeChangeStream(EVENTS)
+    flushed = []
+    mongo_schema = watch_schema(change_stream, flushed.append, flush_interval=0)
+    assert change_stream.polls == 2 * len(EVENTS)
+    assert len(flushed) == 2 * len(EVENTS)
+    assert mongo_schema == watch_schema(EVENTS)